@@ -9,21 +9,30 @@ and be served by Gunicorn in production.
 import os
 import json
 import logging
-from flask import Flask, request, jsonify
+import hmac
+import uuid
+from functools import wraps
+from flask import Flask, request, jsonify, send_file
 from telegram import Update
 from telegram.ext import Dispatcher
 import settings
-from bot import setup_handlers
+from bot import setup_handlers, make_persistence, configure_logging, membership_scheduler, membership_cache, task_catalog, send_queue, notification_bus, publish_twitter_status, user_cache, task_renderer, wallet_index, referral_index, sybil_detector, submission_index, submission_status_index, publish_submission_status
 from bot_fixed import force_clear_updates
+from lib.db import pool_status
+from lib.metrics import metrics
+from lib import log
+from lib.update_queue import UpdateQueue, route_dispatcher_updates
+from lib.broadcast import Broadcast, get_status as get_broadcast_status, request_stop as request_broadcast_stop
+from lib.payout_export import FORMATS as PAYOUT_FORMATS, create_export, export_path, find_export
+from lib.moderation import ACTIONS, list_twitter_verifications, apply_twitter_decisions, list_sybil_flags, SubmissionModeration, TaskBackendError
+from lib.submissions import list_collisions
+from lib.submission_status import STATUSES as SUBMISSION_STATUSES
 from telegram.ext import Updater
 import threading
 import time
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Structured logging; records are written by a background thread
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Create Flask application
@@ -34,10 +43,14 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 bot = None
 dispatcher = None
 updater = None
+update_queue = None
+
+# Task submissions are moderated on the task backend that stores them
+submission_moderation = SubmissionModeration(settings.TASKS_API_URL)
 
 def initialize_bot():
     """Initialize the Telegram bot and dispatcher."""
-    global bot, dispatcher, updater
+    global bot, dispatcher, updater, update_queue
     
     try:
         logger.info("Initializing Telegram bot...")
@@ -49,10 +62,12 @@ def initialize_bot():
         # Create updater and get bot and dispatcher
         updater = Updater(
             settings.TELEGRAM_TOKEN,
+            base_url=f'{settings.TELEGRAM_API_URL}/bot',
             request_kwargs={
                 'connect_timeout': 60.0,
                 'read_timeout': 60.0,
             },
+            persistence=make_persistence(),
             use_context=True
         )
         
@@ -62,6 +77,17 @@ def initialize_bot():
         # Setup handlers
         setup_handlers(dispatcher)
         
+        # Webhook mode never calls start_polling, so run scheduled jobs explicitly
+        updater.job_queue.start()
+        
+        # Updates are processed off the request thread, in order per user
+        update_queue = UpdateQueue(
+            dispatcher.process_update,
+            workers=settings.UPDATE_WORKERS,
+            max_size=settings.UPDATE_QUEUE_SIZE
+        )
+        update_queue.start()
+        
         logger.info("Bot initialized successfully")
         return True
         
@@ -102,14 +128,46 @@ def health_check():
         'status': 'healthy',
         'service': 'AirdropBot V2',
         'bot_status': bot_status,
+        'membership_checks': membership_scheduler.stats(),
+        'membership_cache': membership_cache.stats(),
+        'task_catalog': task_catalog.stats(),
+        'task_renderer': task_renderer.stats(),
+        'db_pool': pool_status(),
+        'update_queue': update_queue.stats() if update_queue else None,
+        'send_queue': send_queue.stats(),
+        'notification_bus': notification_bus.stats(),
+        'user_cache': user_cache.stats(),
+        'wallet_index': wallet_index.stats(),
+        'referral_index': referral_index.stats(),
+        'sybil': sybil_detector.stats(),
+        'submission_index': submission_index.stats(),
+        'submission_status': submission_status_index.stats(),
+        'logging': log.stats(),
+        'persistence': dispatcher.persistence.stats() if dispatcher and hasattr(dispatcher.persistence, 'stats') else None,
         'timestamp': time.time()
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """p50/p95/p99 latency per handler and per dependency, in the Prometheus text format."""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/leaderboard')
+def leaderboard():
+    """Top referrers, served from the in-memory referral index."""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), settings.LEADERBOARD_SIZE)
+    return jsonify({
+        'leaderboard': [
+            {'rank': rank, 'telegram_id': referrer_id, 'referrals': count}
+            for rank, (referrer_id, count) in enumerate(referral_index.leaderboard(limit), 1)
+        ]
+    })
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming Telegram webhooks."""
     try:
-        if not bot or not dispatcher:
+        if not bot or not dispatcher or not update_queue:
             logger.error("Bot not initialized")
             return jsonify({'error': 'Bot not initialized'}), 500
         
@@ -124,9 +182,13 @@ def webhook():
         update = Update.de_json(json_data, bot)
         
         if update:
-            # Process the update
-            dispatcher.process_update(update)
-            logger.info(f"Processed update: {update.update_id}")
+            # Queue the update and acknowledge right away
+            if not update_queue.submit(update):
+                logger.warning(f"Update queue full, asking Telegram to retry update {update.update_id}")
+                response = jsonify({'error': 'Too many pending updates'})
+                response.headers['Retry-After'] = str(settings.WEBHOOK_RETRY_AFTER)
+                return response, 503
+            logger.info(f"Queued update: {update.update_id}")
             return jsonify({'status': 'ok'})
         else:
             logger.warning("Failed to create Update object from JSON")
@@ -180,6 +242,301 @@ def webhook_info():
         logger.error(f"Error getting webhook info: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def require_admin(view):
+    """Protect admin routes with the X-Admin-Token header."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not settings.ADMIN_API_TOKEN or not hmac.compare_digest(token, settings.ADMIN_API_TOKEN):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.route('/admin/broadcast', methods=['POST'])
+@require_admin
+def start_broadcast():
+    """Start a broadcast to all matching users, or resume the one with the given id.
+
+    A resumed broadcast keeps its stored text and filters. If another worker
+    is still sending it, its status is returned unchanged.
+    """
+    try:
+        if not bot:
+            return jsonify({'error': 'Bot not initialized'}), 500
+        
+        data = request.get_json() or {}
+        broadcast_id = str(data.get('id') or uuid.uuid4().hex)
+        if not broadcast_id.isalnum() or len(broadcast_id) > 64:
+            return jsonify({'error': 'id must be alphanumeric, at most 64 characters'}), 400
+        
+        try:
+            broadcast = Broadcast(
+                broadcast_id, bot, send_queue, data.get('text'),
+                filters=data.get('filters'),
+                parse_mode=data.get('parse_mode'),
+                batch_size=settings.BROADCAST_BATCH_SIZE,
+                lease_seconds=settings.BROADCAST_LEASE_SECONDS
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if broadcast.start() is False:
+            return jsonify({'error': 'text is required'}), 400
+        return jsonify(get_broadcast_status(broadcast_id)), 202
+    except Exception as e:
+        logger.error(f"Error starting broadcast: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/broadcast/<broadcast_id>', methods=['GET'])
+@require_admin
+def broadcast_status(broadcast_id):
+    """Progress and throughput of a broadcast, as of its last checkpoint."""
+    status = get_broadcast_status(broadcast_id)
+    if status is None:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify(status)
+
+@app.route('/admin/broadcast/<broadcast_id>/stop', methods=['POST'])
+@require_admin
+def stop_broadcast(broadcast_id):
+    """Stop a running broadcast after its current batch, on whichever worker sends it; it can be resumed later."""
+    status = request_broadcast_stop(broadcast_id)
+    if status is None:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify(status)
+
+@app.route('/admin/payouts/export', methods=['POST'])
+@require_admin
+def start_payout_export():
+    """Start exporting the payout list to a file in the background."""
+    try:
+        data = request.get_json() or {}
+        fmt = data.get('format', 'csv')
+        if fmt not in PAYOUT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(PAYOUT_FORMATS)}"}), 400
+        
+        export_id = uuid.uuid4().hex
+        path = export_path(settings.PAYOUT_EXPORT_DIR, export_id, fmt)
+        export = create_export(path, fmt, include_tasks=data.get('include_tasks', True),
+                               include_flagged=data.get('include_flagged', False))
+        export.start()
+        return jsonify(dict(export.status(), id=export_id)), 202
+    except Exception as e:
+        logger.error(f"Error starting payout export: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/payouts/export/<export_id>', methods=['GET'])
+@require_admin
+def payout_export_status(export_id):
+    """Progress of a payout export, from its status file; includes the sha256 once it has completed."""
+    status = find_export(settings.PAYOUT_EXPORT_DIR, export_id) if export_id.isalnum() else None
+    if status is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify(dict(status, id=export_id))
+
+@app.route('/admin/payouts/export/<export_id>/download', methods=['GET'])
+@require_admin
+def download_payout_export(export_id):
+    """Download a completed payout export."""
+    status = find_export(settings.PAYOUT_EXPORT_DIR, export_id) if export_id.isalnum() else None
+    if status is None:
+        return jsonify({'error': 'Export not found'}), 404
+    if status['state'] != 'completed':
+        return jsonify({'error': f"Export is {status['state']}"}), 409
+    response = send_file(os.path.abspath(status['path']), as_attachment=True)
+    response.headers['X-Checksum-SHA256'] = status['sha256']
+    return response
+
+@app.route('/admin/wallets/revalidate', methods=['POST'])
+@require_admin
+def revalidate_wallets():
+    """Re-check every stored wallet and rebuild the duplicate index in the background; poll GET for the counts."""
+    threading.Thread(target=wallet_index.revalidate, name='wallet-revalidate', daemon=True).start()
+    return jsonify(wallet_index.stats()), 202
+
+@app.route('/admin/wallets/revalidate', methods=['GET'])
+@require_admin
+def wallet_revalidation_status():
+    """Counts (and a sample) of invalid and shared wallets found by the last revalidation."""
+    return jsonify(wallet_index.stats())
+
+@app.route('/admin/sybil/scan', methods=['POST'])
+@require_admin
+def start_sybil_scan():
+    """Rescore every user in the background and replace the sybil flags; poll GET for the result."""
+    threading.Thread(target=sybil_detector.run, name='sybil-scan', daemon=True).start()
+    return jsonify(sybil_detector.stats()), 202
+
+@app.route('/admin/sybil/scan', methods=['GET'])
+@require_admin
+def sybil_scan_status():
+    """Summary of the last sybil scoring run."""
+    return jsonify(sybil_detector.stats())
+
+@app.route('/admin/sybil_flags', methods=['GET'])
+@require_admin
+def sybil_flags():
+    """Page through flagged users using a keyset cursor."""
+    try:
+        after = request.args.get('cursor', type=int)
+        min_score = request.args.get('min_score', 0.0, type=float)
+        limit = min(request.args.get('limit', 100, type=int), settings.MODERATION_PAGE_SIZE_MAX)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        items, next_cursor = list_sybil_flags(after=after, limit=limit, min_score=min_score)
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error listing sybil flags: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/submissions/collisions', methods=['GET'])
+@require_admin
+def submission_collisions():
+    """Page through task proofs reused across accounts, oldest first, using a keyset cursor."""
+    try:
+        after = request.args.get('cursor', type=int)
+        limit = min(request.args.get('limit', 100, type=int), settings.MODERATION_PAGE_SIZE_MAX)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        items, next_cursor = list_collisions(after=after, limit=limit)
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error listing submission collisions: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/submissions/status', methods=['POST'])
+@require_admin
+def submission_status_hook():
+    """Called by the task backend after moderation, so /tasks shows decisions and users are notified."""
+    try:
+        data = request.get_json() or {}
+        updates = data.get('updates') or []
+        if not isinstance(updates, list) or len(updates) > settings.MODERATION_BATCH_MAX:
+            return jsonify({'error': f'updates must be a list of at most {settings.MODERATION_BATCH_MAX} items'}), 400
+        for item in updates:
+            if not isinstance(item, dict) or not isinstance(item.get('telegram_id'), int) \
+                    or item.get('task_id') is None or item.get('status') not in SUBMISSION_STATUSES:
+                return jsonify({
+                    'error': f"each update needs an integer telegram_id, a task_id and a status in: {', '.join(SUBMISSION_STATUSES)}"
+                }), 400
+        
+        for item in updates:
+            publish_submission_status(item['telegram_id'], item['task_id'], item['status'])
+        return jsonify({'status': 'ok', 'published': len(updates)})
+    except Exception as e:
+        logger.error(f"Error publishing submission statuses: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/twitter_verifications', methods=['GET'])
+@require_admin
+def twitter_verifications():
+    """Page through users by X verification status using a keyset cursor."""
+    try:
+        status = request.args.get('status', 'pending')
+        after = request.args.get('cursor', type=int)
+        limit = min(request.args.get('limit', 100, type=int), settings.MODERATION_PAGE_SIZE_MAX)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        items, next_cursor = list_twitter_verifications(status=status, after=after, limit=limit)
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Error listing twitter verifications: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/twitter_verifications/bulk', methods=['POST'])
+@require_admin
+def bulk_twitter_verifications():
+    """Approve or reject many pending X verifications at once; users are notified asynchronously."""
+    try:
+        data = request.get_json() or {}
+        action = data.get('action')
+        telegram_ids = data.get('telegram_ids') or []
+        
+        if action not in ACTIONS:
+            return jsonify({'error': f"action must be one of: {', '.join(ACTIONS)}"}), 400
+        if not isinstance(telegram_ids, list) or not all(isinstance(i, int) for i in telegram_ids):
+            return jsonify({'error': 'telegram_ids must be a list of integers'}), 400
+        if len(telegram_ids) > settings.MODERATION_BATCH_MAX:
+            return jsonify({'error': f'At most {settings.MODERATION_BATCH_MAX} ids per request'}), 400
+        
+        changed, not_announced = apply_twitter_decisions(
+            telegram_ids, action, publish_twitter_status,
+            reason=data.get('reason'),
+            chunk_size=settings.MODERATION_UPDATE_CHUNK,
+            publish_timeout=settings.MODERATION_PUBLISH_TIMEOUT
+        )
+        return jsonify({
+            'status': 'ok',
+            'requested': len(telegram_ids),
+            'updated': len(changed),
+            # ids that were not pending (already decided or unknown) are left untouched
+            'skipped': len(set(telegram_ids)) - len(changed),
+            # updated, but the user was not notified (the notification bus stayed full)
+            'not_notified': len(not_announced)
+        })
+    except Exception as e:
+        logger.error(f"Error applying twitter verifications: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/submissions', methods=['GET'])
+@require_admin
+def task_submissions():
+    """Page through task submissions by status using a keyset cursor (served by the task backend)."""
+    try:
+        status = request.args.get('status', 'pending')
+        after = request.args.get('cursor', type=int)
+        limit = min(request.args.get('limit', 100, type=int), settings.MODERATION_PAGE_SIZE_MAX)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        items, next_cursor = submission_moderation.list(status=status, after=after, limit=limit)
+        return jsonify({'items': items, 'next_cursor': next_cursor})
+    except TaskBackendError as e:
+        logger.error(f"Error listing task submissions: {e}")
+        return jsonify({'error': 'Task backend error'}), 502
+    except Exception as e:
+        logger.error(f"Error listing task submissions: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/submissions/bulk', methods=['POST'])
+@require_admin
+def bulk_task_submissions():
+    """Approve or reject many pending task submissions at once; users are notified asynchronously."""
+    try:
+        data = request.get_json() or {}
+        action = data.get('action')
+        submission_ids = data.get('submission_ids') or []
+        
+        if action not in ACTIONS:
+            return jsonify({'error': f"action must be one of: {', '.join(ACTIONS)}"}), 400
+        if not isinstance(submission_ids, list) or not all(isinstance(i, int) for i in submission_ids):
+            return jsonify({'error': 'submission_ids must be a list of integers'}), 400
+        if len(submission_ids) > settings.MODERATION_BATCH_MAX:
+            return jsonify({'error': f'At most {settings.MODERATION_BATCH_MAX} ids per request'}), 400
+        
+        changed, not_announced = submission_moderation.apply(
+            submission_ids, action, publish_submission_status,
+            publish_timeout=settings.MODERATION_PUBLISH_TIMEOUT
+        )
+        return jsonify({
+            'status': 'ok',
+            'requested': len(submission_ids),
+            'updated': len(changed),
+            # submissions that were not pending (already decided or unknown) are left untouched
+            'skipped': len(set(submission_ids)) - len(changed),
+            # updated, but the user was not notified (the notification bus stayed full)
+            'not_notified': len(not_announced)
+        })
+    except TaskBackendError as e:
+        logger.error(f"Error applying task submission decisions: {e}")
+        return jsonify({'error': 'Task backend error'}), 502
+    except Exception as e:
+        logger.error(f"Error applying task submission decisions: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -200,16 +557,17 @@ if __name__ != '__main__':
 
 if __name__ == '__main__':
     # Development mode - run with Flask dev server
-    print("Starting AirdropBot V2 in development mode...")
+    logger.info("Starting AirdropBot V2 in development mode...")
     
     if initialize_bot():
-        print("Bot initialized successfully")
+        logger.info("Bot initialized successfully")
         
         # In development, we can use polling instead of webhooks
         use_polling = os.environ.get('USE_POLLING', 'true').lower() == 'true'
         
         if use_polling:
-            print("Starting polling mode for development...")
+            logger.info("Starting polling mode for development...")
+            route_dispatcher_updates(dispatcher, update_queue)
             # Start polling in a separate thread
             def start_polling():
                 updater.start_polling(
@@ -226,5 +584,5 @@ if __name__ == '__main__':
         # Start Flask app
         app.run(host='0.0.0.0', port=5000, debug=True)
     else:
-        print("Failed to initialize bot")
+        logger.error("Failed to initialize bot")
         exit(1)
\ No newline at end of file
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the hot bot.py handlers, with JSON baselines.
+
+Each handler is called directly with fake ``update`` / ``context`` objects
+against an in-memory SQLite database. HTTP is mocked below ``requests``
+(a transport adapter mounted on the bot's sessions answers getChatMember,
+``/tasks`` and ``/user_submissions``), so the clients' own code still
+runs. Outgoing messages are captured instead of going through the send
+queue. Every benchmark checks the handler's first result and reply, so a
+broken handler fails the run instead of timing its error path.
+
+    python benchmarks/bench_handlers.py --save baseline.json
+    python benchmarks/bench_handlers.py --compare baseline.json --threshold 0.2
+
+``--compare`` exits with 1 when a benchmark is more than ``--threshold``
+(relative) slower than in the baseline.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never benchmark against a real database or API
+os.environ.update(
+    DATABASE_URL='sqlite://',
+    PERSISTENCE_BACKEND='',
+    TELEGRAM_TOKEN='123456:bench',
+    TELEGRAM_API_URL='http://telegram.bench',
+    TASKS_API_URL='http://tasks.bench/api',
+    LOG_LEVEL='WARNING',
+    LOG_FILE='',
+)
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import bot
+from lib.db import engine
+from lib.models import users_data
+from lib.schema import create_tables
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+class FakeHTTPAdapter(BaseAdapter):
+    """Transport answering the Bot API and task backend calls the handlers make"""
+
+    def __init__(self, tasks=20):
+        super().__init__()
+        self.catalog = json.dumps({'tasks': [{
+            'id': task_id,
+            'title': f'Task number {task_id}',
+            'description': 'Like and retweet the pinned post, then share the link.',
+            'task_type': ('twitter', 'telegram', 'discord')[task_id % 3],
+            'requirements': 'Public account' if task_id % 2 else '',
+        } for task_id in range(1, tasks + 1)]}).encode('utf-8')
+        self.calls = 0
+
+    def _response(self, request, status, body=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.headers = CaseInsensitiveDict(headers or {'Content-Type': 'application/json'})
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        path = request.path_url.split('?', 1)[0]
+        if path.endswith('/getChatMember'):
+            return self._response(request, 200, b'{"ok": true, "result": {"status": "member"}}')
+        if path.endswith('/tasks'):
+            if request.headers.get('If-None-Match') == '"catalog-v1"':
+                return self._response(request, 304, headers={'ETag': '"catalog-v1"'})
+            return self._response(request, 200, self.catalog, {'ETag': '"catalog-v1"'})
+        if '/user_submissions/' in path:
+            return self._response(request, 200, b'{"success": true, "submissions": []}')
+        return self._response(request, 404, b'{"error": "Not found"}')
+
+    def close(self):
+        pass
+
+
+class CapturingSendQueue(object):
+    """Stands in for lib.send_queue.SendQueue: counts messages, sends nothing"""
+
+    def __init__(self):
+        self.submitted = 0
+        self.last_text = None
+
+    def submit(self, chat_id, fn, args=(), kwargs=None, priority=0):
+        self.submitted += 1
+        self.last_text = args[0] if args else (kwargs or {}).get('text')
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def fake_user(user_id):
+    return SimpleNamespace(id=user_id, username=f'bench{user_id}', first_name='Bench', is_bot=False)
+
+
+def fake_update(user_id, text):
+    message = SimpleNamespace(chat_id=user_id, text=text, from_user=fake_user(user_id), reply_text=_noop)
+    return SimpleNamespace(message=message, callback_query=None, effective_user=message.from_user)
+
+
+def fake_query(user_id, data):
+    message = SimpleNamespace(chat_id=user_id, text='...', reply_text=_noop)
+    return SimpleNamespace(data=data, from_user=fake_user(user_id), message=message, answer=_noop,
+                           edit_message_text=_noop)
+
+
+def fake_context(user_id):
+    return SimpleNamespace(bot=SimpleNamespace(send_chat_action=_noop, send_message=_noop),
+                           user_data={'user_id': user_id}, chat_data={}, bot_data={})
+
+
+def random_wallet():
+    number = int.from_bytes(os.urandom(32), 'big')
+    text = ''
+    while number:
+        number, digit = divmod(number, 58)
+        text = ALPHABET[digit] + text
+    return text.rjust(32, '1')
+
+
+def install_fakes(tasks):
+    # The in-memory database starts empty
+    users_data.__table__.create(engine, checkfirst=True)
+    create_tables()
+    adapter = FakeHTTPAdapter(tasks)
+    for session in (bot.tasks_http, bot.task_catalog._http, bot.membership_client._http):
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    bot.send_queue = CapturingSendQueue()
+    return adapter
+
+
+def registered_users(count, step):
+    """Create ``count`` users at registration ``step``; returns their ids"""
+    ids = [next(_user_ids) for _ in range(count)]
+    for user_id in ids:
+        fields = {'telegram_verified': step > 1, 'twitter_verification_status': 'approved' if step > 2 else 'pending'}
+        if step == 4:
+            fields.update(wallet=random_wallet(), wallet_submitted=True, verified=True)
+        bot.update_user_step(user_id, step, **fields)
+    return ids
+
+
+_user_ids = itertools.count(10 ** 9)
+
+
+## benchmarks: name -> (calls, expected first result); each call takes no arguments
+
+def bench_start_new(count):
+    def call():
+        user_id = next(_user_ids)
+        return bot.start(fake_update(user_id, '/start'), fake_context(user_id))
+    return call, bot.TELEGRAM_CHECK
+
+
+def bench_start_registered(count):
+    users = itertools.cycle(registered_users(count, 4))
+
+    def call():
+        user_id = next(users)
+        return bot.start(fake_update(user_id, '/start'), fake_context(user_id))
+    return call, bot.COMPLETED
+
+
+def bench_check_groups_uncached(count):
+    def call():
+        return bot.check_user_exist_groups(next(_user_ids))
+    return call, True
+
+
+def bench_check_groups_cached(count):
+    users = list(range(1, count + 1))
+    bot.check_users_exist_groups(users)
+    users = itertools.cycle(users)
+
+    def call():
+        return bot.check_user_exist_groups(next(users))
+    return call, True
+
+
+def bench_update_user_step(count):
+    users = itertools.cycle(registered_users(count, 1))
+
+    def call():
+        return bot.update_user_step(next(users), 2, telegram_verified=True)
+    return call, True
+
+
+def warm_statuses(users):
+    for user_id in users:
+        bot.submission_status_index.get(user_id)
+    return users
+
+
+def bench_tasks_command(count):
+    users = itertools.cycle(warm_statuses(registered_users(count, 4)))
+
+    def call():
+        user_id = next(users)
+        return bot.tasks_command(fake_update(user_id, '/tasks'), fake_context(user_id))
+    return call, None
+
+
+def bench_tasks_command_uncached(count):
+    users = itertools.cycle(registered_users(count, 4))
+
+    def call():
+        user_id = next(users)
+        bot.submission_status_index.invalidate(user_id)
+        return bot.tasks_command(fake_update(user_id, '/tasks'), fake_context(user_id))
+    return call, None
+
+
+def bench_show_available_tasks(count):
+    users = itertools.cycle(warm_statuses(registered_users(count, 4)))
+
+    def call():
+        user_id = next(users)
+        return bot.show_available_tasks(fake_query(user_id, 'view_tasks'), {'user_id': user_id})
+    return call, None
+
+
+def bench_handle_wallet_submit(count):
+    def call():
+        user_id = next(_user_ids)
+        return bot.handle_wallet_submit(fake_update(user_id, random_wallet()), fake_context(user_id))
+    return call, bot.COMPLETED
+
+
+BENCHMARKS = {
+    'start (new user)': bench_start_new,
+    'start (registered user)': bench_start_registered,
+    'check_user_exist_groups (uncached)': bench_check_groups_uncached,
+    'check_user_exist_groups (cached)': bench_check_groups_cached,
+    'update_user_step': bench_update_user_step,
+    'tasks_command': bench_tasks_command,
+    'tasks_command (statuses uncached)': bench_tasks_command_uncached,
+    'show_available_tasks': bench_show_available_tasks,
+    'handle_wallet_submit': bench_handle_wallet_submit,
+}
+
+
+def run(names, number, repeat, users):
+    results = {}
+    for name in names:
+        call, expected = BENCHMARKS[name](users)
+        bot.send_queue.last_text = None
+        first = call()
+        if first != expected:
+            raise SystemExit(f"{name}: returned {first!r}, expected {expected!r}")
+        if (bot.send_queue.last_text or '').startswith('❌'):
+            raise SystemExit(f"{name}: answered {bot.send_queue.last_text!r}")
+        timings = [total / number * 1e6 for total in timeit.repeat(call, number=number, repeat=repeat)]
+        results[name] = {
+            'min_us': round(min(timings), 2),
+            'median_us': round(statistics.median(timings), 2),
+            'number': number,
+            'repeat': repeat,
+        }
+        print(f"{name:<38} min {results[name]['min_us']:10.2f} us   median {results[name]['median_us']:10.2f} us")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against ``baseline``; returns the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<38}{'baseline':>12}{'now':>12}{'change':>10}")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<38}{'-':>12}{result['min_us']:>10.2f}us{'new':>10}")
+            continue
+        change = result['min_us'] / before['min_us'] - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{name:<38}{before['min_us']:>10.2f}us{result['min_us']:>10.2f}us{change:>+9.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=200, help='calls per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per benchmark (min and median reported)')
+    parser.add_argument('--users', type=int, default=500, help='distinct registered users per benchmark')
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('-k', '--filter', default='', help='only benchmarks whose name contains this')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+
+    bot.configure_logging()
+    install_fakes(args.tasks)
+    names = [name for name in BENCHMARKS if args.filter in name]
+    print(f"{len(names)} benchmarks, {args.repeat} x {args.number} calls each, Python {platform.python_version()}")
+    results = run(names, args.number, args.repeat, args.users)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Saved {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) more than {args.threshold:.0%} slower than {args.compare}",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark: per-update cost of rendering bot replies.
+
+Compares the way handlers used to build keyboards and texts on every
+update ("before") with the prebuilt markups and catalog-versioned task
+fragments of lib.rendering ("after").
+
+    python benchmarks/bench_rendering.py [--tasks 20] [--number 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import settings
+from lib.rendering import TaskRenderer, PROCEED_TWITTER_MARKUP, TWITTER_FOLLOW_TEXT
+
+STATUSES = ('pending', 'approved', 'rejected')
+
+
+class FakeCatalog(object):
+    """Stands in for lib.task_catalog.TaskCatalog with a fixed task list"""
+
+    def __init__(self, count):
+        self.version = 'v1'
+        self._tasks = tuple({
+            'id': task_id,
+            'title': f'Task number {task_id}',
+            'description': 'Like and retweet the pinned post, then share the link. ' * 3,
+            'task_type': random.choice(('twitter', 'telegram', 'discord')),
+            'requirements': 'Public account, at least 10 followers' if task_id % 2 else '',
+        } for task_id in range(1, count + 1))
+        self._by_id = {str(task['id']): task for task in self._tasks}
+
+    def snapshot(self):
+        return self.version, self._tasks, self._by_id
+
+    def tasks(self):
+        return self._tasks
+
+    def get(self, task_id):
+        return self._by_id.get(str(task_id))
+
+
+## before: what the handlers did per update
+
+def before_task_menu(all_tasks, user_submissions):
+    submitted_task_ids = {sub['task_id'] for sub in user_submissions}
+    submission_statuses = {}
+    completed_tasks = []
+    new_tasks = []
+    for task in all_tasks:
+        if task['id'] in submitted_task_ids:
+            submission = next((sub for sub in user_submissions if sub['task_id'] == task['id']), None)
+            submission_statuses[task['id']] = submission['status'] if submission else 'pending'
+            completed_tasks.append(task)
+        else:
+            new_tasks.append(task)
+    message = ""
+    keyboard = []
+    if new_tasks:
+        for task in new_tasks:
+            keyboard.append([InlineKeyboardButton(f"🆕 {task['title']}", callback_data=f"task_{task['id']}")])
+        message += "\n"
+    if completed_tasks:
+        message += "✅ <b>Your Submissions</b>\n"
+        for task in completed_tasks:
+            status_emoji = {'pending': '⏳', 'approved': '✅', 'rejected': '❌'}.get(submission_statuses[task['id']], '⏳')
+            keyboard.append([InlineKeyboardButton(f"{status_emoji} {task['title']}", callback_data=f"task_{task['id']}")])
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+def before_task_detail(catalog, task_id):
+    task = catalog.get(task_id)
+    message = f"🎯 <b>{task['title']}</b>\n\n"
+    message += f"📝 <b>Description:</b>\n{task['description']}\n\n"
+    message += f"🔗 <b>Type:</b> {task['task_type'].title()}\n\n"
+    if task.get('requirements'):
+        message += f"📋 <b>Requirements:</b>\n{task['requirements']}\n\n"
+    keyboard = [
+        [InlineKeyboardButton("🚀 Proceed", callback_data=f"proceed_task_{task_id}")],
+        [InlineKeyboardButton("⬅️ Back to Tasks", callback_data="view_tasks")]
+    ]
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+def before_static_reply():
+    keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    return settings.TWITTER_FOLLOW_MESSAGE.format(twitter_link=settings.TWITTER_PAGE_LINK), reply_markup
+
+
+## after: lib.rendering
+
+def after_task_menu(renderer, user_submissions):
+    statuses = {}
+    for submission in user_submissions:
+        statuses.setdefault(str(submission['task_id']), submission['status'])
+    return renderer.task_menu(statuses)
+
+
+def after_task_detail(renderer, task_id):
+    return renderer.get(task_id).detail
+
+
+def after_static_reply():
+    return TWITTER_FOLLOW_TEXT, PROCEED_TWITTER_MARKUP
+
+
+def random_submissions(task_count, max_submitted):
+    submitted = random.sample(range(1, task_count + 1), random.randint(0, max_submitted))
+    return [{'task_id': task_id, 'status': random.choice(STATUSES)} for task_id in submitted]
+
+
+def measure(label, before, after, number):
+    before_us = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e6
+    after_us = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e6
+    print(f"{label:<34} before {before_us:9.2f} us   after {after_us:9.2f} us   x{before_us / after_us:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    catalog = FakeCatalog(args.tasks)
+    renderer = TaskRenderer(catalog)
+    all_tasks = catalog.tasks()
+
+    # A mix of users: most have submitted nothing or a few tasks
+    users = [random_submissions(args.tasks, 3) for _ in range(500)]
+    position = [0]
+
+    def next_user():
+        position[0] = (position[0] + 1) % len(users)
+        return users[position[0]]
+
+    print(f"{args.tasks} tasks, {len(users)} distinct users, {args.number} updates per run")
+    measure("static reply (markup + text)", before_static_reply, after_static_reply, args.number)
+    measure("task detail", lambda: before_task_detail(catalog, 1), lambda: after_task_detail(renderer, 1), args.number)
+    measure("task list, nothing submitted",
+            lambda: before_task_menu(all_tasks, []), lambda: after_task_menu(renderer, []), args.number)
+    measure("task list, mixed users",
+            lambda: before_task_menu(all_tasks, next_user()), lambda: after_task_menu(renderer, next_user()),
+            args.number)
+    print(f"renderer: {renderer.stats()}")
+
+
+if __name__ == '__main__':
+    main()
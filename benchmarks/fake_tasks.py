@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the task backend (``settings.TASKS_API_URL``), for load tests.
+
+Serves a fixed catalog on ``/api/tasks`` (with an ETag, so the bot's
+conditional requests get 304s), an empty history on
+``/api/user_submissions/<id>`` and accepts every ``/api/submit_task``.
+
+    python benchmarks/fake_tasks.py --port 8082 --tasks 20
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+
+from fake_telegram import QuietHTTPServer
+
+
+class FakeTaskAPI(object):
+    """Threaded HTTP server with a fixed task catalog"""
+
+    def __init__(self, host='127.0.0.1', port=0, tasks=20):
+        self._catalog = json.dumps({'tasks': [{
+            'id': task_id,
+            'title': f'Task number {task_id}',
+            'description': 'Like and retweet the pinned post, then share the link.',
+            'task_type': ('twitter', 'telegram', 'discord')[task_id % 3],
+            'requirements': 'Public account' if task_id % 2 else '',
+        } for task_id in range(1, tasks + 1)]}).encode('utf-8')
+        self._etag = '"%s"' % hashlib.sha1(self._catalog).hexdigest()
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                api._handle(self)
+
+            def do_POST(self):
+                api._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = QuietHTTPServer((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-tasks', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _reply(self, request, status, body=b'', headers=()):
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _handle(self, request):
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            request.rfile.read(length)
+        path = request.path.split('?', 1)[0].rstrip('/')
+        endpoint = path.split('/')[2] if path.count('/') >= 2 else ''
+        with self._lock:
+            self.calls[endpoint] += 1
+
+        if path == '/api/tasks':
+            if request.headers.get('If-None-Match') == self._etag:
+                self._reply(request, 304, headers=[('ETag', self._etag)])
+            else:
+                self._reply(request, 200, self._catalog, headers=[('ETag', self._etag)])
+        elif path.startswith('/api/user_submissions/'):
+            self._reply(request, 200, b'{"success": true, "submissions": []}')
+        elif path == '/api/submit_task':
+            self._reply(request, 200, b'{"success": true}')
+        else:
+            self._reply(request, 404, b'{"error": "Not found"}')
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake task backend')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--tasks', type=int, default=20)
+    args = parser.parse_args()
+
+    api = FakeTaskAPI(args.host, args.port, args.tasks)
+    print(f'Fake task API on {api.url}')
+    api.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
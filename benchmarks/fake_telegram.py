@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Telegram Bot API, for load tests.
+
+Serves ``/bot<token>/<method>`` for the methods the bot uses: getMe,
+getUpdates (long polling on updates pushed with ``push_update``),
+setWebhook/deleteWebhook/getWebhookInfo, getChatMember (everyone is a
+member), sendMessage, editMessageText, answerCallbackQuery and
+sendChatAction. Message sends can be slowed down (``latency`` +/-
+``jitter`` seconds) and refused with 429 ``retry_after`` at a given ratio,
+like the real flood limits.
+
+Every sendMessage / editMessageText that is accepted is handed to the
+chat's waiter, so a driver can measure the time from an update to the
+bot's answer with ``wait_for(chat_id)``.
+
+    python benchmarks/fake_telegram.py --port 8081 --latency 0.05 --rate-limit-ratio 0.01
+"""
+
+import argparse
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'load_test_bot'}
+SEND_METHODS = ('sendMessage', 'editMessageText')
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded server that ignores clients going away (the bot process is killed at the end of a run)"""
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeTelegramAPI(object):
+    """Threaded HTTP server answering Bot API calls from memory"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+
+        self._updates = []
+        self._updates_cond = threading.Condition()
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        self._message_ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+        self.webhook_url = ''
+        self.calls = Counter()
+        self.rate_limited = 0
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                api._handle(self)
+
+            def do_POST(self):
+                api._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = QuietHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    ## driver side
+
+    def push_update(self, update):
+        """Queue an update for getUpdates (polling mode)"""
+        with self._updates_cond:
+            self._updates.append(update)
+            self._updates_cond.notify_all()
+
+    def _waiter(self, chat_id):
+        with self._waiters_lock:
+            waiter = self._waiters.get(chat_id)
+            if waiter is None:
+                waiter = self._waiters[chat_id] = queue.Queue()
+            return waiter
+
+    def drain(self, chat_id):
+        """Forget answers to ``chat_id`` that nobody waited for"""
+        waiter = self._waiter(chat_id)
+        while not waiter.empty():
+            waiter.get_nowait()
+
+    def wait_for(self, chat_id, timeout=30.0):
+        """Next ``(method, params, received_at)`` sent to ``chat_id``; raises queue.Empty on timeout"""
+        return self._waiter(chat_id).get(timeout=timeout)
+
+    def forget(self, chat_id):
+        with self._waiters_lock:
+            self._waiters.pop(chat_id, None)
+
+    ## HTTP side
+
+    def _params(self, request):
+        parts = urlsplit(request.path)
+        params = dict(parse_qsl(parts.query))
+        length = int(request.headers.get('Content-Length') or 0)
+        if length:
+            body = request.rfile.read(length)
+            if request.headers.get('Content-Type', '').startswith('application/json'):
+                params.update(json.loads(body or b'{}'))
+            else:
+                params.update(parse_qsl(body.decode('utf-8')))
+        return parts.path, params
+
+    def _reply(self, request, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _handle(self, request):
+        path, params = self._params(request)
+        method = path.rsplit('/', 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+        handler = getattr(self, f'_api_{method}', None)
+        if not path.startswith('/bot') or handler is None:
+            self._reply(request, 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+
+        if method in SEND_METHODS:
+            if self.latency or self.jitter:
+                time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+            if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+                with self._lock:
+                    self.rate_limited += 1
+                self._reply(request, 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                })
+                return
+        self._reply(request, 200, {'ok': True, 'result': handler(params)})
+
+    def _message(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = params.get('message_id')
+        return {
+            'message_id': int(message_id) if message_id else next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._updates_cond:
+            # Confirmed updates are dropped, as by Telegram
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_cond.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _api_setWebhook(self, params):
+        self.webhook_url = params.get('url', '')
+        return True
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = ''
+        return True
+
+    def _api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+
+    def _api_getChatMember(self, params):
+        user_id = int(params['user_id'])
+        return {'status': 'member', 'user': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}}
+
+    def _api_sendChatAction(self, params):
+        return True
+
+    def _api_answerCallbackQuery(self, params):
+        return True
+
+    def _api_sendMessage(self, params):
+        message = self._message(params)
+        self._waiter(message['chat']['id']).put(('sendMessage', params, time.monotonic()))
+        return message
+
+    def _api_editMessageText(self, params):
+        message = self._message(params)
+        self._waiter(message['chat']['id']).put(('editMessageText', params, time.monotonic()))
+        return message
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'rate_limited': self.rate_limited}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every send')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(args.host, args.port, args.latency, args.jitter, args.rate_limit_ratio, args.retry_after)
+    print(f'Fake Telegram Bot API on {api.url}')
+    api.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end load test: synthetic users through the whole registration funnel.
+
+Starts a fake Telegram Bot API (benchmarks/fake_telegram.py) and a fake task
+backend (benchmarks/fake_tasks.py), runs the bot against them in a child
+process (benchmarks/run_bot.py) with a fresh SQLite database, and drives
+``--users`` synthetic users, ``--concurrency`` at a time, through:
+
+    /start -> start_registration -> proceed_twitter -> X username -> admin approval
+    -> proceed_wallet -> wallet -> /tasks
+
+In ``polling`` mode updates are served to ``bot.main()`` through
+getUpdates; in ``webhook`` mode they are POSTed to the app.py webhook the
+bot registered with setWebhook. Each step is timed from handing the update
+over to the bot's answer (sendMessage / editMessageText) reaching the fake
+API. The report gives funnels per second, p50/p95/p99 per step and per
+funnel, the child's CPU, RSS and thread count (with psutil), and the calls
+the fakes received.
+
+The bot's outgoing flood limits (30 msg/s, 1 msg/s per chat) bound what the
+funnel can reach; ``--send-rate`` / ``--chat-rate`` lift them to measure the
+bot itself. ``--min-throughput`` makes the run fail below a floor, for CI.
+
+    python benchmarks/load_test.py --mode both --users 200 --concurrency 50 --send-rate 1000 --chat-rate 100
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_tasks import FakeTaskAPI
+from fake_telegram import BOT_USER, FakeTelegramAPI
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:load-test'
+ADMIN_TOKEN = 'load-test-admin'
+MODES = ('polling', 'webhook')
+STEPS = ('start', 'start_registration', 'proceed_twitter', 'twitter_username', 'approval', 'proceed_wallet', 'wallet',
+         'tasks')
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+class StepFailed(Exception):
+    """The bot did not answer a funnel step in time"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def b58encode(data):
+    number = int.from_bytes(data, 'big')
+    text = ''
+    while number:
+        number, digit = divmod(number, 58)
+        text = BASE58[digit] + text
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + text
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        'count': len(values),
+        'p50': round(pick(0.50), 4),
+        'p95': round(pick(0.95), 4),
+        'p99': round(pick(0.99), 4),
+        'max': round(values[-1], 4),
+    }
+
+
+class ResourceSampler(object):
+    """CPU, RSS and thread count of the bot process, sampled in the background"""
+
+    def __init__(self, pid, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self._process = psutil.Process(pid) if psutil else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+
+    def start(self):
+        if self._process is not None:
+            self._process.cpu_percent()
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self._process.oneshot():
+                    self.samples.append((self._process.cpu_percent(), self._process.memory_info().rss,
+                                         self._process.num_threads()))
+            except psutil.Error:
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if not self.samples:
+            return None
+        cpu = [sample[0] for sample in self.samples]
+        return {
+            'cpu_avg_percent': round(sum(cpu) / len(cpu), 1),
+            'cpu_max_percent': round(max(cpu), 1),
+            'rss_max_mb': round(max(sample[1] for sample in self.samples) / 2 ** 20, 1),
+            'threads_max': max(sample[2] for sample in self.samples),
+        }
+
+
+class LoadTest(object):
+    """One run of the funnel against the bot in ``mode``"""
+
+    def __init__(self, mode, users, concurrency, step_timeout, latency, jitter, rate_limit_ratio, send_rate=None,
+                 chat_rate=None):
+        self.mode = mode
+        self.users = users
+        self.concurrency = concurrency
+        self.step_timeout = step_timeout
+        self.send_rate = send_rate
+        self.chat_rate = chat_rate
+
+        self.telegram = FakeTelegramAPI(latency=latency, jitter=jitter, rate_limit_ratio=rate_limit_ratio)
+        self.tasks = FakeTaskAPI()
+        self.port = free_port()
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        self.process = None
+        self.workdir = None
+
+        self._update_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.funnels = []
+        self.failures = {}
+
+    ## bot process
+
+    def _env(self):
+        env = dict(os.environ)
+        env.update(
+            TELEGRAM_TOKEN=TOKEN,
+            TELEGRAM_API_URL=self.telegram.url,
+            TASKS_API_URL=self.tasks.url,
+            DATABASE_URL=f'sqlite:///{os.path.join(self.workdir, "airdrop_bot.db")}',
+            ADMIN_API_TOKEN=ADMIN_TOKEN,
+            LOG_LEVEL='WARNING',
+            LOG_FILE='',
+            PYTHONUNBUFFERED='1',
+        )
+        if self.mode == 'webhook':
+            env['WEBHOOK_URL'] = f'http://127.0.0.1:{self.port}'
+        if self.send_rate:
+            env['SEND_GLOBAL_RATE'] = str(self.send_rate)
+        if self.chat_rate:
+            env['SEND_CHAT_RATE'] = str(self.chat_rate)
+        return env
+
+    def _ready(self):
+        if self.mode == 'polling':
+            return self.telegram.calls['getUpdates'] > 0 and self._port_open()
+        return bool(self.telegram.webhook_url)
+
+    def _port_open(self):
+        try:
+            socket.create_connection(('127.0.0.1', self.port), timeout=0.2).close()
+            return True
+        except OSError:
+            return False
+
+    def start(self, timeout=60.0):
+        self.telegram.start()
+        self.tasks.start()
+        self.workdir = tempfile.mkdtemp(prefix=f'airdrop-load-{self.mode}-')
+        self._output = open(os.path.join(self.workdir, 'bot.log'), 'wb')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'benchmarks', 'run_bot.py'), self.mode, '--port', str(self.port)],
+            cwd=self.workdir, env=self._env(), stdout=self._output, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while not self._ready():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f'{self.mode} bot did not start, see {self._output.name}')
+            time.sleep(0.1)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._output.close()
+        self.telegram.stop()
+        self.tasks.stop()
+
+    ## synthetic users
+
+    def _deliver(self, update):
+        update['update_id'] = next(self._update_ids)
+        if self.mode == 'polling':
+            self.telegram.push_update(update)
+        else:
+            self.http.post(self.telegram.webhook_url, json=update, timeout=self.step_timeout).raise_for_status()
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}', 'username': f'load{user_id}'}
+
+    def _message(self, user_id, text):
+        message = {
+            'message_id': random.randint(1, 1 << 30),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': message}
+
+    def _callback(self, user_id, data):
+        return {'callback_query': {
+            'id': str(random.getrandbits(48)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': random.randint(1, 1 << 30),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...',
+            },
+        }}
+
+    def _approve(self, user_id):
+        response = self.http.post(
+            f'http://127.0.0.1:{self.port}/admin/twitter_verifications/bulk',
+            json={'action': 'approve', 'telegram_ids': [user_id]},
+            headers={'X-Admin-Token': ADMIN_TOKEN}, timeout=self.step_timeout)
+        response.raise_for_status()
+
+    def _step(self, user_id, step, action):
+        """Run ``action`` and wait for the bot's answer in the user's chat; returns the latency"""
+        self.telegram.drain(user_id)
+        started = time.monotonic()
+        action()
+        try:
+            _method, _params, answered = self.telegram.wait_for(user_id, timeout=self.step_timeout)
+        except queue.Empty:
+            raise StepFailed(step)
+        latency = answered - started
+        with self._lock:
+            self.latencies[step].append(latency)
+        return latency
+
+    def _funnel(self, user_id):
+        wallet = b58encode(os.urandom(32))
+        steps = (
+            ('start', lambda: self._deliver(self._message(user_id, '/start'))),
+            ('start_registration', lambda: self._deliver(self._callback(user_id, 'start_registration'))),
+            ('proceed_twitter', lambda: self._deliver(self._callback(user_id, 'proceed_twitter'))),
+            ('twitter_username', lambda: self._deliver(self._message(user_id, f'@load{user_id}'))),
+            ('approval', lambda: self._approve(user_id)),
+            ('proceed_wallet', lambda: self._deliver(self._callback(user_id, 'proceed_wallet'))),
+            ('wallet', lambda: self._deliver(self._message(user_id, wallet))),
+            ('tasks', lambda: self._deliver(self._message(user_id, '/tasks'))),
+        )
+        started = time.monotonic()
+        try:
+            for step, action in steps:
+                self._step(user_id, step, action)
+        except (StepFailed, requests.RequestException) as e:
+            failed = str(e) if isinstance(e, StepFailed) else f'{step}: {e.__class__.__name__}'
+            with self._lock:
+                self.failures[failed] = self.failures.get(failed, 0) + 1
+            return
+        finally:
+            self.telegram.forget(user_id)
+        with self._lock:
+            self.funnels.append(time.monotonic() - started)
+
+    def run(self):
+        self.start()
+        sampler = ResourceSampler(self.process.pid).start()
+        try:
+            first_id = random.randint(10 ** 8, 10 ** 9)
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='load-user') as pool:
+                list(pool.map(self._funnel, range(first_id, first_id + self.users)))
+            elapsed = time.monotonic() - started
+        finally:
+            resources = sampler.stop()
+            self.stop()
+        return {
+            'mode': self.mode,
+            'users': self.users,
+            'concurrency': self.concurrency,
+            'completed': len(self.funnels),
+            'failed': self.failures,
+            'elapsed_s': round(elapsed, 3),
+            'throughput': round(len(self.funnels) / elapsed, 2) if elapsed else 0.0,
+            'funnel': percentiles(self.funnels),
+            'steps': {step: percentiles(values) for step, values in self.latencies.items()},
+            'resources': resources,
+            'telegram_api': self.telegram.stats(),
+            'task_api': self.tasks.stats(),
+            'bot_log': self._output.name,
+        }
+
+
+def print_report(report):
+    print(f"\n== {report['mode']}: {report['completed']}/{report['users']} funnels in {report['elapsed_s']}s "
+          f"({report['throughput']} funnels/s, concurrency {report['concurrency']})")
+    if report['failed']:
+        print(f"   failed at: {', '.join(f'{step} x{count}' for step, count in report['failed'].items())}")
+    print(f"   {'step':<18}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, stats in list(report['steps'].items()) + [('funnel', report['funnel'])]:
+        if stats['count']:
+            print(f"   {name:<18}{stats['count']:>7}" + ''.join(f"{stats[key] * 1000:>7.1f}ms" for key in
+                                                             ('p50', 'p95', 'p99', 'max')))
+    if report['resources']:
+        resources = report['resources']
+        print(f"   bot: cpu avg {resources['cpu_avg_percent']}% / max {resources['cpu_max_percent']}%, "
+              f"rss max {resources['rss_max_mb']} MB, threads max {resources['threads_max']}")
+    print(f"   telegram api: {report['telegram_api']}")
+    print(f"   task api: {report['task_api']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test of the registration funnel')
+    parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--step-timeout', type=float, default=30.0, help='seconds to wait for each answer')
+    parser.add_argument('--latency', type=float, default=0.0, help='fake Bot API latency per send, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--send-rate', type=float, help='override SEND_GLOBAL_RATE in the bot')
+    parser.add_argument('--chat-rate', type=float, help='override SEND_CHAT_RATE in the bot')
+    parser.add_argument('--min-throughput', type=float, help='exit with 1 when a mode reaches fewer funnels/s')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON')
+    args = parser.parse_args()
+
+    reports = []
+    for mode in (MODES if args.mode == 'both' else (args.mode,)):
+        test = LoadTest(mode, args.users, args.concurrency, args.step_timeout, args.latency, args.jitter,
+                        args.rate_limit_ratio, args.send_rate, args.chat_rate)
+        reports.append(test.run())
+        if not args.json:
+            print_report(reports[-1])
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    if psutil is None:
+        print('psutil is not installed: no resource usage', file=sys.stderr)
+    if args.min_throughput is not None:
+        slow = [report['mode'] for report in reports if report['throughput'] < args.min_throughput]
+        if slow:
+            print(f"Throughput below {args.min_throughput} funnels/s: {', '.join(slow)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the bot for benchmarks/load_test.py, in a process of its own.
+
+``polling`` runs ``bot.main()`` (long polling on TELEGRAM_API_URL) next to
+a small admin endpoint, since polling mode has no Flask app to receive
+moderation decisions. ``webhook`` serves the Flask app of app.py, which
+gets updates on ``/webhook`` and has the real admin routes.
+
+Either way ``POST /admin/twitter_verifications/bulk`` with
+``{"action": "approve", "telegram_ids": [...]}`` on ``--port`` approves
+pending X verifications and pushes the notifications.
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python benchmarks/run_bot.py polling --port 8090
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def serve_moderation(port, publish):
+    """Admin endpoint for polling mode: bulk X verification decisions only"""
+    from lib.moderation import ACTIONS, apply_twitter_decisions
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if self.path != '/admin/twitter_verifications/bulk' or data.get('action') not in ACTIONS:
+                status, body = 404, {'error': 'Not found'}
+            else:
+                changed, not_announced = apply_twitter_decisions(data.get('telegram_ids') or [], data['action'], publish)
+                status, body = 200, {'changed': len(changed), 'not_notified': len(not_announced)}
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-admin', daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot for a load test')
+    parser.add_argument('mode', choices=('polling', 'webhook'))
+    parser.add_argument('--port', type=int, required=True, help='webhook / admin port')
+    args = parser.parse_args()
+
+    # The load test starts on an empty database
+    from lib.schema import create_tables
+    create_tables()
+
+    if args.mode == 'polling':
+        import bot
+        serve_moderation(args.port, bot.publish_twitter_status)
+        bot.main()
+    else:
+        from werkzeug.serving import make_server
+
+        # Importing app initializes the bot, as under gunicorn
+        import app
+        make_server('127.0.0.1', args.port, app.app, threaded=True).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,28 +17,147 @@ Press Ctrl-C on the command line or send a signal to the process to stop the
 bot.
 """
 
-from telegram import ChatAction, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import ChatAction, ReplyKeyboardMarkup
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters, RegexHandler,
                           ConversationHandler, CallbackQueryHandler, JobQueue)
 
 ## custom library
-from lib.models import userDBexists,add_userDB,user_details_summary,session,users_data
+from lib.models import users_data
+from lib.db import session_scope, upsert, insert_if_missing, increment, on_commit
+from lib.membership_scheduler import MembershipCheckScheduler
+from lib.membership_client import MembershipClient
+from lib.membership_cache import MembershipCache
+from lib.task_catalog import TaskCatalog, TaskCatalogError
+from lib.update_queue import UpdateQueue, route_dispatcher_updates
+from lib.send_queue import SendQueue, BACKGROUND
+from lib.notification_bus import NotificationBus
+from lib.twitter_status import (TwitterStatusCache, DECISIONS, reserve_notices, clear_notice, claim_notice,
+                                load_waiting, poll_decisions)
+from lib.persistence import create_persistence
+from lib.user_cache import UserProfileCache, PROFILE_FIELDS
+from lib.solana import WalletIndex, is_valid_address
+from lib.referrals import ReferralIndex
+from lib.sybil import create_detector
+from lib.submissions import SubmissionIndex, SubmissionRejected, normalize_proof, record_collision
+from lib.submission_status import SubmissionStatusIndex
+from lib.metrics import metrics, InstrumentedSession
+from lib.log import setup_logging
+from lib.rendering import (TaskRenderer, START_REGISTRATION_MARKUP, PROCEED_TWITTER_MARKUP,
+                           PROCEED_WALLET_MARKUP, CHECK_AGAIN_MARKUP, TWITTER_FOLLOW_TEXT, TWITTER_REJECTED_TEXT,
+                           TELEGRAM_JOINED_TEXT, NOT_IN_GROUP_TEXT, ASK_TO_JOIN_TEXT, TASK_SUBMIT_TEXT, task_submit_markup, referral_link)
 from random import randint
+import html
+import logging
 import os
 import re
 import settings
-import requests
 from functools import wraps
 from dataclasses import dataclass
-from time import sleep
-import threading
-import time
+
+logger = logging.getLogger(__name__)
 
 TELEGRAM_CHECK, TWITTER_SUBMIT, TWITTER_PENDING, WALLET_SUBMIT, COMPLETED = range(5)
 
+task_catalog = TaskCatalog(settings.TASKS_API_URL, ttl=settings.TASK_CATALOG_TTL)
+task_renderer = TaskRenderer(task_catalog)
+
+send_queue = SendQueue(
+    global_rate=settings.SEND_GLOBAL_RATE,
+    chat_rate=settings.SEND_CHAT_RATE,
+    chat_burst=settings.SEND_CHAT_BURST,
+    max_size=settings.SEND_QUEUE_SIZE,
+    max_interactive_size=settings.SEND_QUEUE_INTERACTIVE_SIZE,
+    max_retries=settings.SEND_MAX_RETRIES
+)
+
+
+## outgoing messages go through the rate-limited send queue
+def reply(message, text, **kwargs):
+    """Interactive reply to a user's message"""
+    return send_queue.submit(message.chat_id, message.reply_text, (text,), kwargs)
+
+def edit(query, text, **kwargs):
+    """Interactive edit of the message a callback button belongs to"""
+    chat_id = query.message.chat_id if query.message else query.from_user.id
+    return send_queue.submit(chat_id, query.edit_message_text, (text,), kwargs)
+
+def notify(bot, chat_id, text, **kwargs):
+    """Background notification that the user did not directly ask for"""
+    kwargs.update(chat_id=chat_id, text=text)
+    return send_queue.submit(chat_id, bot.send_message, kwargs=kwargs, priority=BACKGROUND)
+
+# Task backend calls share one connection pool and are timed
+tasks_http = InstrumentedSession('task_api')
+
+def load_user_profile(telegram_id):
+    """The user's users_data columns as a dict, or None if they are not registered"""
+    with session_scope() as db:
+        row = db.query(*(getattr(users_data, field) for field in PROFILE_FIELDS)).filter(
+            users_data.telegram_id == telegram_id
+        ).first()
+    return row._asdict() if row else None
+
+def load_user_summary(telegram_id):
+    """The /info text of a user, or None if they are not registered"""
+    profile = load_user_profile(telegram_id)
+    if profile is None:
+        return None
+    return settings.USER_INFO_MESSAGE.format(**{
+        field: 'Not set' if value is None else value for field, value in profile.items()
+    })
+
+user_cache = UserProfileCache(
+    metrics.timed('db')(load_user_profile),
+    metrics.timed('db')(load_user_summary),
+    max_size=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL
+)
+
+wallet_index = WalletIndex(chunk_size=settings.WALLET_INDEX_CHUNK)
+referral_index = ReferralIndex(top_k=settings.LEADERBOARD_SIZE, chunk_size=settings.REFERRAL_INDEX_CHUNK)
+sybil_detector = create_detector()
+submission_index = SubmissionIndex(chunk_size=settings.SUBMISSION_INDEX_CHUNK)
+
+notification_bus = NotificationBus(max_size=settings.NOTIFICATION_BUS_SIZE)
+twitter_status_cache = TwitterStatusCache(ttl=settings.TWITTER_STATUS_CACHE_TTL)
+
+def publish_twitter_status(telegram_id, status, reason=None, timeout=None, claimed=True):
+    """Announce a committed twitter_verification_status change on the notification bus; False if dropped.
+
+    ``claimed`` is False for decisions found by polling, whose notice this
+    process has not reserved yet.
+    """
+    return notification_bus.publish('twitter_status', {
+        'telegram_id': telegram_id,
+        'status': status,
+        'reason': reason,
+        'claimed': claimed
+    }, timeout=timeout)
+
+def publish_submission_status(telegram_id, task_id, status, timeout=None):
+    """Announce a moderated task submission on the notification bus; False if dropped"""
+    return notification_bus.publish('submission_status', {
+        'telegram_id': telegram_id,
+        'task_id': str(task_id),
+        'status': status
+    }, timeout=timeout)
+
+def fetch_submission_statuses(user_id):
+    """task_id -> status for the user's submissions, from the task backend (None if it did not answer)"""
+    submissions_response = tasks_http.get(f'{settings.TASKS_API_URL}/user_submissions/{user_id}')
+    if submissions_response.status_code != 200:
+        return None
+    return submission_statuses(submissions_response.json().get('submissions', []))
+
+submission_status_index = SubmissionStatusIndex(
+    fetch_submission_statuses,
+    max_size=settings.SUBMISSION_STATUS_CACHE_SIZE,
+    ttl=settings.SUBMISSION_STATUS_CACHE_TTL
+)
+
 
 def start(update, context):
-    print(f"Start function called for user: {update.message.from_user.id}")
+    logger.debug(f"Start function called for user: {update.message.from_user.id}")
     
     context.bot.send_chat_action(chat_id=update.message.chat_id, action=ChatAction.TYPING)
     
@@ -58,66 +177,63 @@ def start(update, context):
     
     # Check if user already exists in database
     try:
-        existing_user = userDBexists(update.message.from_user.id)
+        existing_user = user_cache.get(update.message.from_user.id)
+        if existing_user is None:
+            raise LookupError(f"user {update.message.from_user.id} is not registered")
         if existing_user:
             # User exists, check their current status
             registration_step = existing_user.get('registration_step', 1)
             
             if registration_step == 4:  # Completed registration
-                ref_link = f"https://t.me/greendale1_bot?start={context.user_data['user_id']}"
+                ref_link = referral_link(context.user_data['user_id'])
                 status_info = f"✅ Telegram: Verified\n✅ X (Twitter): Verified\n✅ Wallet: {existing_user.get('wallet', 'Not set')[:10]}..."
                 message = settings.ALREADY_REGISTERED_MESSAGE.format(
                     status_info=status_info,
                     ref_link=ref_link
                 )
-                update.message.reply_text(message)
+                reply(update.message, message)
                 return COMPLETED
             else:
                 # Continue from where they left off
                 return handle_existing_user_flow(context.bot, update, context.user_data, existing_user)
     except Exception as e:
-        print(f"User not found in database: {e}")
+        logger.info(f"User not found in database: {e}")
         # Create new user in database with referral tracking
         try:
-            new_user = users_data(
-                telegram_id=update.message.from_user.id,
-                username=update.message.from_user.username,
-                registration_step=1,
-                telegram_verified=False,
-                twitter_verification_status='pending',
-                wallet_submitted=False,
-                balance=0,
-                verified=False,
-                referral_count=0,
-                referral_by=referrer_id
-            )
-            session.add(new_user)
-            session.commit()
-            print(f"New user created in database: {update.message.from_user.id}")
-            
-            # Update referrer's referral count if valid referrer
-            if referrer_id and userDBexists(referrer_id):
-                referrer_data = userDBexists(referrer_id)
-                if referrer_data:
-                    current_count = referrer_data.get('referral_count', 0)
-                    update_user_step(
-                        referrer_id,
-                        referrer_data.get('registration_step', 1),
-                        referral_count=current_count + 1
-                    )
-                    print(f"Updated referrer {referrer_id} referral count to {current_count + 1}")
+            user_id = update.message.from_user.id
+            with session_scope() as db:
+                created = insert_if_missing(db, users_data, 'telegram_id', dict(
+                    telegram_id=user_id,
+                    username=update.message.from_user.username,
+                    registration_step=1,
+                    telegram_verified=False,
+                    twitter_verification_status='pending',
+                    wallet_submitted=False,
+                    balance=0,
+                    verified=False,
+                    referral_count=0,
+                    referral_by=referrer_id
+                ))
+                
+                # Credit the referrer with a single atomic UPDATE (no-op if they don't exist)
+                credited = False
+                if created and referrer_id and referrer_id != user_id:
+                    credited = increment(db, users_data, 'telegram_id', referrer_id, 'referral_count')
+                    if credited:
+                        on_commit(db, lambda: user_cache.invalidate(referrer_id))
+                        on_commit(db, lambda: referral_index.add(user_id, referrer_id))
+                        on_commit(db, lambda: sybil_detector.mark(referrer_id))
+            if created:
+                logger.info(f"New user created in database: {user_id}")
+            if credited:
+                logger.info(f"Incremented referral count of referrer {referrer_id}")
         except Exception as create_error:
-            print(f"Error creating new user: {create_error}")
-            session.rollback()
+            logger.error(f"Error creating new user: {create_error}")
     
     # New user - start the registration flow
     welcome_text = settings.WELCOME_MESSAGE.format(Username=update.message.from_user.first_name or "Friend")
     
-    # Create inline keyboard with Start Registration button
-    keyboard = [[InlineKeyboardButton("🚀 Start Registration", callback_data="start_registration")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    update.message.reply_text(welcome_text, reply_markup=reply_markup)
+    reply(update.message, welcome_text, reply_markup=START_REGISTRATION_MARKUP)
     
     return TELEGRAM_CHECK
 
@@ -130,26 +246,18 @@ def handle_existing_user_flow(update, context, existing_user):
     elif step == 2:  # Twitter submission
         twitter_status = existing_user.get('twitter_verification_status', 'pending')
         if twitter_status == 'pending':
-            update.message.reply_text(settings.TWITTER_PENDING_MESSAGE.format(
+            reply(update.message, settings.TWITTER_PENDING_MESSAGE.format(
                 username=existing_user.get('twitter_id', 'Unknown')
             ))
             return TWITTER_PENDING
         elif twitter_status == 'rejected':
-            keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            update.message.reply_text(settings.TWITTER_FOLLOW_MESSAGE.format(
-                twitter_link=settings.TWITTER_PAGE_LINK
-            ), reply_markup=reply_markup)
+            reply(update.message, TWITTER_FOLLOW_TEXT, reply_markup=PROCEED_TWITTER_MARKUP)
             return TWITTER_SUBMIT
         else:  # approved
-            keyboard = [[InlineKeyboardButton("Proceed to Submit Wallet", callback_data="proceed_wallet")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            update.message.reply_text(settings.TWITTER_APPROVED_MESSAGE, reply_markup=reply_markup)
+            reply(update.message, settings.TWITTER_APPROVED_MESSAGE, reply_markup=PROCEED_WALLET_MARKUP)
             return WALLET_SUBMIT
     elif step == 3:  # Wallet submission
-        keyboard = [[InlineKeyboardButton("Proceed to Submit Wallet", callback_data="proceed_wallet")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(settings.WALLET_PROMPT_MESSAGE, reply_markup=reply_markup)
+        reply(update.message, settings.WALLET_PROMPT_MESSAGE, reply_markup=PROCEED_WALLET_MARKUP)
         return WALLET_SUBMIT
     
     return TELEGRAM_CHECK
@@ -159,23 +267,22 @@ def check_telegram_membership(update, context):
     # Handle both Message and CallbackQuery objects
     if hasattr(update, 'callback_query') and update.callback_query:
         user_id = update.callback_query.from_user.id
-        reply_method = update.callback_query.message.reply_text
+        reply_to = update.callback_query.message
     else:
         user_id = update.message.from_user.id
-        reply_method = update.message.reply_text
+        reply_to = update.message
     
     if check_user_exist_groups(user_id):
         # User is in groups, proceed to Twitter step
-        keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        reply_method(settings.TELEGRAM_VERIFIED_MESSAGE, reply_markup=reply_markup)
+        reply(reply_to, settings.TELEGRAM_VERIFIED_MESSAGE, reply_markup=PROCEED_TWITTER_MARKUP)
         
         # Update user's telegram verification status
         update_user_step(context.user_data['user_id'], 2, telegram_verified=True)
+        membership_scheduler.discard(context.user_data['user_id'])
         return TWITTER_SUBMIT
     else:
         # User not in groups, start automatic checking
-        reply_method(settings.ASK_TO_JOIN_GROUPS + "\n\n⏳ I'll automatically check your membership every 30 seconds...")
+        reply(reply_to, ASK_TO_JOIN_TEXT)
         
         # Start automatic membership checking
         start_auto_membership_check(update, context)
@@ -186,127 +293,116 @@ def check_telegram_membership(update, context):
 def update_user_step(telegram_id, step, **kwargs):
     """Update user's registration step and other fields"""
     try:
-        user = session.query(users_data).filter(users_data.telegram_id == telegram_id).first()
-        if not user:
-            # Create new user
-            user = users_data(
+        # Single INSERT ... ON CONFLICT DO UPDATE instead of SELECT + INSERT/UPDATE
+        with metrics.timer('db', 'update_user_step'), session_scope() as db:
+            upsert(db, users_data, 'telegram_id', dict(
+                kwargs,
                 telegram_id=telegram_id,
-                registration_step=step,
-                **kwargs
-            )
-            session.add(user)
-        else:
-            # Update existing user
-            user.registration_step = step
-            for key, value in kwargs.items():
-                setattr(user, key, value)
-        
-        session.commit()
+                registration_step=step
+            ))
+            on_commit(db, lambda: user_cache.invalidate(telegram_id))
+            if 'twitter_verification_status' in kwargs:
+                status = kwargs['twitter_verification_status']
+                if status in DECISIONS:
+                    reserve_notices(db, [telegram_id], status)
+                else:
+                    clear_notice(db, telegram_id)
+                on_commit(db, lambda: publish_twitter_status(telegram_id, status))
         return True
     except Exception as e:
-        print(f"Error updating user step: {e}")
-        session.rollback()
+        logger.error(f"Error updating user step: {e}")
         return False
 
+membership_cache = MembershipCache(
+    max_size=settings.MEMBERSHIP_CACHE_SIZE,
+    positive_ttl=settings.MEMBERSHIP_CACHE_POSITIVE_TTL,
+    negative_ttl=settings.MEMBERSHIP_CACHE_NEGATIVE_TTL,
+    negative_max_ttl=settings.MEMBERSHIP_CACHE_NEGATIVE_MAX_TTL
+)
+
+membership_client = MembershipClient(
+    settings.TELEGRAM_TOKEN,
+    settings.GROUPS_LIST,
+    api_url=settings.TELEGRAM_API_URL,
+    max_workers=settings.MEMBERSHIP_CHECK_WORKERS,
+    interactive_workers=settings.MEMBERSHIP_INTERACTIVE_WORKERS,
+    connect_timeout=settings.MEMBERSHIP_CONNECT_TIMEOUT,
+    read_timeout=settings.MEMBERSHIP_READ_TIMEOUT,
+    cache=membership_cache
+)
+
 def check_user_exist_groups(user_telegram_int_id):
     try:
-        for group in settings.GROUPS_LIST:
-            url = f'https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getChatMember?chat_id=@{group}&user_id={user_telegram_int_id}'
-            response = requests.get(url)
-            data = response.json()
-            
-            # Check if the API response is valid
-            if not data.get('ok', False):
-                print(f'Telegram API error for group {group}: {data.get("description", "Unknown error")}')
-                return False
-                
-            # Check if result exists in response
-            if 'result' not in data:
-                print(f'No result in API response for group {group}')
-                return False
-                
-            if data['result']['status'] not in ['member', 'administrator', 'creator']:
-                return False
-        return True
+        return membership_client.is_member(user_telegram_int_id)
     except Exception as e:
-        print(f'Error checking group membership: {e}')
+        logger.error(f'Error checking group membership: {e}')
         return False
 
+def check_users_exist_groups(user_telegram_int_ids):
+    """Batch variant of check_user_exist_groups; returns the ids that are in all groups"""
+    results = membership_client.check_batch(user_telegram_int_ids)
+    return [user_id for user_id, is_member in results.items() if is_member]
+
 def handle_telegram_check(update, context):
     """Handle Telegram group membership checking"""
     query = update.callback_query
+    if query and query.data == "start_registration":
+        # The welcome message's button: first membership check, inside the conversation
+        query.answer()
+        context.user_data['user_id'] = query.from_user.id
+        return check_telegram_membership(update, context)
     if query and query.data == "check_telegram":
         query.answer()
         context.bot.send_chat_action(chat_id=query.message.chat_id, action=ChatAction.TYPING)
         
         if check_user_exist_groups(context.user_data['user_id']):
             # User joined groups, proceed to Twitter
-            keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            query.edit_message_text(settings.TELEGRAM_VERIFIED_MESSAGE, reply_markup=reply_markup)
+            edit(query, settings.TELEGRAM_VERIFIED_MESSAGE, reply_markup=PROCEED_TWITTER_MARKUP)
             
             # Update user step
             update_user_step(context.user_data['user_id'], 2, telegram_verified=True)
+            membership_scheduler.discard(context.user_data['user_id'])
             return TWITTER_SUBMIT
         else:
             # Still not in groups
-            query.edit_message_text(settings.NOT_IN_GROUP_MESSAGE + "\n\n⏳ I'll continue checking automatically every 30 seconds...")
+            edit(query, NOT_IN_GROUP_TEXT)
             return TELEGRAM_CHECK
     
     # Handle any text message in this state
     if hasattr(update, 'message') and update.message:
-        update.message.reply_text("⏳ I'm automatically checking your group membership. Please wait...")
+        reply(update.message, "⏳ I'm automatically checking your group membership. Please wait...")
     return TELEGRAM_CHECK
 
-def start_auto_membership_check(update, context):
-    """Start automatic membership checking in a separate thread"""
-    def auto_check():
-        # Handle both Message and CallbackQuery objects
-        if hasattr(update, 'callback_query') and update.callback_query:
-            chat_id = update.callback_query.message.chat_id
-        else:
-            chat_id = update.message.chat_id
-        user_id = context.user_data['user_id']
-        max_attempts = 20  # Check for 10 minutes (20 * 30 seconds)
-        attempt = 0
-        
-        while attempt < max_attempts:
-            time.sleep(30)  # Wait 30 seconds
-            attempt += 1
-            
-            try:
-                if check_user_exist_groups(user_id):
-                    # User joined! Send success message
-                    keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text="🎉 " + settings.TELEGRAM_VERIFIED_MESSAGE,
-                        reply_markup=reply_markup
-                    )
-                    
-                    # Update user step
-                    update_user_step(user_id, 2, telegram_verified=True)
-                    break
-                    
-            except Exception as e:
-                print(f"Error in auto membership check: {e}")
-                continue
-        
-        # If we've exhausted all attempts
-        if attempt >= max_attempts:
-            keyboard = [[InlineKeyboardButton("I've Joined - Check Again", callback_data="check_telegram")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="⏰ Automatic checking has timed out. Please use the button below to check manually:",
-                reply_markup=reply_markup
-            )
+def notify_membership_joined(bot, entry):
+    """Called by the membership scheduler once a waiting user has joined all groups"""
+    notify(bot, entry.chat_id, TELEGRAM_JOINED_TEXT, reply_markup=PROCEED_TWITTER_MARKUP)
     
-    # Start the checking thread
-    thread = threading.Thread(target=auto_check)
-    thread.daemon = True
-    thread.start()
+    # Update user step
+    update_user_step(entry.user_id, 2, telegram_verified=True)
+
+def notify_membership_timeout(bot, entry):
+    """Called by the membership scheduler once a user ran out of automatic checks"""
+    notify(bot, entry.chat_id, "⏰ Automatic checking has timed out. Please use the button below to check manually:",
+           reply_markup=CHECK_AGAIN_MARKUP)
+
+membership_scheduler = MembershipCheckScheduler(
+    check_batch=check_users_exist_groups,
+    on_joined=notify_membership_joined,
+    on_timeout=notify_membership_timeout,
+    interval=settings.MEMBERSHIP_CHECK_INTERVAL,
+    max_attempts=settings.MEMBERSHIP_CHECK_MAX_ATTEMPTS,
+    tick=settings.MEMBERSHIP_CHECK_TICK,
+    batch_size=settings.MEMBERSHIP_CHECK_BATCH_SIZE
+)
+
+def start_auto_membership_check(update, context):
+    """Queue the user for automatic membership checks on the shared scheduler"""
+    # Handle both Message and CallbackQuery objects
+    if hasattr(update, 'callback_query') and update.callback_query:
+        chat_id = update.callback_query.message.chat_id
+    else:
+        chat_id = update.message.chat_id
+    membership_scheduler.add(context.user_data['user_id'], chat_id)
 
 def handle_twitter_submit(update, context):
     """Handle Twitter follow and username submission"""
@@ -314,9 +410,7 @@ def handle_twitter_submit(update, context):
     
     if query and query.data == "proceed_twitter":
         query.answer()
-        query.edit_message_text(settings.TWITTER_FOLLOW_MESSAGE.format(
-            twitter_link=settings.TWITTER_PAGE_LINK
-        ))
+        edit(query, TWITTER_FOLLOW_TEXT)
         return TWITTER_SUBMIT
     
     # Handle username submission
@@ -331,7 +425,7 @@ def handle_twitter_submit(update, context):
             twitter_verification_status='pending'
         )
         
-        update.message.reply_text(settings.TWITTER_PENDING_MESSAGE.format(username=username))
+        reply(update.message, settings.TWITTER_PENDING_MESSAGE.format(username=username))
         return TWITTER_PENDING
     
     # Handle any other callback queries that shouldn't be processed here
@@ -340,76 +434,137 @@ def handle_twitter_submit(update, context):
         return TWITTER_SUBMIT
     
     if update.message:
-        update.message.reply_text("Please submit your X (Twitter) username.")
+        reply(update.message, "Please submit your X (Twitter) username.")
     return TWITTER_SUBMIT
 
 def handle_twitter_pending(update, context):
     """Handle users waiting for Twitter verification"""
-    # Check if admin has approved/rejected
-    try:
-        user = session.query(users_data).filter(users_data.telegram_id == context.user_data['user_id']).first()
-        if user:
-            if user.twitter_verification_status == 'approved':
-                keyboard = [[InlineKeyboardButton("Proceed to Submit Wallet", callback_data="proceed_wallet")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                update.message.reply_text(settings.TWITTER_APPROVED_MESSAGE, reply_markup=reply_markup)
-                update_user_step(context.user_data['user_id'], 3)
-                return WALLET_SUBMIT
-            elif user.twitter_verification_status == 'rejected':
-                keyboard = [[InlineKeyboardButton("Proceed to X Follow", callback_data="proceed_twitter")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                update.message.reply_text(settings.TWITTER_REJECTED_MESSAGE.format(
-                    reason="Please ensure you've followed our X account"
-                ))
-                return TWITTER_SUBMIT
-    except Exception as e:
-        print(f"Error checking Twitter status: {e}")
+    user_id = context.user_data['user_id']
+    
+    # Decisions made here arrive on the notification bus, and those made
+    # elsewhere are found by poll_twitter_statuses, so a cached 'pending'
+    # can be answered without touching the database
+    status = twitter_status_cache.get(user_id)
+    if status is None:
+        try:
+            with session_scope() as db:
+                user = db.query(users_data.twitter_verification_status).filter(users_data.telegram_id == user_id).first()
+            if user:
+                status = user.twitter_verification_status
+                twitter_status_cache.set(user_id, status)
+                if status in DECISIONS:
+                    # Answered now, so the poll doesn't announce it again
+                    claim_notice(user_id, status)
+        except Exception as e:
+            logger.error(f"Error checking Twitter status: {e}")
     
-    update.message.reply_text("⏳ Your X verification is still pending. Please wait for admin approval.")
+    if status == 'approved':
+        reply(update.message, settings.TWITTER_APPROVED_MESSAGE, reply_markup=PROCEED_WALLET_MARKUP)
+        update_user_step(user_id, 3)
+        return WALLET_SUBMIT
+    elif status == 'rejected':
+        reply(update.message, TWITTER_REJECTED_TEXT, reply_markup=PROCEED_TWITTER_MARKUP)
+        return TWITTER_SUBMIT
+    
+    reply(update.message, "⏳ Your X verification is still pending. Please wait for admin approval.")
     return TWITTER_PENDING
 
+def on_twitter_status(bot, event):
+    """Push an admin's X verification decision to the user as soon as it is committed"""
+    user_id = event['telegram_id']
+    status = event['status']
+    twitter_status_cache.set(user_id, status)
+    # Bulk moderation writes the row directly, not through update_user_step
+    user_cache.invalidate(user_id)
+    # Several workers may find the same decision by polling; one tells the user
+    if status in DECISIONS and not event.get('claimed', True) and not claim_notice(user_id, status):
+        return
+    
+    # Never write registration_step here: the event can arrive long after the
+    # decision, when the user may already be past the X step. An approval
+    # moves the user to the wallet step in the same UPDATE that records it.
+    if status == 'approved':
+        notify(bot, user_id, settings.TWITTER_APPROVED_MESSAGE, reply_markup=PROCEED_WALLET_MARKUP)
+    elif status == 'rejected':
+        if event.get('reason'):
+            text = settings.TWITTER_REJECTED_MESSAGE.format(reason=event['reason'])
+        else:
+            text = TWITTER_REJECTED_TEXT
+        notify(bot, user_id, text, reply_markup=PROCEED_TWITTER_MARKUP)
+
+def on_submission_status(bot, event):
+    """Keep the user's task statuses current and tell them about the decision"""
+    user_id = event['telegram_id']
+    status = event['status']
+    submission_status_index.update(user_id, event['task_id'], status)
+    
+    if status in ('approved', 'rejected'):
+        try:
+            task = task_catalog.get(event['task_id'])
+        except TaskCatalogError:
+            task = None
+        title = task['title'] if task else f"task {event['task_id']}"
+        if status == 'approved':
+            notify(bot, user_id, f"✅ Your submission for <b>{html.escape(title)}</b> was approved!", parse_mode='HTML')
+        else:
+            notify(bot, user_id, f"❌ Your submission for <b>{html.escape(title)}</b> was rejected.", parse_mode='HTML')
+
 def handle_wallet_submit(update, context):
     """Handle wallet address submission"""
     query = update.callback_query
     
     if query and query.data == "proceed_wallet":
         query.answer()
-        query.edit_message_text(settings.WALLET_PROMPT_MESSAGE)
+        edit(query, settings.WALLET_PROMPT_MESSAGE)
         return WALLET_SUBMIT
     
     # Handle wallet address submission
     if update.message and update.message.text:
         wallet_address = update.message.text.strip()
+        user_id = context.user_data['user_id']
         
-        # Basic Solana address validation (44 characters, base58)
-        if len(wallet_address) >= 32 and len(wallet_address) <= 44:
+        # Must be base58 for a 32 byte public key
+        if is_valid_address(wallet_address):
+            # One wallet per account
+            if wallet_index.claim(wallet_address, user_id) is not None:
+                logger.warning(f"User {user_id} submitted a wallet already used by another account")
+                reply(update.message, "❌ This wallet address is already registered to another account. Please submit your own wallet.")
+                return WALLET_SUBMIT
             try:
                 # Save wallet and mark as completed
-                update_user_step(
-                    context.user_data['user_id'],
+                saved = update_user_step(
+                    user_id,
                     4,
                     wallet=wallet_address,
                     wallet_submitted=True,
                     verified=True
                 )
+                if not saved:
+                    raise RuntimeError("wallet was not saved")
+                
+                # A new wallet can complete a cluster in the user's referral group
+                profile = user_cache.get(user_id)
+                if profile is not None:
+                    sybil_detector.mark(profile.referral_by)
                 
                 # Generate referral link
-                ref_link = f"https://t.me/greendale1_bot?start={context.user_data['user_id']}"
+                ref_link = referral_link(context.user_data['user_id'])
                 
                 # Format and send completion message with referral link
                 completion_message = settings.FINAL_SUCCESS_MESSAGE.format(ref_link=ref_link)
-                update.message.reply_text(completion_message)
+                reply(update.message, completion_message)
                 return COMPLETED
                 
             except Exception as e:
-                print(f"Error saving wallet: {e}")
-                update.message.reply_text(settings.ERROR_MESSAGE)
+                logger.error(f"Error saving wallet: {e}")
+                wallet_index.release(wallet_address, user_id)
+                reply(update.message, settings.ERROR_MESSAGE)
                 return WALLET_SUBMIT
         else:
-            update.message.reply_text("❌ Invalid Solana wallet address. Please enter a valid address.")
+            reply(update.message, "❌ Invalid Solana wallet address. Please enter a valid address.")
             return WALLET_SUBMIT
     
-    update.message.reply_text("Please submit your Solana wallet address.")
+    reply(update.message, "Please submit your Solana wallet address.")
     return WALLET_SUBMIT
 
 def handle_completed(update, context):
@@ -420,17 +575,61 @@ def handle_completed(update, context):
         return handle_task_submission_text(update, context)
     
     # Default completed message for other interactions
-    update.message.reply_text("✅ You have already completed the airdrop registration!\n\nThank you for participating in the Greendale Airdrop.")
+    reply(update.message, "✅ You have already completed the airdrop registration!\n\nThank you for participating in the Greendale Airdrop.")
     return COMPLETED
 
 def userInfo(update, context):
     """Handle /info command"""
     context.bot.send_chat_action(chat_id=update.message.chat_id, action=ChatAction.TYPING)
-    user_info = user_details_summary(int(update.message.from_user.id))
+    user_info = user_cache.summary(int(update.message.from_user.id))
     if user_info:
-        update.message.reply_text(user_info)
+        reply(update.message, user_info)
     else:
-        update.message.reply_text('User does not exist. Please use /start to signup')
+        reply(update.message, 'User does not exist. Please use /start to signup')
+
+def leaderboard_command(update, context):
+    """Handle /leaderboard command"""
+    top = referral_index.leaderboard(settings.LEADERBOARD_SHOWN)
+    if not top:
+        reply(update.message, "🏆 No referrals yet. Share your referral link to be the first on the leaderboard!")
+        return
+    
+    lines = ["🏆 <b>Top Referrers</b>\n"]
+    for rank, (referrer_id, count) in enumerate(top, 1):
+        profile = user_cache.get(referrer_id)
+        name = f"@{profile.username}" if profile and profile.username else f"User {str(referrer_id)[-4:]}"
+        lines.append(f"{rank}. {html.escape(name)} - {count} referrals")
+    
+    user_id = update.message.from_user.id
+    lines.append(f"\n👥 Your referrals: {referral_index.count(user_id)}")
+    reply(update.message, "\n".join(lines), parse_mode='HTML')
+
+def reload_referral_index(context):
+    """Pick up referrals registered by other workers"""
+    try:
+        referral_index.load()
+    except Exception as e:
+        logger.error(f"Error reloading referral index: {e}")
+
+def poll_twitter_statuses(context):
+    """Announce X verification decisions made by other workers or directly in the database"""
+    try:
+        poll_decisions(
+            twitter_status_cache,
+            lambda telegram_id, status: publish_twitter_status(telegram_id, status, claimed=False),
+            chunk_size=settings.TWITTER_STATUS_POLL_CHUNK
+        )
+    except Exception as e:
+        logger.error(f"Error polling X verification statuses: {e}")
+
+def rescore_sybil_groups(context):
+    """Incremental sybil scoring of referral groups that changed"""
+    try:
+        summary = sybil_detector.run_incremental()
+        if summary and summary['flagged']:
+            logger.info(f"Sybil rescoring flagged {summary['flagged']} of {summary['users']} users")
+    except Exception as e:
+        logger.error(f"Error rescoring sybil groups: {e}")
 
 def call_back(update, context):
     """Handle callback queries not handled by conversation handler"""
@@ -438,13 +637,13 @@ def call_back(update, context):
     callback_data = query.data
     
     # Filter out conversation-related callbacks to prevent conflicts
-    conversation_callbacks = ["proceed_twitter", "proceed_wallet", "check_telegram"]
+    conversation_callbacks = ["start_registration", "proceed_twitter", "proceed_wallet", "check_telegram"]
     if callback_data in conversation_callbacks:
         # Let the conversation handler deal with these
         return
     
     query.answer()
-    print(f"callback called {callback_data}")
+    logger.debug(f"callback called {callback_data}")
     
     if callback_data == "view_tasks":
         show_available_tasks(query, context.user_data)
@@ -457,202 +656,93 @@ def call_back(update, context):
     elif callback_data.startswith("submit_task_"):
         task_id = callback_data.split("_")[2]
         handle_task_submit(query, context.user_data, task_id)
-    elif callback_data == "start_registration":
-        # Handle Start Registration button press
-        # Get user_id from callback query and add to user_data
-        user_id = query.from_user.id
-        context.user_data['user_id'] = user_id
-        
-        # Create a mock update object that mimics message structure for compatibility
-        class MockUpdate:
-            def __init__(self, callback_query):
-                self.message = callback_query
-                self.callback_query = callback_query
-        
-        mock_update = MockUpdate(query)
-        return check_telegram_membership(mock_update, context)
 
 def show_available_tasks(update, user_data):
     """Show list of available tasks with completion status"""
     try:
-        print("[DEBUG] show_available_tasks called")
+        logger.debug("show_available_tasks called")
         user_id = update.callback_query.from_user.id if hasattr(update, 'callback_query') else update.from_user.id
         
         # Fetch all tasks
-        tasks_response = requests.get('http://localhost:5000/api/tasks')
-        print(f"[DEBUG] API response status: {tasks_response.status_code}")
-        
-        if tasks_response.status_code != 200:
-            print(f"[DEBUG] API error in show_available_tasks: {tasks_response.status_code}")
-            update.edit_message_text("❌ Error fetching tasks. Please try again later.")
+        try:
+            all_tasks = task_catalog.tasks()
+        except TaskCatalogError as e:
+            logger.warning(f"API error in show_available_tasks: {e}")
+            edit(update, "❌ Error fetching tasks. Please try again later.")
             return
-            
-        tasks_data = tasks_response.json()
-        all_tasks = tasks_data.get('tasks', [])
-        print(f"[DEBUG] Found {len(all_tasks)} tasks in show_available_tasks")
+        logger.debug(f"Found {len(all_tasks)} tasks in show_available_tasks")
         
         if not all_tasks:
-            update.edit_message_text("❌ No active tasks available at the moment.")
+            edit(update, "❌ No active tasks available at the moment.")
             return
         
-        # Fetch user submissions
-        submissions_response = requests.get(f'http://localhost:5000/api/user_submissions/{user_id}')
-        user_submissions = []
-        if submissions_response.status_code == 200:
-            submissions_data = submissions_response.json()
-            if submissions_data.get('success'):
-                user_submissions = submissions_data.get('submissions', [])
-        
-        # Categorize tasks
-        completed_tasks = []
-        new_tasks = []
-        
-        submitted_task_ids = {sub['task_id'] for sub in user_submissions}
-        
-        for task in all_tasks:
-            if task['id'] in submitted_task_ids:
-                # Find the submission status
-                submission = next((sub for sub in user_submissions if sub['task_id'] == task['id']), None)
-                task['submission_status'] = submission['status'] if submission else 'pending'
-                completed_tasks.append(task)
-            else:
-                new_tasks.append(task)
-        
-        # Build message
-        message = ""
-        
-        keyboard = []
-        
-        # Add new tasks section
-        if new_tasks:
-            for task in new_tasks:
-                button_text = f"🆕 {task['title']}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=f"task_{task['id']}")])
-                print(f"[DEBUG] Added new task: {task['title']} (ID: {task['id']})")
-            message += "\n"
-        
-        # Add completed tasks section
-        if completed_tasks:
-            message += "✅ <b>Your Submissions</b>\n"
-            for task in completed_tasks:
-                status_emoji = {
-                    'pending': '⏳',
-                    'approved': '✅', 
-                    'rejected': '❌'
-                }.get(task['submission_status'], '⏳')
-                button_text = f"{status_emoji} {task['title']}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=f"task_{task['id']}")])
-                print(f"[DEBUG] Added completed task: {task['title']} (ID: {task['id']}, Status: {task['submission_status']})")
-        
-        if not keyboard:
-            update.edit_message_text("❌ No tasks available at the moment.")
+        # Buttons are prebuilt per catalog version; only the status emojis depend on the user
+        statuses = submission_status_index.get(user_id)
+        message, reply_markup = task_renderer.task_menu(statuses)
+        if reply_markup is None:
+            edit(update, "❌ No tasks available at the moment.")
             return
-            
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
-        print("[DEBUG] Tasks message sent successfully from show_available_tasks")
+        
+        edit(update, message, reply_markup=reply_markup, parse_mode='HTML')
+        logger.debug("Tasks message sent successfully from show_available_tasks")
         
     except Exception as e:
-        print(f"Error fetching tasks: {e}")
-        update.edit_message_text("❌ Error fetching tasks. Please try again later.")
+        logger.error(f"Error fetching tasks: {e}")
+        edit(update, "❌ Error fetching tasks. Please try again later.")
+
+def submission_statuses(user_submissions):
+    """task_id -> submission status, the first submission per task wins"""
+    statuses = {}
+    for submission in user_submissions:
+        statuses.setdefault(str(submission['task_id']), submission.get('status') or 'pending')
+    return statuses
 
 def show_task_details(update, user_data, task_id):
     """Show detailed information about a specific task"""
     try:
-        response = requests.get('http://localhost:5000/api/tasks')
-        if response.status_code == 200:
-            data = response.json()
-            tasks = data.get('tasks', [])
-            
-            task = next((t for t in tasks if str(t['id']) == str(task_id)), None)
-            if not task:
-                update.edit_message_text("❌ Task not found.")
-                return
-            
-            message = f"🎯 <b>{task['title']}</b>\n\n"
-            message += f"📝 <b>Description:</b>\n{task['description']}\n\n"
-            message += f"🔗 <b>Type:</b> {task['task_type'].title()}\n\n"
-            
-            if task.get('requirements'):
-                message += f"📋 <b>Requirements:</b>\n{task['requirements']}\n\n"
-            
-            keyboard = [
-                [InlineKeyboardButton("🚀 Proceed", callback_data=f"proceed_task_{task_id}")],
-                [InlineKeyboardButton("⬅️ Back to Tasks", callback_data="view_tasks")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            update.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
-        else:
-            update.edit_message_text("❌ Error fetching task details. Please try again later.")
+        fragments = task_renderer.get(task_id)
+        if not fragments:
+            edit(update, "❌ Task not found.")
+            return
+        
+        message, reply_markup = fragments.detail
+        edit(update, message, reply_markup=reply_markup, parse_mode='HTML')
     except Exception as e:
-        print(f"Error fetching task details: {e}")
-        update.edit_message_text("❌ Error fetching task details. Please try again later.")
+        logger.error(f"Error fetching task details: {e}")
+        edit(update, "❌ Error fetching task details. Please try again later.")
 
 def handle_task_proceed(update, user_data, task_id):
     """Handle when user clicks Proceed on a task"""
     try:
-        response = requests.get('http://localhost:5000/api/tasks')
-        if response.status_code == 200:
-            data = response.json()
-            tasks = data.get('tasks', [])
-            
-            task = next((t for t in tasks if str(t['id']) == str(task_id)), None)
-            if not task:
-                update.edit_message_text("❌ Task not found.")
-                return
-            
-            message = f"🎯 <b>{task['title']}</b>\n\n"
-            message += f"📝 Platform: {task.get('task_type', 'General').title()}\n"
-            message += f"Task: {task['description']}\n\n"
-            
-            message += "✨ <b>Complete this task to receive more airdrop allocation!</b>\n\n"
-            
-            if task.get('requirements'):
-                message += f"📋 <b>Requirements:</b>\n{task['requirements']}\n\n"
-            
-            message += "✅ <b>After completing, please submit the proof as a reply to this message.</b>\n\n"
-            message += "📎 Please provide the link or proof of completion:"
-            
-            keyboard = [
-                [InlineKeyboardButton("📤 Submit Proof", callback_data=f"submit_task_{task_id}")],
-                [InlineKeyboardButton("⬅️ Back", callback_data=f"task_{task_id}")]
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            update.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
-            
-            # Store task_id in user context for submission
-            user_data['current_task_id'] = task_id
-        else:
-            update.edit_message_text("❌ Error fetching task details. Please try again later.")
+        try:
+            fragments = task_renderer.get(task_id)
+        except TaskCatalogError:
+            edit(update, "❌ Error fetching task details. Please try again later.")
+            return
+        if not fragments:
+            edit(update, "❌ Task not found.")
+            return
+        
+        message, reply_markup = fragments.proceed
+        edit(update, message, reply_markup=reply_markup, parse_mode='HTML')
+        
+        # Store task_id in user context for submission
+        user_data['current_task_id'] = task_id
     except Exception as e:
-        print(f"Error handling task proceed: {e}")
-        update.edit_message_text("❌ Error processing request. Please try again later.")
+        logger.error(f"Error handling task proceed: {e}")
+        edit(update, "❌ Error processing request. Please try again later.")
 
 def handle_task_submit(update, user_data, task_id):
     """Handle task submission request"""
     try:
-        message = "📤 <b>Submit Your Proof</b>\n\n"
-        message += "Please reply to this message with your proof of completion:\n\n"
-        message += "• For Twitter tasks: Share the tweet link\n"
-        message += "• For Telegram tasks: Share your username\n"
-        message += "• For other tasks: Share the relevant link or proof\n\n"
-        message += "⏳ <i>Waiting for your submission...</i>"
-        
-        keyboard = [
-            [InlineKeyboardButton("⬅️ Back", callback_data=f"proceed_task_{task_id}")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.edit_message_text(message, reply_markup=reply_markup, parse_mode='HTML')
+        edit(update, TASK_SUBMIT_TEXT, reply_markup=task_submit_markup(task_id), parse_mode='HTML')
         
         # Store task_id for text submission handler
         user_data['awaiting_submission'] = task_id
         
     except Exception as e:
-        print(f"Error handling task submit: {e}")
-        update.edit_message_text("❌ Error processing request. Please try again later.")
+        logger.error(f"Error handling task submit: {e}")
+        edit(update, "❌ Error processing request. Please try again later.")
 
 def handle_task_submission_text(update, context):
     """Handle text submissions for tasks"""
@@ -662,8 +752,27 @@ def handle_task_submission_text(update, context):
     task_id = context.user_data['awaiting_submission']
     submission_text = update.message.text
     user_id = update.message.from_user.id
+    proof = normalize_proof(submission_text)
+    claimed = False
     
     try:
+        # Refuse proofs already used before anything is sent to the backend
+        try:
+            submission_index.claim(task_id, proof, user_id)
+            claimed = True
+        except SubmissionRejected as rejected:
+            if rejected.kind == 'collision':
+                record_collision(task_id, proof, user_id, rejected.owner_id, submission_text)
+                # A proof shared inside one referral group is a sybil signal
+                profile = user_cache.get(user_id)
+                if profile is not None:
+                    sybil_detector.mark(profile.referral_by)
+                logger.warning(f"Submission collision: user {user_id} reused proof of user {rejected.owner_id} for task {task_id}")
+                reply(update.message, "❌ This proof has already been submitted by another account.")
+            else:
+                reply(update.message, "ℹ️ You have already submitted this proof for this task.")
+            return
+        
         # Submit to backend API
         payload = {
             'user_id': user_id,
@@ -671,10 +780,12 @@ def handle_task_submission_text(update, context):
             'submission_link': submission_text
         }
         
-        response = requests.post('http://localhost:5000/api/submit_task', json=payload)
+        response = tasks_http.post(f'{settings.TASKS_API_URL}/submit_task', json=payload)
         
         if response.status_code == 200:
-            update.message.reply_text(
+            claimed = False
+            submission_status_index.update(user_id, task_id, 'pending', only_new=True)
+            reply(update.message,
                 "✅ <b>Submission Received!</b>\n\n"
                 "Thank you! Your submission is under review.\n\n"
                 "📋 <b>What you submitted:</b>\n"
@@ -687,11 +798,18 @@ def handle_task_submission_text(update, context):
         else:
             error_data = response.json()
             error_message = error_data.get('error', 'Unknown error occurred')
-            update.message.reply_text(f"❌ Error: {error_message}")
+            reply(update.message, f"❌ Error: {error_message}")
             
     except Exception as e:
-        print(f"Error submitting task: {e}")
-        update.message.reply_text("❌ Error submitting task. Please try again later.")
+        logger.error(f"Error submitting task: {e}")
+        reply(update.message, "❌ Error submitting task. Please try again later.")
+    finally:
+        # The backend did not take it, so the proof can be submitted again
+        if claimed:
+            try:
+                submission_index.release(task_id, proof, user_id)
+            except Exception as e:
+                logger.error(f"Error releasing submission proof: {e}")
 
 def tasks_command(update, context):
     """Handle /tasks command"""
@@ -699,76 +817,53 @@ def tasks_command(update, context):
         user_id = update.message.from_user.id
         
         # Fetch all tasks
-        tasks_response = requests.get('http://localhost:5000/api/tasks')
-        
-        if tasks_response.status_code != 200:
-            update.message.reply_text("❌ Error fetching tasks. Please try again later.")
+        try:
+            all_tasks = task_catalog.tasks()
+        except TaskCatalogError:
+            reply(update.message, "❌ Error fetching tasks. Please try again later.")
             return
-            
-        tasks_data = tasks_response.json()
-        all_tasks = tasks_data.get('tasks', [])
         
         if not all_tasks:
-            update.message.reply_text("❌ No active tasks available at the moment.")
+            reply(update.message, "❌ No active tasks available at the moment.")
             return
         
-        # Fetch user submissions
-        submissions_response = requests.get(f'http://localhost:5000/api/user_submissions/{user_id}')
-        user_submissions = []
-        
-        if submissions_response.status_code == 200:
-            submissions_data = submissions_response.json()
-            user_submissions = submissions_data.get('submissions', [])
-        
-        # Create a set of task IDs that user has submitted
-        submitted_task_ids = {sub['task_id'] for sub in user_submissions}
-        
-        # Categorize tasks
-        new_tasks = [task for task in all_tasks if task['id'] not in submitted_task_ids]
-        completed_tasks = [task for task in all_tasks if task['id'] in submitted_task_ids]
-        
-        # Build message
-        message = ""
-        
-        keyboard = []
-        
-        # Add new tasks section
-        if new_tasks:
-            for task in new_tasks:
-                button_text = f"🆕 {task['title']}"
-                keyboard.append([InlineKeyboardButton(button_text, callback_data=f"task_{task['id']}")])
-            message += "\n"
-        
-        # Add completed tasks section
-        if completed_tasks:
-            message += "📋 <b>Your Submissions</b>\n"
-            for task in completed_tasks:
-                # Find the submission for this task
-                submission = next((sub for sub in user_submissions if sub['task_id'] == task['id']), None)
-                if submission:
-                    status_emoji = "✅" if submission['status'] == 'approved' else "⏳" if submission['status'] == 'pending' else "❌"
-                    message += f"• {status_emoji} {task['title']} - {submission['status'].title()}\n"
-                    button_text = f"{status_emoji} {task['title']}"
-                    keyboard.append([InlineKeyboardButton(button_text, callback_data=f"task_{task['id']}")])
-            message += "\n"
-        
-        if not new_tasks and not completed_tasks:
-            message += "❌ No tasks available at the moment."
-        else:
-            message += "Tap on any task to view details!"
+        message, reply_markup = task_renderer.task_summary(submission_status_index.get(user_id))
+        if reply_markup is None:
+            reply(update.message, "❌ No tasks available at the moment.")
+            return
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(message, reply_markup=reply_markup, parse_mode='HTML')
+        reply(update.message, message, reply_markup=reply_markup, parse_mode='HTML')
         
     except Exception as e:
-        print(f"Error fetching tasks: {e}")
-        update.message.reply_text("❌ Error fetching tasks. Please try again later.")
+        logger.error(f"Error fetching tasks: {e}")
+        reply(update.message, "❌ Error fetching tasks. Please try again later.")
 
 def error(update, context):
     """Log Errors caused by Updates."""
-    print(f'Update "{update}" caused error "{context.error}"')
+    logger.error(f'Update caused error "{context.error}"', exc_info=context.error)
 
 
+def make_persistence():
+    """Conversation state and user_data store shared by all workers (None keeps it in memory)"""
+    return create_persistence(
+        settings.PERSISTENCE_BACKEND,
+        filename=settings.PERSISTENCE_FILE,
+        cache_ttl=settings.PERSISTENCE_CACHE_TTL,
+        flush_interval=settings.PERSISTENCE_FLUSH_INTERVAL
+    )
+
+
+def instrument_handlers(handlers):
+    """Time every handler callback (conversation states included) under its function name"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not getattr(handler.callback, '__wrapped__', None):
+            handler.callback = metrics.timed('handler')(handler.callback)
+
 def setup_handlers(dp):
     """Setup all handlers for the dispatcher - used by both polling and webhook modes"""
     # Add conversation handler with the enhanced workflow states
@@ -776,7 +871,7 @@ def setup_handlers(dp):
         entry_points=[CommandHandler('start', start)],
         states={
             TELEGRAM_CHECK: [
-                CallbackQueryHandler(handle_telegram_check),
+                CallbackQueryHandler(handle_telegram_check, pattern='^(start_registration|check_telegram)$'),
                 MessageHandler(Filters.text, handle_telegram_check)
             ],
             TWITTER_SUBMIT: [
@@ -784,6 +879,9 @@ def setup_handlers(dp):
                 MessageHandler(Filters.text, handle_twitter_submit)
             ],
             TWITTER_PENDING: [
+                # Buttons from pushed approve/reject notifications
+                CallbackQueryHandler(handle_wallet_submit, pattern='^proceed_wallet$'),
+                CallbackQueryHandler(handle_twitter_submit, pattern='^proceed_twitter$'),
                 MessageHandler(Filters.text, handle_twitter_pending)
             ],
             WALLET_SUBMIT: [
@@ -795,24 +893,71 @@ def setup_handlers(dp):
             ],
         },
         fallbacks=[CommandHandler('start', start)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='registration',
+        persistent=dp.persistence is not None
     )
     
     dp.add_handler(CommandHandler('info', userInfo))
     dp.add_handler(CommandHandler('tasks', tasks_command))
+    dp.add_handler(CommandHandler('leaderboard', leaderboard_command))
     dp.add_handler(conv_handler)
     dp.add_handler(CallbackQueryHandler(call_back))
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_task_submission_text))
     dp.add_error_handler(error)
+    for group in dp.handlers.values():
+        instrument_handlers(group)
+    
+    # Wallets already used by an account, for duplicate checks
+    report = wallet_index.load()
+    logger.info(f"Wallet index loaded: {report['checked']} wallets, {len(report['invalid'])} invalid, "
+                f"{len(report['duplicates'])} shared by several accounts")
+    
+    # Proofs already submitted, for duplicate checks
+    logger.info(f"Submission index loaded: {submission_index.load()} proofs")
+    
+    # Referral graph for the leaderboard, rebuilt now and then for other workers' referrals
+    logger.info(f"Referral index loaded: {referral_index.load()} referrals")
+    dp.job_queue.run_repeating(reload_referral_index, interval=settings.REFERRAL_INDEX_RELOAD,
+                               first=settings.REFERRAL_INDEX_RELOAD)
+    
+    # Referral groups that gained users or wallets are rescored for sybil farms
+    dp.job_queue.run_repeating(rescore_sybil_groups, interval=settings.SYBIL_INCREMENTAL_INTERVAL,
+                               first=settings.SYBIL_INCREMENTAL_INTERVAL)
+    
+    # Automatic membership re-checks run on the dispatcher's job queue
+    membership_scheduler.start(dp.job_queue)
+    
+    # Message users as soon as their X verification is decided
+    notification_bus.subscribe('twitter_status', lambda event: on_twitter_status(dp.bot, event))
+    # Watch users already waiting, for decisions made by other workers or in the database
+    logger.info(f"Users waiting for X verification: {load_waiting(twitter_status_cache, settings.TWITTER_STATUS_POLL_CHUNK)}")
+    dp.job_queue.run_repeating(poll_twitter_statuses, interval=settings.TWITTER_STATUS_POLL_INTERVAL,
+                               first=settings.TWITTER_STATUS_POLL_INTERVAL)
+    notification_bus.subscribe('submission_status', lambda event: on_submission_status(dp.bot, event))
+
+def configure_logging():
+    """Structured logging through the background writer, configured from settings"""
+    return setup_logging(
+        level=settings.LOG_LEVEL,
+        fmt=settings.LOG_FORMAT,
+        path=settings.LOG_FILE or None,
+        debug_sample_rate=settings.LOG_DEBUG_SAMPLE_RATE,
+        queue_size=settings.LOG_QUEUE_SIZE
+    )
 
 def main():
+    configure_logging()
+    
     # Create the Updater and pass it your bot's token with improved timeout settings.
     updater = Updater(
         settings.TELEGRAM_TOKEN,
+        base_url=f'{settings.TELEGRAM_API_URL}/bot',
         request_kwargs={
             'connect_timeout': 60.0,
             'read_timeout': 60.0,
         },
+        persistence=make_persistence(),
         use_context=True
     )
     
@@ -820,6 +965,13 @@ def main():
     dp = updater.dispatcher
     setup_handlers(dp)
     
+    # Process updates in order per user, in parallel across users
+    route_dispatcher_updates(dp, UpdateQueue(
+        dp.process_update,
+        workers=settings.UPDATE_WORKERS,
+        max_size=settings.UPDATE_QUEUE_SIZE
+    ))
+    
     # Start the Bot with enhanced polling
     updater.start_polling(
         poll_interval=1.0,
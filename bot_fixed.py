@@ -4,13 +4,16 @@
 # Import the original bot code and modify the main function
 from bot import *
 import time
+import logging
 import requests
 
+logger = logging.getLogger(__name__)
+
 def force_clear_updates():
     """Aggressively clear any pending updates"""
     try:
         # Get current updates to find the highest offset
-        url = f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getUpdates"
+        url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_TOKEN}/getUpdates"
         response = requests.get(url, params={'limit': 100, 'timeout': 1})
         
         if response.status_code == 200:
@@ -20,21 +23,22 @@ def force_clear_updates():
                 if updates:
                     # Get the highest update_id and confirm it
                     highest_id = max(update['update_id'] for update in updates)
-                    confirm_url = f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getUpdates"
+                    confirm_url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_TOKEN}/getUpdates"
                     requests.get(confirm_url, params={'offset': highest_id + 1, 'limit': 1, 'timeout': 1})
-                    print(f"Cleared {len(updates)} pending updates, highest ID: {highest_id}")
+                    logger.info(f"Cleared {len(updates)} pending updates, highest ID: {highest_id}")
                 else:
-                    print("No pending updates found")
+                    logger.info("No pending updates found")
             else:
-                print(f"API Error: {data}")
+                logger.error(f"API Error: {data}")
         else:
-            print(f"HTTP Error: {response.status_code}")
+            logger.error(f"HTTP Error: {response.status_code}")
     except Exception as e:
-        print(f"Error clearing updates: {e}")
+        logger.error(f"Error clearing updates: {e}")
 
 def main_fixed():
     """Enhanced main function with conflict resolution"""
-    print("Starting bot with conflict resolution...")
+    configure_logging()
+    logger.info("Starting bot with conflict resolution...")
     
     # Force clear any pending updates
     force_clear_updates()
@@ -45,10 +49,12 @@ def main_fixed():
     # Create the Updater with enhanced settings
     updater = Updater(
         settings.TELEGRAM_TOKEN,
+        base_url=f'{settings.TELEGRAM_API_URL}/bot',
         request_kwargs={
             'connect_timeout': 60.0,
             'read_timeout': 60.0,
         },
+        persistence=make_persistence(),
         use_context=True
     )
     
@@ -56,8 +62,15 @@ def main_fixed():
     dp = updater.dispatcher
     setup_handlers(dp)
     
+    # Process updates in order per user, in parallel across users
+    route_dispatcher_updates(dp, UpdateQueue(
+        dp.process_update,
+        workers=settings.UPDATE_WORKERS,
+        max_size=settings.UPDATE_QUEUE_SIZE
+    ))
+    
     # Start polling with custom parameters
-    print("Starting polling...")
+    logger.info("Starting polling...")
     updater.start_polling(
         poll_interval=1.0,
         timeout=30,
@@ -65,7 +78,7 @@ def main_fixed():
         bootstrap_retries=-1
     )
     
-    print("Bot is running! Press Ctrl+C to stop.")
+    logger.info("Bot is running! Press Ctrl+C to stop.")
     updater.idle()
 
 if __name__ == '__main__':
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bulk broadcast engine for notifying registered users.
+
+Recipients are streamed from ``users_data`` in keyset-paginated batches
+(``telegram_id > last_id ORDER BY telegram_id LIMIT n``), so memory use does
+not depend on the number of users. Messages go out through the
+rate-limited send queue as background traffic.
+
+A broadcast's text, progress and state live in the ``broadcasts`` table, so
+every Gunicorn worker can report on it or stop it. The worker sending it
+holds a lease on the row (``owner``, ``lease_until``) and renews it while it
+works; another worker can only take the broadcast over once the lease has
+expired, i.e. its owner died. Progress is checkpointed after every batch
+has been handed to Telegram, and a broadcast started again with the same id
+resumes after the last checkpointed user.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+
+from sqlalchemy import Column, BigInteger, Boolean, Float, Integer, String, Text, or_, select, update
+from sqlalchemy.orm import declarative_base
+
+from lib.db import session_scope, insert_if_missing
+from lib.models import users_data
+from lib.send_queue import BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+Base = declarative_base()
+
+# Columns a broadcast may be filtered on
+FILTER_FIELDS = ('registration_step', 'verified', 'twitter_verification_status')
+
+
+class BroadcastRecord(Base):
+    """A broadcast's message, progress and current owner"""
+    __tablename__ = 'broadcasts'
+
+    id = Column(String(64), primary_key=True)
+    text = Column(Text, nullable=False)
+    filters = Column(Text, nullable=False)  # JSON
+    parse_mode = Column(String(16), nullable=True)
+    state = Column(String(16), nullable=False)
+    last_id = Column(BigInteger, nullable=True)
+    sent = Column(Integer, nullable=False)
+    failed = Column(Integer, nullable=False)
+    elapsed = Column(Float, nullable=False)
+    stop_requested = Column(Boolean, nullable=False)
+    owner = Column(String(128), nullable=True)
+    lease_until = Column(Float, nullable=True)  # time.time()
+    updated_at = Column(Float, nullable=False)
+
+
+def _status(record):
+    state = record.state
+    if state == 'running' and (record.lease_until or 0) < time.time():
+        # Its worker died mid-broadcast
+        state = 'interrupted'
+    processed = record.sent + record.failed
+    return {
+        'id': record.id,
+        'state': state,
+        'filters': json.loads(record.filters),
+        'last_id': record.last_id,
+        'sent': record.sent,
+        'failed': record.failed,
+        'stop_requested': record.stop_requested,
+        'elapsed_s': round(record.elapsed, 3),
+        'messages_per_s': round(processed / record.elapsed, 2) if record.elapsed else 0.0,
+    }
+
+
+def get_status(broadcast_id):
+    """Progress of a broadcast as of its last checkpoint, or None if there is no such broadcast"""
+    with session_scope() as db:
+        record = db.get(BroadcastRecord, broadcast_id)
+        return _status(record) if record is not None else None
+
+
+def request_stop(broadcast_id):
+    """Ask the worker sending a broadcast to stop after its current batch; returns the status or None"""
+    with session_scope() as db:
+        db.execute(
+            update(BroadcastRecord.__table__)
+            .where(BroadcastRecord.id == broadcast_id)
+            .values(stop_requested=True, updated_at=time.time())
+        )
+    return get_status(broadcast_id)
+
+
+class Broadcast(object):
+    """One message sent to every user matching ``filters``"""
+
+    def __init__(self, broadcast_id, bot, send_queue, text=None, filters=None, parse_mode=None,
+                 batch_size=500, lease_seconds=60):
+        filters = dict(filters or {})
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unsupported broadcast filters: {', '.join(sorted(unknown))}")
+
+        self.id = broadcast_id
+        self.bot = bot
+        self.send_queue = send_queue
+        self.text = text
+        self.filters = filters
+        self.parse_mode = parse_mode
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        # Unique per instance, so two starts in one process don't share a lease either
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        self.last_id = None
+        self.sent = 0
+        self.failed = 0
+        self.state = 'created'
+        self._elapsed_before = 0.0
+        self._started_at = None
+        self._renewed_at = 0.0
+        self._lost = False
+        self._stop = threading.Event()
+
+    ## lease
+
+    def _create(self):
+        """Insert the broadcast's row unless it exists; returns False for an unknown id without text"""
+        with session_scope() as db:
+            if db.get(BroadcastRecord, self.id) is not None:
+                return True
+            if not self.text:
+                return False
+            insert_if_missing(db, BroadcastRecord, 'id', {
+                'id': self.id,
+                'text': self.text,
+                'filters': json.dumps(self.filters),
+                'parse_mode': self.parse_mode,
+                'state': 'created',
+                'last_id': None,
+                'sent': 0,
+                'failed': 0,
+                'elapsed': 0.0,
+                'stop_requested': False,
+                'owner': None,
+                'lease_until': None,
+                'updated_at': time.time(),
+            })
+        return True
+
+    def _acquire(self):
+        """Take the lease unless a live worker holds it or the broadcast is done; loads the progress"""
+        now = time.time()
+        table = BroadcastRecord.__table__
+        with session_scope() as db:
+            taken = db.execute(
+                update(table)
+                .where(table.c.id == self.id, table.c.state != 'completed',
+                       or_(table.c.owner.is_(None), table.c.lease_until < now))
+                .values(owner=self.owner, lease_until=now + self.lease_seconds, state='running',
+                        stop_requested=False, updated_at=now)
+            ).rowcount == 1
+            if not taken:
+                return False
+            record = db.get(BroadcastRecord, self.id)
+            # Resuming sends the stored message, whatever the request said
+            self.text = record.text
+            self.filters = json.loads(record.filters)
+            self.parse_mode = record.parse_mode
+            self.last_id = record.last_id
+            self.sent = record.sent
+            self.failed = record.failed
+            self._elapsed_before = record.elapsed
+        self._renewed_at = now
+        return True
+
+    def _checkpoint(self, state='running', force=True):
+        """Save the progress and renew the lease; False if a stop was requested or the lease was lost.
+
+        Without ``force`` nothing is written until a third of the lease has gone by.
+        """
+        if self._lost:
+            return False
+        now = time.time()
+        if not force and now < self._renewed_at + self.lease_seconds / 3:
+            return not self._stop.is_set()
+        done = state != 'running'
+        table = BroadcastRecord.__table__
+        with session_scope() as db:
+            owned = db.execute(
+                update(table)
+                .where(table.c.id == self.id, table.c.owner == self.owner)
+                .values(state=state, last_id=self.last_id, sent=self.sent, failed=self.failed,
+                        elapsed=self.elapsed(), owner=None if done else self.owner,
+                        lease_until=None if done else now + self.lease_seconds, updated_at=now)
+            ).rowcount == 1
+            stop_requested = owned and db.execute(
+                select(table.c.stop_requested).where(table.c.id == self.id)
+            ).scalar()
+        self._renewed_at = now
+        if not owned:
+            self._lost = True
+            logger.error(f"Broadcast {self.id}: lease lost to another worker, stopping")
+        if not owned or stop_requested:
+            self._stop.set()
+        return not self._stop.is_set()
+
+    ## sending
+
+    def _next_batch(self):
+        with session_scope() as db:
+            query = db.query(users_data.telegram_id)
+            for field, value in self.filters.items():
+                query = query.filter(getattr(users_data, field) == value)
+            if self.last_id is not None:
+                query = query.filter(users_data.telegram_id > self.last_id)
+            rows = query.order_by(users_data.telegram_id).limit(self.batch_size).all()
+        return [row[0] for row in rows]
+
+    def start(self):
+        """Start sending in a background thread.
+
+        Returns False if there is no broadcast with this id and no text to
+        create it with, None if it is completed or another worker is sending
+        it, and True if this worker took it.
+        """
+        if not self._create():
+            return False
+        if not self._acquire():
+            return None
+        self._stop.clear()
+        threading.Thread(target=self.run, name=f'broadcast-{self.id}', daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        self.state = 'running'
+        self._started_at = time.monotonic()
+        try:
+            while self._checkpoint():
+                recipients = self._next_batch()
+                if not recipients:
+                    self.state = 'completed'
+                    break
+
+                # Don't let a broadcast push interactive traffic out of the send queue
+                while len(self.send_queue) > self.send_queue.max_size // 2 and self._checkpoint(force=False):
+                    time.sleep(0.5)
+
+                futures = [
+                    self.send_queue.submit(chat_id, self.bot.send_message, kwargs={
+                        'chat_id': chat_id,
+                        'text': self.text,
+                        'parse_mode': self.parse_mode,
+                    }, priority=BACKGROUND)
+                    for chat_id in recipients
+                ]
+                # Sent messages can't be taken back: finish the batch, keeping the lease alive
+                pending = futures
+                while pending:
+                    pending = wait(pending, timeout=self.lease_seconds / 3).not_done
+                    self._checkpoint(force=False)
+                for future in futures:
+                    if future.exception() is None:
+                        self.sent += 1
+                    else:
+                        self.failed += 1
+                self.last_id = recipients[-1]
+            else:
+                self.state = 'stopped'
+        except Exception as e:
+            logger.error(f"Broadcast {self.id} failed: {e}")
+            self.state = 'failed'
+        finally:
+            self._checkpoint(self.state)
+
+    def elapsed(self):
+        if self._started_at is None:
+            return self._elapsed_before
+        return self._elapsed_before + time.monotonic() - self._started_at
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Thread-safe database sessions for the dispatcher and webhook workers.
+
+Every thread gets its own session from a ``scoped_session`` registry backed
+by a tuned connection pool. Work is wrapped in :func:`session_scope`, which
+commits or rolls back only that thread's unit of work and then returns the
+connection to the pool.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _engine_options(url):
+    options = {'pool_pre_ping': True}
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # One shared connection, or every thread would get its own empty database (benchmarks)
+        options.update(poolclass=StaticPool, connect_args={'check_same_thread': False})
+    elif url.get_backend_name() != 'sqlite':
+        # SQLite uses its own single-connection pools
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+        )
+    return options
+
+
+engine = create_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
+session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+Session = scoped_session(session_factory)
+
+_scope = threading.local()
+
+
+@contextmanager
+def session_scope():
+    """Unit of work for the current thread.
+
+    Nested scopes join the outermost one, so helpers can be called from
+    inside a larger transaction without committing it early.
+    """
+    db = Session()
+    if getattr(_scope, 'depth', 0):
+        _scope.depth += 1
+        try:
+            yield db
+        finally:
+            _scope.depth -= 1
+        return
+
+    _scope.depth = 1
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        _scope.depth = 0
+        Session.remove()
+
+
+def on_commit(db, callback):
+    """Run ``callback()`` once the session's current transaction commits.
+
+    Callbacks are discarded if the transaction rolls back, so listeners only
+    ever hear about changes that really made it to the database.
+    """
+    db.info.setdefault('on_commit', []).append(callback)
+
+
+@event.listens_for(session_factory, 'after_commit')
+def _run_commit_callbacks(db):
+    for callback in db.info.pop('on_commit', ()):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error in on_commit callback: {e}")
+
+
+@event.listens_for(session_factory, 'after_rollback')
+def _drop_commit_callbacks(db):
+    db.info.pop('on_commit', None)
+
+
+def _dialect_insert(db):
+    name = db.get_bind().dialect.name
+    if name == 'postgresql':
+        return postgresql.insert
+    if name == 'sqlite':
+        return sqlite.insert
+    return None
+
+
+def upsert(db, model, key, values):
+    """Insert a row or update it when ``key`` already exists, in one statement.
+
+    Uses ``INSERT ... ON CONFLICT`` on PostgreSQL and SQLite (``key`` must be
+    unique); other databases fall back to SELECT + INSERT/UPDATE.
+    """
+    insert = _dialect_insert(db)
+    column = getattr(model, key)
+    if insert is None:
+        row = db.query(model).filter(column == values[key]).first()
+        if row is None:
+            db.add(model(**values))
+        else:
+            for name, value in values.items():
+                setattr(row, name, value)
+        db.flush()
+        return
+
+    statement = insert(model.__table__).values(**values)
+    changes = {name: statement.excluded[name] for name in values if name != key}
+    if changes:
+        statement = statement.on_conflict_do_update(index_elements=[key], set_=changes)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[key])
+    db.execute(statement)
+
+
+def upsert_many(db, model, key, rows):
+    """:func:`upsert` for a list of rows, in one statement where the dialect allows it"""
+    if not rows:
+        return
+    insert = _dialect_insert(db)
+    if insert is None:
+        for values in rows:
+            upsert(db, model, key, values)
+        return
+    statement = insert(model.__table__).values(rows)
+    changes = {name: statement.excluded[name] for name in rows[0] if name != key}
+    db.execute(statement.on_conflict_do_update(index_elements=[key], set_=changes))
+
+
+def insert_if_missing(db, model, key, values):
+    """Insert a row unless ``key`` already exists; returns True if it was inserted"""
+    insert = _dialect_insert(db)
+    column = getattr(model, key)
+    if insert is None:
+        exists = db.execute(select(column).where(column == values[key])).first()
+        if exists:
+            return False
+        db.add(model(**values))
+        db.flush()
+        return True
+
+    statement = insert(model.__table__).values(**values).on_conflict_do_nothing(index_elements=[key])
+    return db.execute(statement).rowcount == 1
+
+
+def increment(db, model, key, key_value, field, amount=1):
+    """Atomically add ``amount`` to ``field``; returns False if no row matched"""
+    column = getattr(model, field)
+    statement = (
+        update(model.__table__)
+        .where(getattr(model, key) == key_value)
+        .values({field: column + amount})
+    )
+    return db.execute(statement).rowcount > 0
+
+
+def pool_status():
+    """Connection pool usage, for health reporting"""
+    return engine.pool.status()
+
+
+class ReloadJournal(object):
+    """Changes made to an in-memory index while it is rebuilt from its table.
+
+    A rebuild reads the table in chunks without holding the index's
+    ``lock``, so changes applied to the live index meanwhile would be lost
+    when the new data is swapped in. Each change is applied under ``lock``
+    and passed to :meth:`record`; :meth:`reload` swaps the new data in and
+    replays the recorded changes under the same lock. The read may or may
+    not have seen a change, so replaying one must be idempotent.
+    """
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._reload_lock = threading.Lock()
+        self._pending = None  # (replay, args) recorded while a reload runs
+
+    def record(self, replay, *args):
+        """Keep ``replay(*args)`` for the running reload, if any; call with ``lock`` held"""
+        if self._pending is not None:
+            self._pending.append((replay, args))
+
+    def reload(self, read, install):
+        """``install(read())`` under ``lock``, then replay; returns what ``read()`` returned"""
+        with self._reload_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                data = read()
+                with self._lock:
+                    install(data)
+                    for replay, args in self._pending:
+                        replay(*args)
+                return data
+            finally:
+                with self._lock:
+                    self._pending = None
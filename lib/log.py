@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Structured, non-blocking logging.
+
+Log calls on update workers and request threads only put the record on a
+bounded queue; a single ``QueueListener`` thread formats it (one JSON
+object per line) and writes it to stdout and, optionally, a rotating file.
+When the queue is full records are dropped and counted instead of blocking
+the caller.
+
+Every record carries the correlation fields bound with ``log_context`` on
+the thread that logged it. The update queue binds ``update_id``,
+``user_id`` and ``chat_id`` around each update, so all the lines one
+update produces, in handlers and in the lib modules they call, can be
+grouped.
+
+DEBUG records are sampled: only ``debug_sample_rate`` of them are kept
+(when the level lets them through at all), so DEBUG can be enabled on a
+busy bot.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_context = contextvars.ContextVar('log_context', default={})
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Add correlation fields to every record logged on this thread inside the block"""
+    token = _context.set(dict(_context.get(), **fields))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def update_fields(update):
+    """Correlation fields of a Telegram update"""
+    fields = {'update_id': getattr(update, 'update_id', None)}
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        fields['user_id'] = user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        fields['chat_id'] = chat.id
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, context and ``extra`` fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _AsyncHandler(QueueHandler):
+    """Queue handler that samples DEBUG, attaches the context and never blocks"""
+
+    def __init__(self, log_queue, debug_sample_rate=1.0):
+        super().__init__(log_queue)
+        self.debug_sample_rate = debug_sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and random.random() >= self.debug_sample_rate:
+            self.sampled_out += 1
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        # Resolve everything that depends on this thread or on mutable arguments now. The
+        # record is only seen by this handler, so it is updated in place instead of copied.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in _context.get().items():
+            record.__dict__.setdefault(key, value)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level='INFO', fmt='json', path=None, debug_sample_rate=1.0, queue_size=10000):
+    """Route the root logger through the queue to stdout (and ``path``); safe to call again"""
+    global _listener, _handler
+    stop_logging()
+
+    formatter = JsonFormatter() if fmt == 'json' else logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    targets = [logging.StreamHandler(sys.stdout)]
+    if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        targets.append(RotatingFileHandler(path, maxBytes=10240000, backupCount=10))
+    for target in targets:
+        target.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = _AsyncHandler(log_queue, debug_sample_rate)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = QueueListener(log_queue, *targets, respect_handler_level=True)
+    _listener.start()
+    _handler = handler
+    return handler
+
+
+def stop_logging():
+    """Write out whatever is still queued"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def stats():
+    if _handler is None:
+        return None
+    return {
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped,
+        'debug_sampled_out': _handler.sampled_out,
+    }
+
+
+atexit.register(stop_logging)
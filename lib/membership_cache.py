@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TTL + LRU cache for Telegram group membership results.
+
+Entries are keyed by (user_id, group). Positive results are kept for a long
+time, negative results only briefly, with the negative TTL doubling while a
+user keeps coming back negative (so button spam does not turn into API spam).
+Concurrent checks for the same user are coalesced: the first caller does the
+API calls and everybody else waits for its result.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class MembershipCache(object):
+    """Bounded membership cache with separate positive/negative TTLs"""
+
+    def __init__(self, max_size=100000, positive_ttl=600, negative_ttl=5, negative_max_ttl=20):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.negative_max_ttl = negative_max_ttl
+
+        # (user_id, group) -> (is_member, expires_at, negative_streak)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def get(self, user_id, group):
+        """Return the cached result or None when missing/expired"""
+        key = (user_id, group)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, group, is_member):
+        key = (user_id, group)
+        now = time.monotonic()
+        with self._lock:
+            if is_member:
+                entry = (True, now + self.positive_ttl, 0)
+            else:
+                previous = self._entries.get(key)
+                streak = previous[2] + 1 if previous is not None and not previous[0] else 1
+                ttl = min(self.negative_ttl * 2 ** (streak - 1), self.negative_max_ttl)
+                entry = (False, now + ttl, streak)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id, groups):
+        with self._lock:
+            for group in groups:
+                self._entries.pop((user_id, group), None)
+
+    def begin(self, user_id):
+        """Claim the check for ``user_id``.
+
+        Returns ``(future, owner)``. The owner must call :meth:`finish` once it
+        has a result; other callers just wait on the future.
+        """
+        with self._lock:
+            future = self._inflight.get(user_id)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[user_id] = future
+            return future, True
+
+    def finish(self, user_id, result=None, exception=None):
+        with self._lock:
+            future = self._inflight.pop(user_id, None)
+        if future is None:
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+            inflight = len(self._inflight)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'coalesced': self.coalesced,
+            'inflight': inflight,
+        }
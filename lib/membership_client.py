@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pooled, concurrent getChatMember client used to verify group membership.
+
+All groups for a user are checked in parallel over keep-alive connections
+with strict timeouts. A user is reported as "not a member" as soon as the
+first group comes back negative; the remaining checks for that user are
+cancelled if they have not started yet. An optional MembershipCache skips
+API calls for recently seen answers and coalesces concurrent checks.
+
+Interactive checks (a user pressing "check") run on a small pool of their
+own, so they never queue behind a scheduler batch of hundreds of calls.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lib.metrics import InstrumentedSession
+
+logger = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+
+class MembershipClient(object):
+    """Checks whether users are members of every group in ``groups``"""
+
+    def __init__(self, token, groups, api_url='https://api.telegram.org', max_workers=16,
+                 interactive_workers=4, connect_timeout=3.0, read_timeout=5.0, cache=None):
+        self.token = token
+        self.cache = cache
+        self.groups = list(groups)
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_workers = max_workers
+        self.interactive_workers = interactive_workers
+
+        self._http = InstrumentedSession('telegram_api')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers + interactive_workers, max_retries=0)
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+        self._executors = {}
+        self._executor_lock = threading.Lock()
+
+    def executor(self, interactive=False):
+        # Created lazily so importing bot.py does not spawn threads
+        executor = self._executors.get(interactive)
+        if executor is None:
+            with self._executor_lock:
+                executor = self._executors.get(interactive)
+                if executor is None:
+                    if interactive:
+                        executor = ThreadPoolExecutor(max_workers=self.interactive_workers,
+                                                      thread_name_prefix='membership-interactive')
+                    else:
+                        executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                      thread_name_prefix='membership')
+                    self._executors[interactive] = executor
+        return executor
+
+    def get_chat_member_status(self, user_id, group):
+        """Return the member status of ``user_id`` in ``@group``, or None on API errors"""
+        url = f'{self.api_url}/bot{self.token}/getChatMember'
+        try:
+            response = self._http.get(url, params={'chat_id': f'@{group}', 'user_id': user_id},
+                                      timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f'Error checking group membership for group {group}: {e}')
+            return None
+
+        # Check if the API response is valid
+        if not data.get('ok', False):
+            logger.error(f'Telegram API error for group {group}: {data.get("description", "Unknown error")}')
+            return None
+
+        # Check if result exists in response
+        if 'result' not in data:
+            logger.error(f'No result in API response for group {group}')
+            return None
+
+        return data['result'].get('status')
+
+    def is_member(self, user_id):
+        """Check a single user against all groups, on the interactive pool"""
+        return self.check_batch([user_id], interactive=True).get(user_id, False)
+
+    def check_batch(self, user_ids, interactive=False):
+        """Check several users at once; returns a dict of user_id -> bool"""
+        user_ids = list(dict.fromkeys(user_ids))
+        results = {}
+        to_check = {}
+        waiting = {}
+
+        for user_id in user_ids:
+            if self.cache is None:
+                to_check[user_id] = list(self.groups)
+                continue
+
+            missing = []
+            for group in self.groups:
+                cached = self.cache.get(user_id, group)
+                if cached is False:
+                    results[user_id] = False
+                    break
+                if cached is None:
+                    missing.append(group)
+            if user_id in results:
+                continue
+            if not missing:
+                results[user_id] = True
+                continue
+
+            # Coalesce with a check for the same user that is already running
+            future, owner = self.cache.begin(user_id)
+            if owner:
+                to_check[user_id] = missing
+            else:
+                waiting[user_id] = future
+
+        if to_check:
+            try:
+                checked = self._query(to_check, self.executor(interactive))
+            except Exception as e:
+                if self.cache is not None:
+                    for user_id in to_check:
+                        self.cache.finish(user_id, exception=e)
+                raise
+            results.update(checked)
+            if self.cache is not None:
+                for user_id in to_check:
+                    self.cache.finish(user_id, checked[user_id])
+
+        for user_id, future in waiting.items():
+            try:
+                results[user_id] = future.result(timeout=sum(self.timeout) * 2)
+            except Exception as e:
+                logger.error(f'Error waiting for membership check of {user_id}: {e}')
+                results[user_id] = False
+
+        return {user_id: results.get(user_id, False) for user_id in user_ids}
+
+    def _query(self, groups_by_user, executor):
+        """Run getChatMember for every (user, group) pair in parallel on ``executor``"""
+        results = {user_id: True for user_id in groups_by_user}
+        futures = {}
+        by_user = {}
+        for user_id, groups in groups_by_user.items():
+            for group in groups:
+                future = executor.submit(self.get_chat_member_status, user_id, group)
+                futures[future] = (user_id, group)
+                by_user.setdefault(user_id, []).append(future)
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                user_id, group = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    status = future.result()
+                except Exception as e:
+                    logger.error(f'Error checking group membership: {e}')
+                    status = None
+                is_member = status in MEMBER_STATUSES
+                # API errors are not cached, only real answers
+                if status is not None and self.cache is not None:
+                    self.cache.set(user_id, group, is_member)
+                if not is_member and results[user_id]:
+                    # Early exit: one missing group is enough to fail the user
+                    results[user_id] = False
+                    for other in by_user[user_id]:
+                        if other is not future and other.cancel():
+                            pending.discard(other)
+        return results
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        self._http.close()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Central scheduler for automatic Telegram group membership re-checks.
+
+Users who have not joined the required groups yet are kept in a single
+time-ordered heap. A repeating JobQueue job pops the users that are due on
+every tick and checks them in batches, so the number of threads stays the
+same no matter how many users are waiting.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PendingCheck(object):
+    """A user waiting for their group membership to be confirmed"""
+    __slots__ = ('user_id', 'chat_id', 'attempts', 'due')
+
+    def __init__(self, user_id, chat_id, due):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.attempts = 0
+        self.due = due
+
+
+class MembershipCheckScheduler(object):
+    """Time-ordered queue of pending membership checks drained by a JobQueue job.
+
+    ``check_batch`` receives a list of user ids and returns the subset of ids
+    that are now members of all groups. ``on_joined(bot, entry)`` and
+    ``on_timeout(bot, entry)`` are called for users that joined or ran out of
+    attempts.
+    """
+
+    def __init__(self, check_batch, on_joined, on_timeout, interval=30,
+                 max_attempts=20, tick=5, batch_size=200):
+        self.check_batch = check_batch
+        self.on_joined = on_joined
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.tick = tick
+        self.batch_size = batch_size
+
+        self._heap = []
+        self._pending = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._job = None
+
+        # metrics
+        self.checked = 0
+        self.joined = 0
+        self.timed_out = 0
+        self.last_tick_latency = 0.0
+        self.last_batch_size = 0
+        self._check_time_total = 0.0
+
+    def start(self, job_queue):
+        """Register the repeating tick on the given JobQueue"""
+        if self._job is None:
+            self._job = job_queue.run_repeating(self._run_tick, interval=self.tick, first=self.tick,
+                                                name='membership_check_scheduler')
+        return self._job
+
+    def add(self, user_id, chat_id):
+        """Schedule a user for automatic checks; re-adding a user restarts their attempts"""
+        with self._lock:
+            entry = PendingCheck(user_id, chat_id, time.monotonic() + self.interval)
+            # Older heap entries for this user become stale and are skipped on pop
+            self._pending[user_id] = entry
+            heapq.heappush(self._heap, (entry.due, next(self._counter), entry))
+
+    def discard(self, user_id):
+        """Stop checking a user, e.g. once they were verified through the button"""
+        with self._lock:
+            self._pending.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _pop_due(self, now):
+        batch = []
+        with self._lock:
+            while self._heap and len(batch) < self.batch_size:
+                due, _, entry = self._heap[0]
+                if due > now:
+                    break
+                heapq.heappop(self._heap)
+                if self._pending.get(entry.user_id) is entry:
+                    batch.append(entry)
+        return batch
+
+    def _reschedule(self, entry, now):
+        with self._lock:
+            if self._pending.get(entry.user_id) is not entry:
+                return
+            entry.due = now + self.interval
+            heapq.heappush(self._heap, (entry.due, next(self._counter), entry))
+
+    def _finish(self, entry):
+        with self._lock:
+            if self._pending.get(entry.user_id) is entry:
+                del self._pending[entry.user_id]
+                return True
+            return False
+
+    def _run_tick(self, context):
+        self.run_once(context.bot)
+
+    def run_once(self, bot, now=None):
+        """Check every user that is due, one batch at a time"""
+        started = time.monotonic()
+        now = started if now is None else now
+        total = 0
+
+        batch = self._pop_due(now)
+        while batch:
+            total += len(batch)
+            check_started = time.monotonic()
+            try:
+                joined_ids = set(self.check_batch([entry.user_id for entry in batch]))
+            except Exception as e:
+                logger.error(f"Error in auto membership check: {e}")
+                joined_ids = set()
+            self._check_time_total += time.monotonic() - check_started
+            self.checked += len(batch)
+
+            for entry in batch:
+                entry.attempts += 1
+                try:
+                    if entry.user_id in joined_ids:
+                        if self._finish(entry):
+                            self.joined += 1
+                            self.on_joined(bot, entry)
+                    elif entry.attempts >= self.max_attempts:
+                        if self._finish(entry):
+                            self.timed_out += 1
+                            self.on_timeout(bot, entry)
+                    else:
+                        self._reschedule(entry, now)
+                except Exception as e:
+                    logger.error(f"Error notifying user {entry.user_id} about membership check: {e}")
+
+            if len(batch) < self.batch_size:
+                break
+            batch = self._pop_due(now)
+
+        self.last_batch_size = total
+        self.last_tick_latency = time.monotonic() - started
+
+    def stats(self):
+        """Queue depth and check latency for health reporting"""
+        with self._lock:
+            depth = len(self._pending)
+            next_due = self._heap[0][0] - time.monotonic() if self._heap else None
+        return {
+            'queue_depth': depth,
+            'next_check_in': round(next_due, 3) if next_due is not None else None,
+            'checked': self.checked,
+            'joined': self.joined,
+            'timed_out': self.timed_out,
+            'last_tick_users': self.last_batch_size,
+            'last_tick_latency_ms': round(self.last_tick_latency * 1000, 3),
+            'avg_check_latency_ms': round(self._check_time_total / self.checked * 1000, 3) if self.checked else 0.0,
+        }
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Latency histograms and error counters for the hot paths.
+
+Timings are recorded per family (``handler``, ``dependency``, ``db``) and
+name (the handler's function, ``task_api``, ``update_user_step``...) into
+fixed log-spaced buckets, 100 us to about a minute. Every thread records
+into its own buckets, so recording is a ``bisect`` and a list increment
+with no lock and no contention between the update workers; the per-thread
+buckets are only summed when metrics are read.
+
+``render()`` serves them in the Prometheus text format as summaries with
+p50/p95/p99 (estimated from the buckets, within one bucket's width) plus
+``_sum`` and ``_count``::
+
+    airdropbot_handler_seconds{handler="start",quantile="0.95"} 0.0213
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+
+# Upper bounds in seconds: 100 us * 1.4^k, up to ~50 s, then +Inf
+BUCKETS = tuple(0.0001 * 1.4 ** k for k in range(40))
+QUANTILES = (0.5, 0.95, 0.99)
+
+# family -> (metric name, label name, help)
+FAMILIES = {
+    'handler': ('airdropbot_handler_seconds', 'handler', 'Time spent in bot update handlers'),
+    'dependency': ('airdropbot_dependency_seconds', 'dependency', 'Calls to the Telegram API and the task backend'),
+    'db': ('airdropbot_db_seconds', 'operation', 'Database operations'),
+}
+
+
+class Metrics(object):
+    """Registry of per-thread latency histograms and error counters"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            # First record on this thread: register its buckets once
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def observe(self, family, name, seconds):
+        histograms = self._shard()[0]
+        histogram = histograms.get((family, name))
+        if histogram is None:
+            # [bucket counts..., +Inf count, sum]
+            histogram = histograms[(family, name)] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def error(self, family, name):
+        errors = self._shard()[1]
+        errors[(family, name)] = errors.get((family, name), 0) + 1
+
+    def timer(self, family, name):
+        return _Timer(self, family, name)
+
+    def timed(self, family, name=None):
+        """Decorator timing every call of the function (named after it by default)"""
+        def decorate(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with _Timer(self, family, label):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def snapshot(self):
+        """Per-thread buckets summed: ``({(family, name): histogram}, {(family, name): errors})``"""
+        with self._lock:
+            shards = list(self._shards)
+        histograms = {}
+        errors = {}
+        for shard_histograms, shard_errors in shards:
+            # list() copies in one step under the GIL, so a recording thread cannot resize it mid-read
+            for key, histogram in list(shard_histograms.items()):
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = list(histogram)
+                else:
+                    for i, value in enumerate(histogram):
+                        total[i] += value
+            for key, count in list(shard_errors.items()):
+                errors[key] = errors.get(key, 0) + count
+        return histograms, errors
+
+    def quantile(self, histogram, q):
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        counts = histogram[:-1]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self):
+        """``{family: {name: {count, sum, p50, p95, p99, errors}}}``"""
+        histograms, errors = self.snapshot()
+        result = {}
+        for (family, name), histogram in sorted(histograms.items()):
+            entry = {'count': sum(histogram[:-1]), 'sum': round(histogram[-1], 6)}
+            for q in QUANTILES:
+                entry[f'p{int(q * 100)}'] = round(self.quantile(histogram, q), 6)
+            entry['errors'] = errors.get((family, name), 0)
+            result.setdefault(family, {})[name] = entry
+        return result
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        histograms, errors = self.snapshot()
+        lines = []
+        for family, (metric, label, help_text) in FAMILIES.items():
+            series = sorted((name, histogram) for (f, name), histogram in histograms.items() if f == family)
+            if not series:
+                continue
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} summary')
+            for name, histogram in series:
+                value = _escape(name)
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{{label}="{value}",quantile="{q}"}} {self.quantile(histogram, q):.6f}')
+                lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram[-1]:.6f}')
+                lines.append(f'{metric}_count{{{label}="{value}"}} {sum(histogram[:-1])}')
+        if errors:
+            lines.append('# HELP airdropbot_errors_total Timed calls that raised')
+            lines.append('# TYPE airdropbot_errors_total counter')
+            for (family, name), count in sorted(errors.items()):
+                lines.append(f'airdropbot_errors_total{{family="{family}",name="{_escape(name)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'family', 'name', 'started')
+
+    def __init__(self, metrics, family, name):
+        self.metrics = metrics
+        self.family = family
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.family, self.name, time.perf_counter() - self.started)
+        if exc_type is not None:
+            self.metrics.error(self.family, self.name)
+        return False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentedSession(requests.Session):
+    """requests.Session timing every request as a ``dependency``"""
+
+    def __init__(self, dependency, registry=None):
+        super().__init__()
+        self.dependency = dependency
+        self.metrics = registry or metrics
+
+    def request(self, method, url, *args, **kwargs):
+        with self.metrics.timer('dependency', self.dependency):
+            return super().request(method, url, *args, **kwargs)
+
+
+# Process-wide registry
+metrics = Metrics()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch moderation of X (Twitter) follow verifications.
+
+Pending users are listed with keyset cursors (``telegram_id > cursor``)
+instead of OFFSET, so every page costs the same no matter how deep the
+moderator is. Decisions are applied to thousands of users at a time with
+one set-based UPDATE per chunk, and every user whose status actually
+changed is announced after commit so they can be notified. An approval
+moves the user to the wallet step in the same UPDATE, so the row stays
+consistent even if the announcement is lost.
+
+Task submissions are stored and decided by the task backend, so their
+listing and bulk decisions are passed on to it (``GET /submissions`` and
+``POST /submissions/bulk`` under ``TASKS_API_URL``); the backend applies a
+batch in one UPDATE and returns the submissions it changed, which are then
+announced here like X decisions.
+"""
+
+import logging
+import time
+
+from sqlalchemy import select, update
+
+from lib.db import session_scope, on_commit
+from lib.metrics import InstrumentedSession
+from lib.models import users_data
+from lib.sybil import SybilFlag
+from lib.twitter_status import reserve_notices
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+# registration_step a decision moves the user to (rejected users stay on the X step)
+NEXT_STEP = {'approved': 3}
+
+
+def list_twitter_verifications(status='pending', after=None, limit=100):
+    """One page of users with the given verification status, ordered by telegram_id"""
+    with session_scope() as db:
+        query = db.query(
+            users_data.telegram_id,
+            users_data.username,
+            users_data.twitter_id,
+            users_data.twitter_verification_status,
+            SybilFlag.score,
+            SybilFlag.reasons
+        ).outerjoin(SybilFlag, SybilFlag.telegram_id == users_data.telegram_id).filter(
+            users_data.twitter_verification_status == status
+        )
+        if after is not None:
+            query = query.filter(users_data.telegram_id > after)
+        rows = query.order_by(users_data.telegram_id).limit(limit).all()
+
+    items = [{
+        'telegram_id': row.telegram_id,
+        'username': row.username,
+        'twitter_id': row.twitter_id,
+        'status': row.twitter_verification_status,
+        'sybil_score': row.score,
+        'sybil_reasons': row.reasons.split(',') if row.reasons else [],
+    } for row in rows]
+    next_cursor = items[-1]['telegram_id'] if len(items) == limit else None
+    return items, next_cursor
+
+
+def list_sybil_flags(after=None, limit=100, min_score=0.0):
+    """One page of flagged users, ordered by telegram_id"""
+    with session_scope() as db:
+        query = db.query(SybilFlag).filter(SybilFlag.score >= min_score)
+        if after is not None:
+            query = query.filter(SybilFlag.telegram_id > after)
+        rows = query.order_by(SybilFlag.telegram_id).limit(limit).all()
+
+    items = [{
+        'telegram_id': row.telegram_id,
+        'score': row.score,
+        'reasons': row.reasons.split(','),
+        'referrer_id': row.referrer_id,
+    } for row in rows]
+    next_cursor = items[-1]['telegram_id'] if len(items) == limit else None
+    return items, next_cursor
+
+
+def apply_twitter_decisions(telegram_ids, action, publish, reason=None, chunk_size=5000, publish_timeout=30.0):
+    """Approve or reject pending users in bulk.
+
+    Only users that are still pending are changed, and their notices are
+    reserved in the same transaction so no other process announces them
+    again. ``publish(telegram_id, status, reason, timeout)`` is called for
+    each changed user once the transaction commits, and returns False when
+    the event was dropped; all publishes together wait at most
+    ``publish_timeout`` seconds for room.
+    An approval sets ``registration_step`` in the same UPDATE, so handlers
+    of the announcement only notify and never write the row again.
+    Returns ``(changed, not_announced)`` lists of telegram ids.
+    """
+    status = ACTIONS[action]
+    values = {'twitter_verification_status': status}
+    if status in NEXT_STEP:
+        values['registration_step'] = NEXT_STEP[status]
+    telegram_ids = list(dict.fromkeys(telegram_ids))
+    changed = []
+    not_announced = []
+
+    def announce():
+        deadline = time.monotonic() + publish_timeout
+        for telegram_id in changed:
+            if not publish(telegram_id, status, reason, max(0.0, deadline - time.monotonic())):
+                not_announced.append(telegram_id)
+        if not_announced:
+            logger.warning(f"{len(not_announced)} of {len(changed)} {status} decisions were not announced")
+
+    with session_scope() as db:
+        returning = db.get_bind().dialect.name == 'postgresql'
+        for start in range(0, len(telegram_ids), chunk_size):
+            chunk = telegram_ids[start:start + chunk_size]
+            condition = (users_data.telegram_id.in_(chunk)) & (users_data.twitter_verification_status == 'pending')
+            statement = update(users_data.__table__).where(condition).values(**values)
+            if returning:
+                ids = [row[0] for row in db.execute(statement.returning(users_data.telegram_id))]
+            else:
+                # No UPDATE ... RETURNING: read the matching ids inside the same transaction first
+                ids = [row[0] for row in db.execute(select(users_data.telegram_id).where(condition))]
+                db.execute(statement)
+            reserve_notices(db, ids, status)
+            changed.extend(ids)
+
+        on_commit(db, announce)
+
+    return changed, not_announced
+
+
+class TaskBackendError(Exception):
+    """Raised when the task backend rejects or fails a moderation request"""
+
+
+class SubmissionModeration(object):
+    """Keyset-paginated listing and bulk decisions of task submissions, on the task backend"""
+
+    def __init__(self, api_url, timeout=30.0):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._http = InstrumentedSession('task_api')
+
+    def _call(self, method, path, **kwargs):
+        response = self._http.request(method, f'{self.api_url}{path}', timeout=self.timeout, **kwargs)
+        if response.status_code != 200:
+            raise TaskBackendError(f"Task backend returned status {response.status_code} for {path}")
+        return response.json()
+
+    def list(self, status='pending', after=None, limit=100):
+        """One page of submissions with ``status``, ordered by submission id"""
+        params = {'status': status, 'limit': limit}
+        if after is not None:
+            params['after'] = after
+        body = self._call('GET', '/submissions', params=params)
+        items = body.get('submissions', [])
+        next_cursor = items[-1]['id'] if len(items) == limit else None
+        return items, next_cursor
+
+    def apply(self, submission_ids, action, publish, publish_timeout=30.0):
+        """Approve or reject pending submissions in bulk.
+
+        Submissions that are not pending are left alone by the backend.
+        ``publish(telegram_id, task_id, status, timeout)`` is called for each
+        one it changed and returns False when the event was dropped; all
+        publishes together wait at most ``publish_timeout`` seconds for room.
+        Returns ``(changed, not_announced)`` lists of submissions.
+        """
+        status = ACTIONS[action]
+        body = self._call('POST', '/submissions/bulk', json={
+            'submission_ids': list(dict.fromkeys(submission_ids)),
+            'action': action,
+        })
+        changed = body.get('updated', [])
+        not_announced = []
+        deadline = time.monotonic() + publish_timeout
+        for item in changed:
+            if not publish(item['telegram_id'], item['task_id'], status, max(0.0, deadline - time.monotonic())):
+                not_announced.append(item)
+        if not_announced:
+            logger.warning(f"{len(not_announced)} of {len(changed)} {status} submissions were not announced")
+        return changed, not_announced
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process publish/subscribe bus for committed state changes.
+
+Publishers (usually an ``on_commit`` hook, see lib.db) only enqueue the
+event; a single worker thread delivers it to the subscribers of its topic,
+so a slow subscriber (e.g. one that messages the user) never blocks the
+code that committed the change. A publisher that cannot afford to lose
+events (bulk moderation) passes a ``timeout`` and waits for room in the
+queue instead of having them dropped.
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationBus(object):
+    """Topic based event bus with one delivery thread"""
+
+    def __init__(self, max_size=10000):
+        self._subscribers = {}
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def subscribe(self, topic, callback):
+        """Call ``callback(payload)`` for every event published on ``topic``"""
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notification-bus', daemon=True)
+                self._thread.start()
+
+    def publish(self, topic, payload, timeout=None):
+        """Queue an event; returns False if it was dropped.
+
+        Without ``timeout`` a full queue drops the event at once; otherwise
+        the caller waits up to ``timeout`` seconds for room.
+        """
+        if topic not in self._subscribers:
+            return True
+        try:
+            if timeout is None:
+                self._queue.put_nowait((topic, payload))
+            else:
+                self._queue.put((topic, payload), timeout=timeout)
+            self.published += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Notification bus full, dropped {topic} event")
+            return False
+
+    def _run(self):
+        while True:
+            topic, payload = self._queue.get()
+            for callback in list(self._subscribers.get(topic, ())):
+                try:
+                    callback(payload)
+                    self.delivered += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error delivering {topic} event: {e}")
+
+    def stats(self):
+        return {
+            'depth': self._queue.qsize(),
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming export of the final airdrop distribution.
+
+Completed users (registration step 4, wallet submitted, verified) are read
+in ``telegram_id`` order, one keyset chunk (``telegram_id > last``) per
+short transaction, and processed one chunk at a time: approved task
+submissions are counted for the chunk by parallel requests to the task
+backend once its transaction has ended, so no database connection is held
+while the backend answers. Each user's allocation is then computed and the
+chunk is written out as CSV or JSON Lines. Nothing but the current chunk is kept in memory, so the export runs
+in constant memory no matter how many users there are. Output is written to
+a temporary file and moved into place when complete, next to a ``.sha256``
+file in ``sha256sum`` format.
+
+Progress is kept in a ``.status.json`` file next to the output, rewritten
+after every chunk, so any process on the host (every Gunicorn worker) can
+report on an export with :func:`read_status`, not just the one running it.
+
+Users flagged in ``sybil_flags`` (see lib.sybil) are left out unless
+``--include-flagged`` is given, in which case their score is exported.
+
+Run from the project root::
+
+    python -m lib.payout_export --format csv --output payouts.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select
+
+import settings
+from lib.db import session_scope
+from lib.metrics import InstrumentedSession
+from lib.models import users_data
+from lib.sybil import SybilFlag
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ('telegram_id', 'username', 'wallet', 'balance', 'referral_count', 'approved_tasks', 'allocation',
+           'sybil_score')
+
+
+class ApprovedTaskCounter(object):
+    """Counts each user's approved task submissions on the task backend, in parallel per chunk"""
+
+    def __init__(self, api_url, workers=8, timeout=10.0):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._http = InstrumentedSession('task_api')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payout-tasks')
+
+    def _count(self, user_id):
+        response = self._http.get(f'{self.api_url}/user_submissions/{user_id}', timeout=self.timeout)
+        if response.status_code == 404:
+            return 0
+        response.raise_for_status()
+        submissions = response.json().get('submissions', [])
+        # Count each task once, even if it was submitted more than once
+        return len({sub['task_id'] for sub in submissions if sub.get('status') == 'approved'})
+
+    def counts(self, user_ids):
+        """telegram_id -> number of approved tasks; raises if the backend fails"""
+        return dict(zip(user_ids, self._executor.map(self._count, user_ids)))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class PayoutExport(object):
+    """One export run: ``fmt`` rows for every completed user written to ``path``"""
+
+    def __init__(self, path, fmt='csv', referral_reward=0, task_reward=0, task_counter=None, chunk_size=1000,
+                 exclude_flagged=True):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        self.path = path
+        self.status_path = path + '.status.json'
+        self.fmt = fmt
+        self.referral_reward = Decimal(str(referral_reward))
+        self.task_reward = Decimal(str(task_reward))
+        self.task_counter = task_counter
+        self.chunk_size = chunk_size
+        self.exclude_flagged = exclude_flagged
+
+        self.state = 'created'
+        self.rows = 0
+        self.excluded = 0
+        self.total_allocation = Decimal(0)
+        self.sha256 = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    def _query(self, after=None):
+        query = select(
+            users_data.telegram_id,
+            users_data.username,
+            users_data.wallet,
+            users_data.balance,
+            users_data.referral_count,
+            SybilFlag.score,
+        ).outerjoin(SybilFlag, SybilFlag.telegram_id == users_data.telegram_id).where(
+            users_data.registration_step == 4,
+            users_data.wallet_submitted.is_(True),
+            users_data.verified.is_(True),
+        )
+        if after is not None:
+            query = query.where(users_data.telegram_id > after)
+        return query.order_by(users_data.telegram_id).limit(self.chunk_size)
+
+    def _chunks(self):
+        """Completed users, ``chunk_size`` rows at a time, each chunk read in its own transaction"""
+        last_id = None
+        while True:
+            with session_scope() as db:
+                rows = db.execute(self._query(last_id)).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].telegram_id
+
+    def _records(self, rows):
+        if self.exclude_flagged:
+            eligible = [row for row in rows if row.score is None]
+            self.excluded += len(rows) - len(eligible)
+            rows = eligible
+        approved = self.task_counter.counts([row.telegram_id for row in rows]) if self.task_counter else {}
+        for row in rows:
+            balance = Decimal(str(row.balance or 0))
+            referrals = row.referral_count or 0
+            tasks = approved.get(row.telegram_id, 0)
+            allocation = balance + referrals * self.referral_reward + tasks * self.task_reward
+            self.total_allocation += allocation
+            yield (row.telegram_id, row.username or '', row.wallet, str(balance), referrals, tasks, str(allocation),
+                   row.score)
+
+    def _encode(self, records):
+        buffer = io.StringIO()
+        if self.fmt == 'csv':
+            csv.writer(buffer, lineterminator='\n').writerows(records)
+        else:
+            for record in records:
+                buffer.write(json.dumps(dict(zip(COLUMNS, record)), separators=(',', ':')))
+                buffer.write('\n')
+        return buffer.getvalue().encode('utf-8')
+
+    def _write(self, out, digest, data):
+        out.write(data)
+        digest.update(data)
+
+    def _save_status(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(self.status(), host=socket.gethostname(), pid=os.getpid()), f)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self):
+        self.state = 'running'
+        self.started_at = time.monotonic()
+        self._save_status()
+        digest = hashlib.sha256()
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'wb') as out:
+                if self.fmt == 'csv':
+                    self._write(out, digest, self._encode([COLUMNS]))
+                for rows in self._chunks():
+                    # Task backend requests run here, outside the chunk's transaction
+                    records = list(self._records(rows))
+                    self._write(out, digest, self._encode(records))
+                    self.rows += len(records)
+                    self._save_status()
+            os.replace(tmp_path, self.path)
+            self.sha256 = digest.hexdigest()
+            with open(self.path + '.sha256', 'w') as f:
+                f.write(f"{self.sha256}  {os.path.basename(self.path)}\n")
+            self.state = 'completed'
+        except Exception as e:
+            logger.error(f"Payout export to {self.path} failed: {e}")
+            self.error = str(e)
+            self.state = 'failed'
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            self.finished_at = time.monotonic()
+            if self.task_counter is not None:
+                self.task_counter.close()
+            self._save_status()
+        return self.status()
+
+    def start(self):
+        """Run in a background thread (used by the admin API)"""
+        if self._thread is None:
+            # Visible to the other workers before the thread gets going
+            self._save_status()
+            self._thread = threading.Thread(target=self.run, name='payout-export', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return {
+            'path': self.path,
+            'format': self.fmt,
+            'state': self.state,
+            'rows': self.rows,
+            'excluded_flagged': self.excluded,
+            'total_allocation': str(self.total_allocation),
+            'sha256': self.sha256,
+            'error': self.error,
+            'elapsed_s': round(end - self.started_at, 3) if self.started_at is not None else 0.0,
+        }
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_status(path):
+    """Status of the export to ``path`` as last saved, or None if there is no such export"""
+    try:
+        with open(path + '.status.json') as f:
+            status = json.load(f)
+    except FileNotFoundError:
+        return None
+    host, pid = status.pop('host', None), status.pop('pid', None)
+    if status['state'] in ('created', 'running') and host == socket.gethostname() and not _alive(pid):
+        # The process running it died
+        status['state'] = 'interrupted'
+    return status
+
+
+def export_path(directory, export_id, fmt):
+    return os.path.join(directory, f'payouts-{export_id}.{fmt}')
+
+
+def find_export(directory, export_id):
+    """Status of the export with this id in ``directory``, whatever its format, or None"""
+    for fmt in FORMATS:
+        status = read_status(export_path(directory, export_id, fmt))
+        if status is not None:
+            return status
+    return None
+
+
+def create_export(path, fmt='csv', include_tasks=True, include_flagged=False):
+    """PayoutExport configured from settings"""
+    counter = None
+    if include_tasks:
+        counter = ApprovedTaskCounter(settings.TASKS_API_URL, workers=settings.PAYOUT_TASK_WORKERS)
+    return PayoutExport(
+        path, fmt,
+        referral_reward=settings.PAYOUT_REFERRAL_REWARD,
+        task_reward=settings.PAYOUT_TASK_REWARD,
+        task_counter=counter,
+        chunk_size=settings.PAYOUT_CHUNK_SIZE,
+        exclude_flagged=not include_flagged
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the airdrop payout list')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--output', required=True, help='file to write; a .sha256 file is written next to it')
+    parser.add_argument('--no-tasks', action='store_true', help="don't query the task backend for approved tasks")
+    parser.add_argument('--include-flagged', action='store_true', help='keep users flagged as sybils (with their score)')
+    args = parser.parse_args()
+
+    status = create_export(args.output, args.format, include_tasks=not args.no_tasks,
+                           include_flagged=args.include_flagged).run()
+    print(json.dumps(status, indent=2))
+    return 0 if status['state'] == 'completed' else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistence backends for ConversationHandler state and ``context.user_data``.
+
+``SQLPersistence`` stores both in a small key/value table on the bot's
+database (SQLite or PostgreSQL), so every Gunicorn worker and every restart
+sees the same state. Reads go through an in-memory cache that is trusted
+for ``cache_ttl`` seconds and updated by this worker's own writes, so an
+active user costs one ``bot_state`` read per TTL, not one per update.
+Writes are collected and flushed in batches by a background thread
+(write-behind), and only when the data actually changed.
+A change made by one worker is visible to the others after at most
+``flush_interval + cache_ttl`` seconds.
+
+``FilePersistence`` is the single-process variant: python-telegram-bot's
+PicklePersistence, dumped periodically by a background thread instead of on
+every update.
+"""
+
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import Column, Float, String, Text
+from sqlalchemy.orm import declarative_base
+from telegram.ext import BasePersistence, PicklePersistence
+
+from lib.db import session_scope, upsert
+
+logger = logging.getLogger(__name__)
+
+Base = declarative_base()
+
+
+class BotState(Base):
+    """One persisted conversation state or user_data dict, stored as JSON"""
+    __tablename__ = 'bot_state'
+
+    state_key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+def _state_key(kind, key):
+    return f'{kind}:{json.dumps(key)}'
+
+
+_MISSING = object()
+
+
+def _decode(encoded):
+    return encoded is not None, json.loads(encoded) if encoded is not None else None
+
+
+class SharedConversations(dict):
+    """Conversation dict that re-reads stale entries from the shared store"""
+
+    def __init__(self, persistence, name):
+        super().__init__()
+        self.persistence = persistence
+        self.kind = f'conversation:{name}'
+
+    def _refresh(self, key):
+        # key is (chat_id, user_id); the handler will want that user's user_data next
+        prefetch = [('user_data', key[-1])] if len(key) > 1 else []
+        found, state = self.persistence.load(self.kind, list(key), prefetch)
+        if found and state is not None:
+            dict.__setitem__(self, key, state)
+        else:
+            dict.pop(self, key, None)
+
+    def get(self, key, default=None):
+        self._refresh(key)
+        return dict.get(self, key, default)
+
+    # ConversationHandler only tests membership (before ending a conversation)
+    # after get() refreshed the same key for that update, so a plain dict
+    # lookup is current and doesn't read the store a second time.
+
+
+class SQLPersistence(BasePersistence):
+    """Database-backed persistence with a read cache and write-behind batching"""
+
+    def __init__(self, cache_ttl=60.0, flush_interval=0.2, batch_size=500):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._cache = {}   # state key -> (json value or None, loaded_at)
+        self._dirty = {}   # state key -> json value or None (delete)
+        self._inflight = {}  # the batch being written, same shape as _dirty
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._swept_at = time.monotonic()
+        self._thread = threading.Thread(target=self._flush_loop, name='persistence-flush', daemon=True)
+        self._thread.start()
+        # Webhook workers never call Updater.stop(), which would flush for us
+        atexit.register(self.flush)
+
+        self.reads = 0
+        self.cache_hits = 0
+        self.writes = 0
+
+    def load(self, kind, key, prefetch=()):
+        """Return ``(found, value)``, from the cache when it is fresh enough.
+
+        ``prefetch`` lists other ``(kind, key)`` entries that are read in the
+        same query when the database has to be asked anyway.
+        """
+        state_key = _state_key(kind, key)
+        now = time.monotonic()
+        with self._lock:
+            encoded = self._cached(state_key, now)
+            if encoded is not _MISSING:
+                self.cache_hits += 1
+                return _decode(encoded)
+            wanted = [state_key] + [_state_key(*entry) for entry in prefetch
+                                    if self._cached(_state_key(*entry), now) is _MISSING]
+
+        with session_scope() as db:
+            rows = dict(db.query(BotState.state_key, BotState.value).filter(BotState.state_key.in_(wanted)))
+        with self._lock:
+            self.reads += 1
+            for wanted_key in wanted:
+                if wanted_key not in self._dirty and wanted_key not in self._inflight:
+                    self._cache[wanted_key] = (rows.get(wanted_key), now)
+            encoded = self._cached(state_key, now)
+        return _decode(rows.get(state_key) if encoded is _MISSING else encoded)
+
+    def _cached(self, state_key, now):
+        # Our own unflushed write is always the newest value
+        if state_key in self._dirty:
+            return self._dirty[state_key]
+        # ...then the one being written, which the database may not show yet
+        if state_key in self._inflight:
+            return self._inflight[state_key]
+        cached = self._cache.get(state_key)
+        if cached is not None and now - cached[1] < self.cache_ttl:
+            return cached[0]
+        return _MISSING
+
+    def store(self, kind, key, value):
+        """Queue a write (``None`` deletes); unchanged values are skipped"""
+        state_key = _state_key(kind, key)
+        if value is None:
+            encoded = None
+        else:
+            try:
+                encoded = json.dumps(value, sort_keys=True)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Not persisting {state_key}: {e}")
+                return
+        with self._lock:
+            if self._cached(state_key, time.monotonic()) == encoded:
+                return
+            self._dirty[state_key] = encoded
+            self._cache[state_key] = (encoded, time.monotonic())
+            pending = len(self._dirty)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing persistence: {e}")
+            if time.monotonic() - self._swept_at > 60:
+                self._sweep()
+
+    def _sweep(self):
+        """Forget expired cache entries so idle users don't keep memory"""
+        now = self._swept_at = time.monotonic()
+        with self._lock:
+            for state_key in [k for k, (_, loaded_at) in self._cache.items() if now - loaded_at >= self.cache_ttl]:
+                del self._cache[state_key]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                batch, self._dirty = self._dirty, {}
+                self._inflight = batch
+            now = time.time()
+            try:
+                with session_scope() as db:
+                    deleted = [state_key for state_key, encoded in batch.items() if encoded is None]
+                    if deleted:
+                        db.query(BotState).filter(BotState.state_key.in_(deleted)).delete(synchronize_session=False)
+                    for state_key, encoded in batch.items():
+                        if encoded is not None:
+                            upsert(db, BotState, 'state_key', {'state_key': state_key, 'value': encoded, 'updated_at': now})
+            except Exception:
+                with self._lock:
+                    self._inflight = {}
+                    # Put the batch back unless newer writes replaced it meanwhile
+                    for state_key, encoded in batch.items():
+                        self._dirty.setdefault(state_key, encoded)
+                raise
+            with self._lock:
+                self._inflight = {}
+                # Committed, so the database agrees with these for a full TTL
+                loaded_at = time.monotonic()
+                for state_key, encoded in batch.items():
+                    if state_key not in self._dirty:
+                        self._cache[state_key] = (encoded, loaded_at)
+            self.writes += len(batch)
+
+    # -- BasePersistence API --
+
+    def get_user_data(self):
+        # Loaded lazily per user by refresh_user_data
+        return defaultdict(dict)
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        return SharedConversations(self, name)
+
+    def update_conversation(self, name, key, new_state):
+        self.store(f'conversation:{name}', list(key), new_state)
+
+    def update_user_data(self, user_id, data):
+        self.store('user_data', user_id, dict(data) if data else None)
+
+    def refresh_user_data(self, user_id, user_data):
+        found, data = self.load('user_data', user_id)
+        user_data.clear()
+        if found:
+            user_data.update(data)
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def stats(self):
+        with self._lock:
+            dirty = len(self._dirty) + len(self._inflight)
+            cached = len(self._cache)
+        return {'cached': cached, 'dirty': dirty, 'reads': self.reads,
+                'cache_hits': self.cache_hits, 'writes': self.writes}
+
+
+class FilePersistence(PicklePersistence):
+    """PicklePersistence written by a background thread every ``flush_interval`` seconds"""
+
+    def __init__(self, filename, flush_interval=5.0):
+        super().__init__(filename, store_chat_data=False, store_bot_data=False, on_flush=True)
+        self.flush_interval = flush_interval
+        self._dirty = False
+        self._thread = threading.Thread(target=self._flush_loop, name='persistence-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def update_conversation(self, name, key, new_state):
+        super().update_conversation(name, key, new_state)
+        self._dirty = True
+
+    def update_user_data(self, user_id, data):
+        super().update_user_data(user_id, data)
+        self._dirty = True
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            try:
+                self.flush()
+            except Exception as e:
+                # e.g. a handler changed user_data while it was being pickled
+                self._dirty = True
+                logger.error(f"Error flushing persistence: {e}")
+
+
+def create_persistence(backend, filename='bot_state.pickle', cache_ttl=60.0, flush_interval=0.2):
+    """Build the persistence configured by ``settings.PERSISTENCE_BACKEND``"""
+    if backend == 'sql':
+        return SQLPersistence(cache_ttl=cache_ttl, flush_interval=flush_interval)
+    if backend == 'file':
+        return FilePersistence(filename)
+    if backend:
+        raise ValueError(f"Unknown persistence backend: {backend}")
+    return None
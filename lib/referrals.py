@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-memory referral graph and leaderboard.
+
+Referrals are only stored as ``users_data.referral_by``, so questions like
+"who referred the most users" or "how big is this user's referral tree"
+would scan the whole table. ``ReferralIndex`` loads the graph once
+(streaming, in keyset chunks), then keeps it current as new users register:
+
+* every referrer's direct referrals are kept in an ``array('q')`` of
+  telegram ids, 8 bytes per referral instead of a Python int object and
+  list slot each;
+* the top-K referrers are kept in a list sorted by (-count, telegram_id),
+  updated with a binary search per new referral. Reading the leaderboard
+  is then a slice.
+
+Each worker has its own index. It is rebuilt periodically to pick up
+referrals registered by other workers.
+"""
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+from sqlalchemy.orm import aliased
+
+from lib.db import session_scope, ReloadJournal
+from lib.models import users_data
+
+
+class ReferralIndex(object):
+    """Adjacency lists referrer -> referred users, with a top-K leaderboard"""
+
+    def __init__(self, top_k=100, chunk_size=5000):
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+        self._children = {}
+        self._top = []       # sorted (-count, referrer_id), at most top_k entries
+        self._in_top = {}    # referrer_id -> count, for entries in _top
+        self._lock = threading.Lock()
+        self._journal = ReloadJournal(self._lock)  # referrals added while a reload runs
+        self.loaded = False
+        self.referrals = 0
+
+    def load(self):
+        """Rebuild the graph from users_data; returns the number of referrals.
+
+        Referrals added while the new graph is being read are replayed onto
+        it when it replaces the current one, unless the read already saw
+        them.
+        """
+        self._journal.reload(self._read, self._install)
+        return self.referrals
+
+    def _read(self):
+        children = {}
+        referrer = aliased(users_data)
+        last_id = None
+        total = 0
+        while True:
+            with session_scope() as db:
+                # Only credited referrals: the referrer must be a registered user
+                query = db.query(users_data.telegram_id, users_data.referral_by).join(
+                    referrer, referrer.telegram_id == users_data.referral_by
+                ).filter(users_data.referral_by != users_data.telegram_id)
+                if last_id is not None:
+                    query = query.filter(users_data.telegram_id > last_id)
+                rows = query.order_by(users_data.telegram_id).limit(self.chunk_size).all()
+            if not rows:
+                break
+            for child_id, referrer_id in rows:
+                ids = children.get(referrer_id)
+                if ids is None:
+                    ids = children[referrer_id] = array('q')
+                ids.append(child_id)
+            total += len(rows)
+            last_id = rows[-1][0]
+
+        top = sorted((-len(ids), referrer_id) for referrer_id, ids in
+                     heapq.nlargest(self.top_k, children.items(), key=lambda item: (len(item[1]), -item[0])))
+        return children, top, total
+
+    def _install(self, graph):
+        children, top, total = graph
+        self._children = children
+        self._top = top
+        self._in_top = {referrer_id: -count for count, referrer_id in top}
+        self.referrals = total
+        self.loaded = True
+
+    def _replay_add(self, child_id, referrer_id):
+        # A referral the reload already read is not added twice
+        ids = self._children.get(referrer_id)
+        if ids is None:
+            ids = self._children[referrer_id] = array('q')
+        elif child_id in ids:
+            return
+        ids.append(child_id)
+        self.referrals += 1
+        self._update_top(referrer_id, len(ids))
+
+    def add(self, child_id, referrer_id):
+        """Record that ``referrer_id`` referred ``child_id``"""
+        with self._lock:
+            ids = self._children.get(referrer_id)
+            if ids is None:
+                ids = self._children[referrer_id] = array('q')
+            ids.append(child_id)
+            self.referrals += 1
+            self._update_top(referrer_id, len(ids))
+            self._journal.record(self._replay_add, child_id, referrer_id)
+
+    def _update_top(self, referrer_id, count):
+        old = self._in_top.get(referrer_id)
+        if old is not None:
+            del self._top[bisect_left(self._top, (-old, referrer_id))]
+        elif len(self._top) >= self.top_k and (-count, referrer_id) >= self._top[-1]:
+            # Not enough referrals to enter the leaderboard
+            return
+        insort(self._top, (-count, referrer_id))
+        self._in_top[referrer_id] = count
+        if len(self._top) > self.top_k:
+            _, dropped = self._top.pop()
+            del self._in_top[dropped]
+
+    def leaderboard(self, limit=10):
+        """``[(referrer_id, count), ...]`` best first, ties broken by lower telegram_id"""
+        with self._lock:
+            return [(referrer_id, -count) for count, referrer_id in self._top[:limit]]
+
+    def count(self, referrer_id):
+        ids = self._children.get(referrer_id)
+        return len(ids) if ids is not None else 0
+
+    def referred(self, referrer_id):
+        """Telegram ids directly referred by ``referrer_id``"""
+        ids = self._children.get(referrer_id)
+        return ids.tolist() if ids is not None else []
+
+    def tree_sizes(self, referrer_id, max_depth=3):
+        """Number of users referred at each level (direct, their referrals, ...), for multi-level rewards"""
+        sizes = []
+        level = [referrer_id]
+        seen = {referrer_id}
+        with self._lock:
+            for _ in range(max_depth):
+                next_level = []
+                for user_id in level:
+                    for child_id in self._children.get(user_id, ()):
+                        if child_id not in seen:
+                            seen.add(child_id)
+                            next_level.append(child_id)
+                if not next_level:
+                    break
+                sizes.append(len(next_level))
+                level = next_level
+        return sizes
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'referrers': len(self._children),
+            'referrals': self.referrals,
+        }
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Prebuilt keyboards and message texts for the bot's replies.
+
+Markups and texts that never change are built once at import. Task views
+are built once per task catalog version (see lib.task_catalog): every task
+gets one button and one summary line per submission status, so rendering a
+user's task list only picks the fragments matching their statuses instead
+of formatting strings and building buttons on every update. Whole task
+lists are additionally cached per combination of statuses, since most
+users share one (e.g. nothing submitted yet).
+"""
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import settings
+
+
+def _single_button(text, callback_data):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=callback_data)]])
+
+
+## static keyboards
+START_REGISTRATION_MARKUP = _single_button("🚀 Start Registration", "start_registration")
+PROCEED_TWITTER_MARKUP = _single_button("Proceed to X Follow", "proceed_twitter")
+PROCEED_WALLET_MARKUP = _single_button("Proceed to Submit Wallet", "proceed_wallet")
+CHECK_AGAIN_MARKUP = _single_button("I've Joined - Check Again", "check_telegram")
+
+## static texts
+TWITTER_FOLLOW_TEXT = settings.TWITTER_FOLLOW_MESSAGE.format(twitter_link=settings.TWITTER_PAGE_LINK)
+TWITTER_REJECTED_TEXT = settings.TWITTER_REJECTED_MESSAGE.format(
+    reason="Please ensure you've followed our X account"
+)
+TELEGRAM_JOINED_TEXT = "🎉 " + settings.TELEGRAM_VERIFIED_MESSAGE
+NOT_IN_GROUP_TEXT = settings.NOT_IN_GROUP_MESSAGE + "\n\n⏳ I'll continue checking automatically every 30 seconds..."
+ASK_TO_JOIN_TEXT = settings.ASK_TO_JOIN_GROUPS + "\n\n⏳ I'll automatically check your membership every 30 seconds..."
+TASK_SUBMIT_TEXT = (
+    "📤 <b>Submit Your Proof</b>\n\n"
+    "Please reply to this message with your proof of completion:\n\n"
+    "• For Twitter tasks: Share the tweet link\n"
+    "• For Telegram tasks: Share your username\n"
+    "• For other tasks: Share the relevant link or proof\n\n"
+    "⏳ <i>Waiting for your submission...</i>"
+)
+
+REFERRAL_LINK_PREFIX = "https://t.me/greendale1_bot?start="
+
+
+def referral_link(user_id):
+    return f"{REFERRAL_LINK_PREFIX}{user_id}"
+
+
+@lru_cache(maxsize=1024)
+def task_submit_markup(task_id):
+    """Back button of the proof submission prompt (doesn't need the catalog)"""
+    return _single_button("⬅️ Back", f"proceed_task_{task_id}")
+
+
+## task views
+NEW = 'new'
+STATUS_EMOJI = {NEW: '🆕', 'pending': '⏳', 'approved': '✅', 'rejected': '❌'}
+
+
+class TaskFragments(object):
+    """Everything rendered for one task, for one catalog version"""
+    __slots__ = ('task', 'buttons', 'lines', 'detail', 'proceed')
+
+    def __init__(self, task):
+        task_id = task['id']
+        title = task['title']
+        self.task = task
+        # Task list button and /tasks summary line per submission status
+        self.buttons = {
+            status: [InlineKeyboardButton(f"{emoji} {title}", callback_data=f"task_{task_id}")]
+            for status, emoji in STATUS_EMOJI.items()
+        }
+        self.lines = {
+            status: f"• {emoji} {title} - {status.title()}\n"
+            for status, emoji in STATUS_EMOJI.items() if status != NEW
+        }
+
+        requirements = f"📋 <b>Requirements:</b>\n{task['requirements']}\n\n" if task.get('requirements') else ""
+        self.detail = (
+            f"🎯 <b>{title}</b>\n\n"
+            f"📝 <b>Description:</b>\n{task['description']}\n\n"
+            f"🔗 <b>Type:</b> {task['task_type'].title()}\n\n"
+            f"{requirements}",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🚀 Proceed", callback_data=f"proceed_task_{task_id}")],
+                [InlineKeyboardButton("⬅️ Back to Tasks", callback_data="view_tasks")]
+            ])
+        )
+        self.proceed = (
+            f"🎯 <b>{title}</b>\n\n"
+            f"📝 Platform: {task.get('task_type', 'General').title()}\n"
+            f"Task: {task['description']}\n\n"
+            "✨ <b>Complete this task to receive more airdrop allocation!</b>\n\n"
+            f"{requirements}"
+            "✅ <b>After completing, please submit the proof as a reply to this message.</b>\n\n"
+            "📎 Please provide the link or proof of completion:",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("📤 Submit Proof", callback_data=f"submit_task_{task_id}")],
+                [InlineKeyboardButton("⬅️ Back", callback_data=f"task_{task_id}")]
+            ])
+        )
+
+    def button(self, status):
+        return self.buttons.get(status) or self.buttons['pending']
+
+
+class TaskRenderer(object):
+    """Task list and task detail views, cached per task catalog version"""
+
+    def __init__(self, catalog, max_views=1024):
+        self.catalog = catalog
+        self.max_views = max_views
+        # (catalog version, task id -> TaskFragments), swapped as one tuple
+        self._state = (None, OrderedDict())
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.builds = 0
+        self.view_hits = 0
+        self.view_misses = 0
+
+    def _current(self):
+        # One read, so the task list and its version always match
+        version, tasks, _ = self.catalog.snapshot()
+        if version != self._state[0]:
+            with self._lock:
+                if version != self._state[0]:
+                    fragments = OrderedDict((str(task['id']), TaskFragments(task)) for task in tasks)
+                    self._views = OrderedDict()
+                    self._state = (version, fragments)
+                    self.builds += 1
+        return self._state
+
+    def fragments(self):
+        """Fragments of all active tasks in catalog order (may raise TaskCatalogError)"""
+        return self._current()[1]
+
+    def get(self, task_id):
+        """Fragments of one task, or None when it does not exist"""
+        return self.fragments().get(str(task_id))
+
+    def _view(self, kind, statuses, build):
+        version, fragments = self._current()
+        statuses = {str(task_id): status for task_id, status in statuses.items()}
+        key = (kind, version, tuple(sorted(statuses.items())))
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                self.view_hits += 1
+                return view
+            self.view_misses += 1
+        view = build(fragments, statuses)
+        with self._lock:
+            self._views[key] = view
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return view
+
+    def task_menu(self, statuses):
+        """``(text, markup)`` of the task list button menu; ``statuses`` maps submitted task ids to status.
+
+        Returns ``(None, None)`` when there are no tasks.
+        """
+        return self._view('menu', statuses, self._build_menu)
+
+    def task_summary(self, statuses):
+        """``(text, markup)`` of the /tasks overview, or ``(None, None)`` when there are no tasks"""
+        return self._view('summary', statuses, self._build_summary)
+
+    @staticmethod
+    def _split(fragments, statuses):
+        new = [fragment for task_id, fragment in fragments.items() if task_id not in statuses]
+        submitted = [(fragment, statuses[task_id]) for task_id, fragment in fragments.items() if task_id in statuses]
+        return new, submitted
+
+    def _build_menu(self, fragments, statuses):
+        new, submitted = self._split(fragments, statuses)
+        keyboard = [fragment.buttons[NEW] for fragment in new]
+        keyboard += [fragment.button(status) for fragment, status in submitted]
+        if not keyboard:
+            return None, None
+        text = ("\n" if new else "") + ("✅ <b>Your Submissions</b>\n" if submitted else "")
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def _build_summary(self, fragments, statuses):
+        new, submitted = self._split(fragments, statuses)
+        if not new and not submitted:
+            return None, None
+        keyboard = [fragment.buttons[NEW] for fragment in new]
+        text = "\n" if new else ""
+        if submitted:
+            text += "📋 <b>Your Submissions</b>\n"
+            for fragment, status in submitted:
+                line = fragment.lines.get(status) or f"• ❌ {fragment.task['title']} - {status.title()}\n"
+                text += line
+                keyboard.append(fragment.buttons.get(status) or fragment.buttons['rejected'])
+            text += "\n"
+        text += "Tap on any task to view details!"
+        return text, InlineKeyboardMarkup(keyboard)
+
+    def stats(self):
+        version, fragments = self._state
+        return {
+            'version': version,
+            'tasks': len(fragments),
+            'builds': self.builds,
+            'views': len(self._views),
+            'view_hits': self.view_hits,
+            'view_misses': self.view_misses,
+        }
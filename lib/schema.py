@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Creates the tables of the bot's own modules, next to ``users_data``.
+
+Tables are not created on import or when a component is constructed: that
+would run DDL in every Gunicorn worker and on every start. Run this once per
+deployment instead (the systemd unit does it in ``ExecStartPre``, the
+Procfile in its ``release`` step), from the project root::
+
+    python -m lib.schema
+
+Existing tables are left as they are.
+"""
+
+import logging
+
+from lib import broadcast, persistence, submissions, sybil, twitter_status
+from lib.db import engine
+
+logger = logging.getLogger(__name__)
+
+# Modules whose declarative ``Base`` holds tables
+MODULES = (broadcast, persistence, submissions, sybil, twitter_status)
+
+
+def create_tables(bind=engine):
+    """Create the missing tables; returns the names of all the modules' tables"""
+    names = []
+    for module in MODULES:
+        module.Base.metadata.create_all(bind)
+        names.extend(module.Base.metadata.tables)
+    return names
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Tables ready: {', '.join(create_tables())}")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rate-limited outbound message pipeline honoring Telegram flood limits.
+
+Every send (``send_message``, ``reply_text``, ``edit_message_text``...) is
+queued with a chat id and a priority. Calls to one chat wait in that chat's
+FIFO and only its head is scheduled, so messages to a chat are sent one at
+a time and in the order they were submitted. A scheduler thread releases
+chat heads only when both the global token bucket (~30 msg/s) and the
+chat's own bucket (~1 msg/s) allow it, interactive replies before
+background notifications, and hands them to a small pool of sender
+threads. A 429 ``RetryAfter`` pauses all sending for the requested time
+and retries the call, still at the head of its chat.
+
+Background calls are dropped once ``max_size`` calls are waiting;
+interactive replies keep being accepted up to ``max_interactive_size``
+and are dropped beyond that.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram.error import RetryAfter
+
+from lib.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class SendQueueFull(Exception):
+    """Raised (through the future) when a message is dropped because the queue is full"""
+
+
+class TokenBucket(object):
+    """Classic token bucket refilled continuously at ``rate`` tokens/s"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Call(object):
+    __slots__ = ('chat_id', 'fn', 'args', 'kwargs', 'priority', 'future', 'attempts')
+
+    def __init__(self, chat_id, fn, args, kwargs, priority):
+        self.chat_id = chat_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = Future()
+        self.attempts = 0
+
+
+class SendQueue(object):
+    """Prioritized, rate-limited queue of Bot API calls, in order per chat"""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_size=10000,
+                 max_retries=3, workers=8, max_interactive_size=None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_size = max_size
+        self.max_interactive_size = max_interactive_size or 2 * max_size
+        self.max_retries = max_retries
+        self.workers = workers
+
+        self._chats = {}      # chat_id -> deque of calls; the head is scheduled or in flight
+        self._ready = []      # (priority, seq, call), chat heads only
+        self._delayed = []    # (not_before, seq, call), chat heads only
+        self._queued = 0      # calls not handed to a sender yet
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+        # metrics
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sender')
+                self._thread = threading.Thread(target=self._run, name='send-queue', daemon=True)
+                self._thread.start()
+
+    def submit(self, chat_id, fn, args=(), kwargs=None, priority=INTERACTIVE):
+        """Queue ``fn(*args, **kwargs)`` for ``chat_id``; returns a Future with its result"""
+        call = _Call(chat_id, fn, args, kwargs or {}, priority)
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            limit = self.max_interactive_size if priority == INTERACTIVE else self.max_size
+            if self._queued >= limit:
+                self.dropped += 1
+                call.future.set_exception(SendQueueFull(f'send queue is full, dropped message to {chat_id}'))
+                return call.future
+            self._queued += 1
+            calls = self._chats.get(chat_id)
+            if calls is None:
+                self._chats[chat_id] = deque((call,))
+                self._schedule(call)
+            else:
+                # Sent once the calls before it in this chat are done
+                calls.append(call)
+        return call.future
+
+    def __len__(self):
+        with self._cond:
+            return self._queued
+
+    def _schedule(self, call):
+        heapq.heappush(self._ready, (call.priority, next(self._counter), call))
+        self._cond.notify()
+
+    def _finish(self, call):
+        """The chat's head is done: schedule the next call to that chat"""
+        calls = self._chats[call.chat_id]
+        calls.popleft()
+        if calls:
+            self._schedule(calls[0])
+        else:
+            del self._chats[call.chat_id]
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                # Forget chats whose bucket has fully refilled
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items()
+                                      if not value.is_idle(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _delay(self, call, until):
+        heapq.heappush(self._delayed, (until, next(self._counter), call))
+
+    def _next_call(self):
+        """Block until a call may be sent right now, then return it"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    call = heapq.heappop(self._delayed)[2]
+                    heapq.heappush(self._ready, (call.priority, next(self._counter), call))
+
+                timeout = None
+                if self._delayed:
+                    timeout = self._delayed[0][0] - now
+                if self._paused_until > now:
+                    timeout = self._paused_until - now
+                elif self._ready:
+                    global_delay = self.global_bucket.delay(now)
+                    if global_delay:
+                        timeout = global_delay
+                    else:
+                        call = heapq.heappop(self._ready)[2]
+                        chat_delay = self._chat_bucket(call.chat_id, now).delay(now)
+                        if chat_delay:
+                            self._delay(call, now + chat_delay)
+                            continue
+                        self.global_bucket.consume()
+                        self._chat_bucket(call.chat_id, now).consume()
+                        self._queued -= 1
+                        return call
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            call = self._next_call()
+            self._executor.submit(self._send, call)
+
+    def _send(self, call):
+        call.attempts += 1
+        try:
+            with metrics.timer('dependency', 'telegram_api'):
+                result = call.fn(*call.args, **call.kwargs)
+        except RetryAfter as e:
+            with self._cond:
+                if call.attempts <= self.max_retries:
+                    self.retried += 1
+                    # Flood limit hit: pause everything, then retry this call (still its chat's head)
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                    self._queued += 1
+                    self._schedule(call)
+                    return
+                self.failed += 1
+                self._finish(call)
+            logger.error(f"Giving up sending to chat {call.chat_id} after {call.attempts} attempts: {e}")
+            call.future.set_exception(e)
+        except Exception as e:
+            with self._cond:
+                self.failed += 1
+                self._finish(call)
+            logger.error(f"Error sending message to chat {call.chat_id}: {e}")
+            call.future.set_exception(e)
+        else:
+            with self._cond:
+                self.sent += 1
+                self._finish(call)
+            call.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            queued = self._queued
+            ready = len(self._ready)
+            delayed = len(self._delayed)
+            inflight = len(self._chats) - ready - delayed
+            paused = max(0.0, self._paused_until - time.monotonic())
+        return {
+            'queued': queued,
+            'ready': ready,
+            'waiting_for_rate_limit': delayed,
+            'inflight': inflight,
+            'paused_for_s': round(paused, 3),
+            'sent': self.sent,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Solana wallet address validation and the wallet ownership index.
+
+A Solana address is the base58 encoding of a 32 byte public key, so an
+address is only accepted when it decodes to exactly 32 bytes (length alone
+lets typos and exchange memo strings through). ``WalletIndex`` keeps every
+submitted wallet in memory, so a wallet already used by another account is
+found with one dict lookup instead of a table scan. It is loaded once at
+startup by streaming the ``users_data.wallet`` column in keyset chunks,
+which also re-validates every stored address; the admin API reruns that
+in the background with :meth:`WalletIndex.revalidate`.
+"""
+
+import threading
+import time
+
+from lib.db import session_scope, ReloadJournal
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+ADDRESS_BYTES = 32
+
+# ASCII code -> digit value, -1 for characters outside the alphabet
+_DIGITS = [-1] * 128
+for _value, _char in enumerate(ALPHABET):
+    _DIGITS[ord(_char)] = _value
+
+
+def b58decode(text):
+    """Decode a base58 string; raises ValueError on characters outside the alphabet"""
+    number = 0
+    for char in text:
+        code = ord(char)
+        value = _DIGITS[code] if code < 128 else -1
+        if value < 0:
+            raise ValueError(f"Invalid base58 character {char!r}")
+        number = number * 58 + value
+    # Every leading '1' encodes one leading zero byte
+    zeros = len(text) - len(text.lstrip('1'))
+    return b'\0' * zeros + (number.to_bytes((number.bit_length() + 7) // 8, 'big') if number else b'')
+
+
+def is_valid_address(address):
+    """True if ``address`` is base58 for exactly 32 bytes"""
+    # 32 bytes encode to 32-44 characters; checking first keeps huge inputs cheap
+    if not address or not 32 <= len(address) <= 44:
+        return False
+    try:
+        return len(b58decode(address)) == ADDRESS_BYTES
+    except ValueError:
+        return False
+
+
+class WalletIndex(object):
+    """wallet -> telegram_id map used to reject wallets shared between accounts"""
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self._owners = {}
+        self._wallets = {}
+        self._previous = {}  # telegram_id -> wallet its last claim replaced, for release()
+        self._lock = threading.Lock()
+        self._journal = ReloadJournal(self._lock)  # claims and releases made while a reload runs
+        self._revalidate_lock = threading.Lock()
+        self.loaded = False
+        self.duplicates_rejected = 0
+        self.last_revalidation = None
+
+    def scan(self, on_row=None):
+        """Stream every stored wallet and check it.
+
+        Returns ``{'checked', 'invalid', 'duplicates'}``: the number of
+        wallets read, ``[telegram_id, wallet]`` pairs that are not valid
+        addresses, and wallets used by more than one account mapped to their
+        owners. ``on_row(telegram_id, wallet)`` is called for each wallet.
+        """
+        # Imported here so address validation works without the models (and their database)
+        from lib.models import users_data
+
+        checked = 0
+        invalid = []
+        seen = {}
+        duplicates = {}
+        last_id = None
+        while True:
+            with session_scope() as db:
+                query = db.query(users_data.telegram_id, users_data.wallet).filter(users_data.wallet.isnot(None))
+                if last_id is not None:
+                    query = query.filter(users_data.telegram_id > last_id)
+                rows = query.order_by(users_data.telegram_id).limit(self.chunk_size).all()
+            if not rows:
+                break
+            for telegram_id, wallet in rows:
+                checked += 1
+                if not is_valid_address(wallet):
+                    invalid.append([telegram_id, wallet])
+                    continue
+                owner = seen.setdefault(wallet, telegram_id)
+                if owner != telegram_id:
+                    duplicates.setdefault(wallet, [owner]).append(telegram_id)
+                if on_row is not None:
+                    on_row(telegram_id, wallet)
+            last_id = rows[-1][0]
+        return {'checked': checked, 'invalid': invalid, 'duplicates': duplicates}
+
+    def load(self):
+        """(Re)build the index from the database; returns the scan report.
+
+        Claims and releases made while the wallets are being read are
+        replayed onto the new index, so none are lost at the swap.
+        """
+        owners = {}
+        wallets = {}
+
+        def add(telegram_id, wallet):
+            # The first (lowest telegram_id) account keeps a shared wallet
+            owners.setdefault(wallet, telegram_id)
+            wallets[telegram_id] = wallet
+
+        def install(report):
+            self._owners = owners
+            self._wallets = wallets
+            self._previous = {}
+            self.loaded = True
+
+        return self._journal.reload(lambda: self.scan(add), install)
+
+    def revalidate(self, sample=20):
+        """load(), keeping counts and the first ``sample`` findings in ``last_revalidation``.
+
+        Returns that summary, or None if a revalidation is already running.
+        """
+        if not self._revalidate_lock.acquire(blocking=False):
+            return None
+        try:
+            started = time.monotonic()
+            report = self.load()
+            self.last_revalidation = {
+                'checked': report['checked'],
+                'invalid_count': len(report['invalid']),
+                'duplicate_count': len(report['duplicates']),
+                'invalid_sample': report['invalid'][:sample],
+                'duplicates_sample': dict(list(report['duplicates'].items())[:sample]),
+                'elapsed_s': round(time.monotonic() - started, 3),
+            }
+            return self.last_revalidation
+        finally:
+            self._revalidate_lock.release()
+
+    def owner(self, wallet):
+        return self._owners.get(wallet)
+
+    def claim(self, wallet, telegram_id):
+        """Record ``wallet`` for ``telegram_id`` unless another account has it.
+
+        Returns the other account's telegram_id, or None when the claim
+        succeeded. A user's previous wallet is released.
+        """
+        with self._lock:
+            owner = self._claim(wallet, telegram_id)
+            if owner is not None:
+                self.duplicates_rejected += 1
+            else:
+                self._journal.record(self._claim, wallet, telegram_id)
+            return owner
+
+    def _claim(self, wallet, telegram_id):
+        owner = self._owners.setdefault(wallet, telegram_id)
+        if owner != telegram_id:
+            return owner
+        previous = self._wallets.get(telegram_id)
+        if previous is not None:
+            self._previous[telegram_id] = previous
+            if previous != wallet and self._owners.get(previous) == telegram_id:
+                del self._owners[previous]
+        self._wallets[telegram_id] = wallet
+        return None
+
+    def release(self, wallet, telegram_id):
+        """Undo a claim whose database write failed, giving the user back their previous wallet"""
+        with self._lock:
+            self._release(wallet, telegram_id)
+            self._journal.record(self._release, wallet, telegram_id)
+
+    def _release(self, wallet, telegram_id):
+        if self._wallets.get(telegram_id) != wallet:
+            return
+        previous = self._previous.pop(telegram_id, None)
+        if previous == wallet:
+            # The claim didn't change anything
+            return
+        if self._owners.get(wallet) == telegram_id:
+            del self._owners[wallet]
+        if previous is None:
+            del self._wallets[telegram_id]
+        else:
+            self._wallets[telegram_id] = previous
+            self._owners.setdefault(previous, telegram_id)
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'wallets': len(self._owners),
+            'duplicates_rejected': self.duplicates_rejected,
+            'revalidating': self._revalidate_lock.locked(),
+            'last_revalidation': self.last_revalidation,
+        }
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-user task submission statuses for rendering /tasks.
+
+Each cached user has a ``task_id -> status`` dict, loaded from the task
+backend the first time it is needed and then kept current incrementally:
+a submission the bot sends is added as ``pending``, and moderation
+decisions arrive as ``submission_status`` events on the notification bus.
+Rendering the task list is then one dict lookup instead of an HTTP round
+trip. The cache is an LRU bounded by ``max_size`` users; entries expire
+after a TTL so decisions that never reached this process are picked up.
+
+Status dicts are replaced, never modified in place, so a dict handed to a
+renderer does not change under it.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from lib.user_cache import LoadTracker
+
+STATUSES = ('pending', 'approved', 'rejected')
+
+
+class SubmissionStatusIndex(object):
+    """Bounded LRU of telegram_id -> {task_id: status}"""
+
+    def __init__(self, load_statuses, max_size=50000, ttl=300):
+        # load_statuses(telegram_id) -> {task_id: status}, or None if the backend did not answer
+        self.load_statuses = load_statuses
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # telegram_id -> (statuses, expires)
+        self._lock = threading.Lock()
+        # A load that raced with a change to the same user is not cached
+        self._loads = LoadTracker()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.updates = 0
+
+    def get(self, telegram_id):
+        """The user's statuses by task id (string); empty if the backend could not be reached"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._loads.begin(telegram_id)
+
+        statuses = None
+        try:
+            statuses = self.load_statuses(telegram_id)
+        finally:
+            with self._lock:
+                if self._loads.end(telegram_id, generation) and statuses is not None:
+                    self._put(telegram_id, statuses)
+        return {} if statuses is None else statuses
+
+    def _put(self, telegram_id, statuses):
+        self._entries[telegram_id] = (statuses, time.monotonic() + self.ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, telegram_id, task_id, status, only_new=False):
+        """Record a submission's status; with ``only_new`` an existing status is kept.
+
+        Users that are not cached are left alone, their next load sees the
+        change.
+        """
+        task_id = str(task_id)
+        with self._lock:
+            self._loads.changed(telegram_id)
+            self.updates += 1
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                return
+            statuses, expires = entry
+            if only_new and task_id in statuses:
+                return
+            statuses = dict(statuses)
+            statuses[task_id] = status
+            self._entries[telegram_id] = (statuses, expires)
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._loads.changed(telegram_id)
+            self._entries.pop(telegram_id, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'updates': self.updates,
+        }
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Task submission ingest: proof-link normalization and duplicate checks.
+
+Users resubmit the same tweet many times, and farms reuse one proof across
+accounts. Before a submission reaches the task backend its proof link is
+normalized, so every spelling of the same post gives the same string
+(``twitter.com``/``x.com``/``mobile.twitter.com`` and the embed mirrors,
+``?s=20`` share suffixes, tracking parameters, trailing slashes, the
+author part of a status URL), and reduced to a 16 byte fingerprint.
+
+``SubmissionIndex`` keeps every accepted fingerprint in memory, so a
+duplicate is found with a dict lookup:
+
+* the same user sending the same proof for the same task is a resubmission
+  and is simply refused;
+* a proof already used by another account is a collision, refused and
+  recorded in ``submission_collisions`` for moderators.
+
+Only links are compared across accounts. A proof without a link ("done",
+a username...) is keyed per user, since different users legitimately send
+the same text.
+
+Accepted proofs are stored in ``submission_proofs`` (one row per task and
+fingerprint), which is what the index is loaded from at startup and what
+catches the same proof arriving on two workers at once.
+"""
+
+import hashlib
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from sqlalchemy import Column, BigInteger, Float, Integer, String, Text, delete, select
+from sqlalchemy.orm import declarative_base
+
+from lib.db import session_scope, insert_if_missing, ReloadJournal
+
+Base = declarative_base()
+
+
+class SubmissionProof(Base):
+    """An accepted proof for a task"""
+    __tablename__ = 'submission_proofs'
+
+    proof_key = Column(String(128), primary_key=True)  # "<task_id>:<fingerprint>"
+    task_id = Column(String(64), nullable=False)
+    fingerprint = Column(String(32), nullable=False, index=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    proof = Column(Text, nullable=False)
+    submitted_at = Column(Float, nullable=False)
+
+
+class SubmissionCollision(Base):
+    """A proof submitted by an account other than the one that used it first"""
+    __tablename__ = 'submission_collisions'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String(64), nullable=False)
+    fingerprint = Column(String(32), nullable=False, index=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    owner_id = Column(BigInteger, nullable=False)
+    proof = Column(Text, nullable=False)
+    submission = Column(Text, nullable=True)
+    created_at = Column(Float, nullable=False)
+
+
+X_HOSTS = frozenset((
+    'x.com', 'twitter.com', 'mobile.twitter.com', 'mobile.x.com',
+    'fxtwitter.com', 'vxtwitter.com', 'fixupx.com', 'fixvx.com', 'nitter.net',
+))
+# Query parameters that never change what a link points to
+TRACKING_PARAMS = frozenset(('fbclid', 'gclid', 'igshid', 'ref', 'ref_src', 'ref_url', 'si', 'feature'))
+
+_URL_RE = re.compile(r'(?:https?://|www\.)\S+|\b(?:[a-z0-9-]+\.)+[a-z]{2,}/\S*', re.IGNORECASE)
+_X_STATUS_RE = re.compile(r'^/(?:i/web|i|[^/]+)/status(?:es)?/(\d+)', re.IGNORECASE)
+
+
+def normalize_proof(text):
+    """Canonical form of a submission: the first link in it, or the whitespace-collapsed lowercased text"""
+    text = (text or '').strip()
+    match = _URL_RE.search(text)
+    if match is None:
+        return ' '.join(text.lower().split())
+
+    url = match.group(0).rstrip('.,;:!?)]>"\'')
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    if host in X_HOSTS:
+        # Statuses have one id whatever the author part says; handles are case-insensitive
+        status = _X_STATUS_RE.match(parts.path)
+        if status:
+            return f'https://x.com/i/status/{status.group(1)}'
+        return 'https://x.com' + (parts.path.rstrip('/').lower() or '')
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip('/')
+    return f'https://{host}{path}' + (f'?{urlencode(query)}' if query else '')
+
+
+def fingerprint(proof):
+    """16 byte digest of a normalized proof"""
+    return hashlib.blake2b(proof.encode('utf-8'), digest_size=16).digest()
+
+
+def is_link(proof):
+    """True if a normalized proof is a link, the only kind of proof compared across accounts"""
+    return proof.startswith('https://')
+
+
+def proof_digest(proof, telegram_id):
+    """Index key of a normalized proof: links are shared by all users, plain text is the user's own"""
+    return fingerprint(proof if is_link(proof) else f'{telegram_id}\n{proof}')
+
+
+class SubmissionRejected(Exception):
+    """A proof that was already used; ``kind`` is 'resubmitted' or 'collision'"""
+
+    def __init__(self, kind, owner_id):
+        super().__init__(kind)
+        self.kind = kind
+        self.owner_id = owner_id
+
+
+class SubmissionIndex(object):
+    """Fingerprints of accepted proofs, per task and across users"""
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self._by_task = {}  # (task_id, fingerprint) -> telegram_id
+        self._owners = {}   # fingerprint -> [telegram_id of the first user, tasks they used it for]
+        self._lock = threading.Lock()
+        self._journal = ReloadJournal(self._lock)  # claims and releases made while a reload runs
+        self.loaded = False
+        self.resubmissions = 0
+        self.collisions = 0
+
+    def load(self):
+        """(Re)build the index from submission_proofs; returns the number of proofs.
+
+        Claims and releases made while the proofs are being read are
+        replayed onto the new index, so none are lost at the swap.
+        """
+        self._journal.reload(self._read, self._install)
+        return len(self._by_task)
+
+    def _read(self):
+        by_task = {}
+        owners = {}
+        last_key = None
+        while True:
+            with session_scope() as db:
+                query = select(SubmissionProof.proof_key, SubmissionProof.task_id,
+                               SubmissionProof.fingerprint, SubmissionProof.telegram_id)
+                if last_key is not None:
+                    query = query.where(SubmissionProof.proof_key > last_key)
+                rows = db.execute(query.order_by(SubmissionProof.proof_key).limit(self.chunk_size)).all()
+            if not rows:
+                break
+            for _, task_id, digest, telegram_id in rows:
+                digest = bytes.fromhex(digest)
+                by_task[(task_id, digest)] = telegram_id
+                owner = owners.setdefault(digest, [telegram_id, 0])
+                if owner[0] == telegram_id:
+                    owner[1] += 1
+            last_key = rows[-1][0]
+        return by_task, owners
+
+    def _install(self, index):
+        self._by_task, self._owners = index
+        self.loaded = True
+
+    def _apply(self, change, task_id, digest, telegram_id):
+        """Apply ``_add`` or ``_remove`` to the live index; call with the lock held"""
+        change(task_id, digest, telegram_id)
+        self._journal.record(change, task_id, digest, telegram_id)
+
+    def _add(self, task_id, digest, telegram_id):
+        if self._by_task.get((task_id, digest)) == telegram_id:
+            # Replayed after a reload that already read it
+            return
+        self._by_task[(task_id, digest)] = telegram_id
+        owner = self._owners.setdefault(digest, [telegram_id, 0])
+        if owner[0] == telegram_id:
+            owner[1] += 1
+
+    def _remove(self, task_id, digest, telegram_id):
+        if self._by_task.get((task_id, digest)) != telegram_id:
+            return
+        del self._by_task[(task_id, digest)]
+        owner = self._owners.get(digest)
+        if owner is not None and owner[0] == telegram_id:
+            owner[1] -= 1
+            if not owner[1]:
+                del self._owners[digest]
+
+    def _check(self, task_id, digest, telegram_id):
+        owner = self._by_task.get((task_id, digest))
+        if owner is None:
+            first = self._owners.get(digest)
+            owner = first[0] if first is not None else telegram_id
+        elif owner == telegram_id:
+            self.resubmissions += 1
+            raise SubmissionRejected('resubmitted', owner)
+        if owner != telegram_id:
+            self.collisions += 1
+            raise SubmissionRejected('collision', owner)
+
+    def claim(self, task_id, proof, telegram_id):
+        """Reserve ``proof`` for the user's submission to ``task_id``.
+
+        Raises SubmissionRejected if the proof was already used, by this user
+        for this task or (links only) by anyone else. The same user may use
+        one proof for several tasks (one post can satisfy a like and a
+        retweet task).
+        """
+        task_id = str(task_id)
+        digest = proof_digest(proof, telegram_id)
+        with self._lock:
+            self._check(task_id, digest, telegram_id)
+            self._apply(self._add, task_id, digest, telegram_id)
+
+        # The database row catches the same proof claimed on another worker
+        try:
+            with session_scope() as db:
+                stored = insert_if_missing(db, SubmissionProof, 'proof_key', {
+                    'proof_key': f'{task_id}:{digest.hex()}',
+                    'task_id': task_id,
+                    'fingerprint': digest.hex(),
+                    'telegram_id': telegram_id,
+                    'proof': proof,
+                    'submitted_at': time.time(),
+                })
+                owner = None if stored else db.execute(
+                    select(SubmissionProof.telegram_id).where(SubmissionProof.proof_key == f'{task_id}:{digest.hex()}')
+                ).scalar()
+        except Exception:
+            # Nothing was stored, so the user must be able to try again
+            with self._lock:
+                self._apply(self._remove, task_id, digest, telegram_id)
+            raise
+        if owner is None:
+            return
+        with self._lock:
+            if owner == telegram_id:
+                self.resubmissions += 1
+                raise SubmissionRejected('resubmitted', owner)
+            # Another worker accepted it first; adopt its owner
+            self._apply(self._remove, task_id, digest, telegram_id)
+            self._apply(self._add, task_id, digest, owner)
+            self.collisions += 1
+        raise SubmissionRejected('collision', owner)
+
+    def release(self, task_id, proof, telegram_id):
+        """Undo a claim whose submission the task backend did not accept"""
+        task_id = str(task_id)
+        digest = proof_digest(proof, telegram_id)
+        with self._lock:
+            self._apply(self._remove, task_id, digest, telegram_id)
+        with session_scope() as db:
+            db.execute(delete(SubmissionProof.__table__).where(
+                SubmissionProof.proof_key == f'{task_id}:{digest.hex()}',
+                SubmissionProof.telegram_id == telegram_id
+            ))
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'proofs': len(self._by_task),
+            'resubmissions_rejected': self.resubmissions,
+            'collisions': self.collisions,
+        }
+
+
+def record_collision(task_id, proof, telegram_id, owner_id, submission=None):
+    """Report a proof reused across accounts to moderators"""
+    with session_scope() as db:
+        db.add(SubmissionCollision(
+            task_id=str(task_id),
+            fingerprint=fingerprint(proof).hex(),
+            telegram_id=telegram_id,
+            owner_id=owner_id,
+            proof=proof,
+            submission=submission,
+            created_at=time.time()
+        ))
+
+
+def list_collisions(after=None, limit=100):
+    """One page of reported collisions, oldest first"""
+    with session_scope() as db:
+        query = db.query(SubmissionCollision)
+        if after is not None:
+            query = query.filter(SubmissionCollision.id > after)
+        rows = query.order_by(SubmissionCollision.id).limit(limit).all()
+
+    items = [{
+        'id': row.id,
+        'task_id': row.task_id,
+        'telegram_id': row.telegram_id,
+        'owner_id': row.owner_id,
+        'proof': row.proof,
+        'submission': row.submission,
+        'created_at': row.created_at,
+    } for row in rows]
+    next_cursor = items[-1]['id'] if len(items) == limit else None
+    return items, next_cursor
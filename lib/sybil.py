@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sybil / referral-farming detection.
+
+Farms register thousands of accounts through one referral link, reuse
+wallets and pick near-identical X handles. Every registered user is scored
+on five signals, computed with vectorized NumPy over the whole user base:
+
+* ``wallet``  - the wallet is also used by other accounts;
+* ``handle``  - several users of the same referrer share a handle stem
+  (the handle lowercased without digits and underscores: ``john_123`` and
+  ``John4`` are both ``john``);
+* ``burst``   - the user is part of a run of the referrer's users with
+  nearly consecutive telegram ids, i.e. accounts created in bulk (the table
+  has no join timestamp; telegram ids are handed out in creation order);
+* ``fanout``  - the referrer brought in an unusually large number of users;
+* ``proof``   - the user sent a task proof another user of the same
+  referrer had already used, or had theirs reused (the collisions recorded
+  in ``submission_collisions``).
+
+Signals are combined as independent probabilities, ``1 - prod(1 - p)``,
+and users scoring at least the threshold are written to the
+``sybil_flags`` table, which the moderation API and the payout export read.
+
+Users are streamed from the database in chunks and only kept as a few
+int64 arrays (strings are reduced to hashes right away), so one million
+users take roughly 50 MB. A full scan replaces the table; the incremental
+mode rescores only the referrer groups that gained users or wallets since
+the last run.
+
+Run a full scan from the project root::
+
+    python -m lib.sybil
+"""
+
+import json
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import Column, BigInteger, Float, String, delete, insert, or_, select
+from sqlalchemy.orm import declarative_base
+
+import settings
+from lib.db import session_scope
+from lib.models import users_data
+from lib.submissions import SubmissionCollision
+
+Base = declarative_base()
+
+
+class SybilFlag(Base):
+    """A user the detector considers part of a farm"""
+    __tablename__ = 'sybil_flags'
+
+    telegram_id = Column(BigInteger, primary_key=True)
+    score = Column(Float, nullable=False)
+    reasons = Column(String(64), nullable=False)
+    referrer_id = Column(BigInteger, nullable=True)
+    flagged_at = Column(Float, nullable=False)
+
+
+REASONS = ('wallet', 'handle', 'burst', 'fanout', 'proof')
+
+# Characters dropped from handles to get their stem
+_STEM_TABLE = str.maketrans('', '', '0123456789_@.-')
+
+
+def handle_stem(handle):
+    """Lowercased handle without digits and separators, or None if too short to mean anything"""
+    if not handle:
+        return None
+    stem = handle.strip().lower().translate(_STEM_TABLE)
+    return stem if len(stem) >= 3 else None
+
+
+def _group_sizes(keys, mask):
+    """For each row, how many rows with ``mask`` set share its key (0 where ``mask`` is unset)"""
+    sizes = np.zeros(len(keys), dtype=np.int64)
+    if mask.any():
+        _, inverse, counts = np.unique(keys[mask], return_inverse=True, return_counts=True)
+        sizes[mask] = counts[inverse]
+    return sizes
+
+
+class UserFeatures(object):
+    """Column arrays for a set of users, built chunk by chunk"""
+
+    def __init__(self):
+        self._chunks = []
+        self.telegram_id = self.referrer = self.wallet = self.stem = self.proof = np.empty(0, dtype=np.int64)
+
+    def add_rows(self, rows):
+        # 0 stands for "none"; a real hash of 0 is astronomically unlikely and would only merge two groups
+        chunk = np.empty((len(rows), 4), dtype=np.int64)
+        for i, (telegram_id, referral_by, wallet, twitter_id) in enumerate(rows):
+            stem = handle_stem(twitter_id)
+            chunk[i] = (
+                telegram_id,
+                referral_by or 0,
+                hash(wallet) if wallet else 0,
+                hash(stem) if stem else 0,
+            )
+        self._chunks.append(chunk)
+
+    def finish(self):
+        data = np.concatenate(self._chunks) if self._chunks else np.empty((0, 4), dtype=np.int64)
+        self._chunks = []
+        self.telegram_id, self.referrer, self.wallet, self.stem = (np.ascontiguousarray(data[:, i]) for i in range(4))
+        self.proof = np.zeros(len(self.telegram_id), dtype=np.int64)
+        return len(self.telegram_id)
+
+    def add_collisions(self, pairs):
+        """Count proofs shared between users of the same referrer; ``pairs`` are (telegram_id, owner_id), after finish()"""
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        if not len(pairs) or not len(self.telegram_id):
+            return
+        order = np.argsort(self.telegram_id)
+        sorted_id = self.telegram_id[order]
+        position = np.minimum(np.searchsorted(sorted_id, pairs), len(sorted_id) - 1)
+        # Both accounts must be among the scored users
+        rows = order[position[(sorted_id[position] == pairs).all(axis=1)]]
+        referrer = self.referrer[rows]
+        same_group = (referrer[:, 0] == referrer[:, 1]) & (referrer[:, 0] != 0)
+        np.add.at(self.proof, rows[same_group].ravel(), 1)
+
+
+def score_users(features, burst_gap=100000, burst_min=5, fanout_min=50):
+    """Per-user ``(score, reason bitmask)`` arrays, aligned with ``features.telegram_id``"""
+    n = len(features.telegram_id)
+    referred = features.referrer != 0
+
+    # wallet: accounts sharing the wallet
+    wallet_sharers = _group_sizes(features.wallet, features.wallet != 0)
+    p_wallet = np.where(wallet_sharers >= 2, 0.9, 0.0)
+
+    # handle: same stem among the referrer's users
+    pair = features.referrer * np.int64(1000003) ^ features.stem
+    stem_sharers = _group_sizes(pair, referred & (features.stem != 0))
+    p_handle = np.where(stem_sharers >= 3, np.minimum(0.8, 0.2 * (stem_sharers - 1)), 0.0)
+
+    # burst: runs of the referrer's users with nearly consecutive telegram ids
+    order = np.lexsort((features.telegram_id, features.referrer))
+    sorted_referrer = features.referrer[order]
+    sorted_id = features.telegram_id[order]
+    linked = np.zeros(n, dtype=bool)
+    if n > 1:
+        # linked[i]: row i continues the run of row i - 1
+        linked[1:] = (sorted_referrer[1:] == sorted_referrer[:-1]) & (np.diff(sorted_id) <= burst_gap)
+    linked &= sorted_referrer != 0
+    run_id = np.cumsum(~linked)
+    run_sizes = np.bincount(run_id)[run_id]
+    burst = np.empty(n, dtype=np.int64)
+    burst[order] = np.where(sorted_referrer != 0, run_sizes, 0)
+    p_burst = np.where(burst >= burst_min, np.minimum(0.8, 0.1 * burst), 0.0)
+
+    # fanout: size of the referrer's group
+    fanout = _group_sizes(features.referrer, referred)
+    p_fanout = np.where(fanout >= fanout_min, 0.3, 0.0)
+
+    # proof: task proofs shared with users of the same referrer
+    p_proof = np.minimum(0.9, 0.45 * features.proof)
+
+    probabilities = (p_wallet, p_handle, p_burst, p_fanout, p_proof)
+    score = 1.0 - np.prod([1.0 - p for p in probabilities], axis=0) if n else np.zeros(0)
+    reasons = np.zeros(n, dtype=np.int64)
+    for bit, p in enumerate(probabilities):
+        reasons |= (p > 0).astype(np.int64) << bit
+    return score, reasons
+
+
+def reason_names(bits):
+    return ','.join(name for bit, name in enumerate(REASONS) if bits & (1 << bit))
+
+
+class SybilDetector(object):
+    """Full and incremental scoring runs writing to ``sybil_flags``"""
+
+    def __init__(self, threshold=0.7, burst_gap=100000, burst_min=5, fanout_min=50, chunk_size=10000):
+        self.threshold = threshold
+        self.burst_gap = burst_gap
+        self.burst_min = burst_min
+        self.fanout_min = fanout_min
+        self.chunk_size = chunk_size
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self.last_run = None
+
+    def mark(self, referrer_id):
+        """Rescore the referrer's group on the next incremental run"""
+        if referrer_id:
+            with self._lock:
+                self._dirty.add(referrer_id)
+
+    def _columns(self):
+        return select(users_data.telegram_id, users_data.referral_by, users_data.wallet, users_data.twitter_id)
+
+    def _collisions(self, db, telegram_ids=None):
+        """(telegram_id, owner_id) of recorded proof collisions, all or those submitted by ``telegram_ids``"""
+        query = select(SubmissionCollision.telegram_id, SubmissionCollision.owner_id)
+        if telegram_ids is None:
+            return db.execute(query).all()
+        rows = []
+        for start in range(0, len(telegram_ids), self.chunk_size):
+            rows.extend(db.execute(query.where(
+                SubmissionCollision.telegram_id.in_(telegram_ids[start:start + self.chunk_size])
+            )).all())
+        return rows
+
+    def _score(self, features):
+        return score_users(features, self.burst_gap, self.burst_min, self.fanout_min)
+
+    def _flags(self, features, score, reasons, only=None):
+        now = time.time()
+        flagged = score >= self.threshold
+        if only is not None:
+            flagged &= only
+        for i in np.flatnonzero(flagged):
+            yield {
+                'telegram_id': int(features.telegram_id[i]),
+                'score': round(float(score[i]), 4),
+                'reasons': reason_names(int(reasons[i])),
+                'referrer_id': int(features.referrer[i]) or None,
+                'flagged_at': now,
+            }
+
+    def _write(self, db, flags):
+        written = 0
+        batch = []
+        for flag in flags:
+            batch.append(flag)
+            if len(batch) >= self.chunk_size:
+                db.execute(insert(SybilFlag.__table__), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            db.execute(insert(SybilFlag.__table__), batch)
+            written += len(batch)
+        return written
+
+    def run(self):
+        """Score every user and replace the flag table; returns a summary"""
+        with self._run_lock:
+            started = time.monotonic()
+            with self._lock:
+                self._dirty.clear()
+            features = UserFeatures()
+            with session_scope() as db:
+                result = db.execute(self._columns().execution_options(stream_results=True))
+                for rows in result.partitions(self.chunk_size):
+                    features.add_rows(rows)
+                users = features.finish()
+                features.add_collisions(self._collisions(db))
+            score, reasons = self._score(features)
+
+            with session_scope() as db:
+                db.execute(delete(SybilFlag.__table__))
+                flagged = self._write(db, self._flags(features, score, reasons))
+            self.last_run = self._summary('full', users, flagged, score >= self.threshold, reasons, started)
+            return self.last_run
+
+    def run_incremental(self):
+        """Rescore the groups marked since the last run; returns a summary (None if nothing changed)"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return None
+        with self._run_lock:
+            started = time.monotonic()
+            referrers = sorted(dirty)
+            features = UserFeatures()
+            with session_scope() as db:
+                seen = set()
+                for start in range(0, len(referrers), 500):
+                    chunk = referrers[start:start + 500]
+                    # The groups themselves, plus every account sharing a wallet with them
+                    wallets = select(users_data.wallet).where(
+                        users_data.referral_by.in_(chunk), users_data.wallet.isnot(None)
+                    )
+                    rows = db.execute(self._columns().where(or_(
+                        users_data.referral_by.in_(chunk), users_data.wallet.in_(wallets)
+                    ))).all()
+                    rows = [row for row in rows if row[0] not in seen]
+                    seen.update(row[0] for row in rows)
+                    features.add_rows(rows)
+                users = features.finish()
+                # Both accounts of a counted collision share a referrer, so are in the sample
+                features.add_collisions(self._collisions(db, [int(telegram_id) for telegram_id in features.telegram_id]))
+            score, reasons = self._score(features)
+
+            # Only the marked groups are complete in this sample, so only they are rewritten
+            in_groups = np.isin(features.referrer, np.array(referrers, dtype=np.int64))
+            group_ids = [int(telegram_id) for telegram_id in features.telegram_id[in_groups]]
+            with session_scope() as db:
+                for start in range(0, len(group_ids), self.chunk_size):
+                    db.execute(delete(SybilFlag.__table__).where(
+                        SybilFlag.telegram_id.in_(group_ids[start:start + self.chunk_size])
+                    ))
+                flagged = self._write(db, self._flags(features, score, reasons, only=in_groups))
+            self.last_run = self._summary('incremental', users, flagged, (score >= self.threshold) & in_groups,
+                                          reasons, started)
+            return self.last_run
+
+    def _summary(self, mode, users, flagged, flagged_mask, reasons, started):
+        return {
+            'mode': mode,
+            'users': users,
+            'flagged': flagged,
+            'by_reason': {
+                name: int(np.count_nonzero(flagged_mask & ((reasons >> bit) & 1).astype(bool)))
+                for bit, name in enumerate(REASONS)
+            },
+            'elapsed_s': round(time.monotonic() - started, 3),
+        }
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._dirty)
+        return {'pending_groups': pending, 'last_run': self.last_run}
+
+
+def create_detector():
+    """SybilDetector configured from settings"""
+    return SybilDetector(
+        threshold=settings.SYBIL_FLAG_THRESHOLD,
+        burst_gap=settings.SYBIL_BURST_ID_GAP,
+        burst_min=settings.SYBIL_BURST_MIN,
+        fanout_min=settings.SYBIL_FANOUT_MIN,
+        chunk_size=settings.SYBIL_CHUNK_SIZE
+    )
+
+
+if __name__ == '__main__':
+    print(json.dumps(create_detector().run(), indent=2))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared, in-process cache of the task catalog served by the task backend.
+
+The catalog is fetched from ``/tasks`` at most once per TTL, using a
+conditional request (ETag / If-None-Match) so an unchanged catalog costs a
+304 instead of a full download. Tasks are indexed by id, so looking up a
+single task is a dict lookup. The version, task list and index are
+published as one tuple, so readers never see a task list from one version
+paired with another version.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from lib.metrics import InstrumentedSession
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCatalogError(Exception):
+    """Raised when the catalog cannot be loaded and no cached copy exists"""
+
+
+class TaskCatalog(object):
+    """TTL-refreshed task list with an id index and a catalog version"""
+
+    def __init__(self, api_url, ttl=30, timeout=5.0):
+        self.url = api_url.rstrip('/') + '/tasks'
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._http = InstrumentedSession('task_api')
+        # (version, tasks, id -> task), swapped in one assignment
+        self._snapshot = (None, (), {})
+        self._etag = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+        self.refreshes = 0
+        self.not_modified = 0
+        self.errors = 0
+
+    @property
+    def version(self):
+        return self._snapshot[0]
+
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def refresh(self, force=False):
+        """Reload the catalog if the TTL expired (or ``force`` is set)"""
+        if not force and self._is_fresh():
+            return
+        # Only one thread refreshes; the others keep serving the current copy
+        if not self._lock.acquire(blocking=self.version is None):
+            return
+        try:
+            if not force and self._is_fresh():
+                return
+            headers = {'If-None-Match': self._etag} if self._etag else {}
+            try:
+                response = self._http.get(self.url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                self._fetch_failed(f"Error fetching task catalog: {e}")
+                return
+
+            if response.status_code == 304:
+                self.not_modified += 1
+                self._loaded_at = time.monotonic()
+                return
+            if response.status_code != 200:
+                self._fetch_failed(f"Task API returned status {response.status_code}")
+                return
+
+            body = response.content
+            # Use the backend's ETag when present, otherwise a hash of the body
+            version = response.headers.get('ETag') or hashlib.sha1(body).hexdigest()
+            if version != self.version:
+                tasks = tuple(json.loads(body).get('tasks', []))
+                self._snapshot = (version, tasks, {str(task['id']): task for task in tasks})
+                self.refreshes += 1
+            self._etag = response.headers.get('ETag')
+            self._loaded_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def _fetch_failed(self, message):
+        self.errors += 1
+        logger.error(message)
+        if self.version is None:
+            raise TaskCatalogError(message)
+        # Keep serving the stale copy and retry a few seconds later
+        self._loaded_at = time.monotonic() - self.ttl + min(5, self.ttl)
+
+    def snapshot(self):
+        """``(version, tasks, id -> task)`` of one catalog version"""
+        self.refresh()
+        return self._snapshot
+
+    def tasks(self):
+        """All active tasks, in backend order"""
+        return self.snapshot()[1]
+
+    def get(self, task_id):
+        """Look up a task by id; returns None when it does not exist"""
+        return self.snapshot()[2].get(str(task_id))
+
+    def invalidate(self):
+        """Force a (conditional) reload on the next access"""
+        self._loaded_at = None
+
+    def stats(self):
+        return {
+            'tasks': len(self._snapshot[1]),
+            'version': self._snapshot[0],
+            'refreshes': self.refreshes,
+            'not_modified': self.not_modified,
+            'errors': self.errors,
+        }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Last known X (Twitter) verification status per user, and the decisions
+that reach those users.
+
+Users waiting for a manual verification are answered from
+``TwitterStatusCache`` instead of a database read on every message. The
+cache is kept current in two ways: ``twitter_status`` events on the
+notification bus for decisions made in this process, and
+:func:`poll_decisions`, which re-reads the statuses of the users this
+process has cached as waiting, so decisions made by another worker or
+directly in the database are seen within one poll interval and announced
+like local ones.
+
+Several processes may see the same decision, but each user is told about
+it once: whoever announces a decision first owns its ``twitter_notices``
+row (see :func:`claim_notice`). Decisions made through
+``apply_twitter_decisions`` reserve the row in the same transaction.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, BigInteger, Float, String, delete, update
+from sqlalchemy.orm import declarative_base
+
+from lib.db import session_scope, insert_if_missing, upsert_many
+
+Base = declarative_base()
+
+# Statuses a moderator can decide; users are told about these
+DECISIONS = ('approved', 'rejected')
+
+
+class TwitterNotice(Base):
+    """The last decision a user was (or is being) told about"""
+    __tablename__ = 'twitter_notices'
+
+    telegram_id = Column(BigInteger, primary_key=True)
+    status = Column(String(16), nullable=False)
+    created_at = Column(Float, nullable=False)
+
+
+def reserve_notices(db, telegram_ids, status):
+    """Mark decisions made in ``db``'s transaction as announced by this process"""
+    now = time.time()
+    upsert_many(db, TwitterNotice, 'telegram_id', [
+        {'telegram_id': telegram_id, 'status': status, 'created_at': now} for telegram_id in telegram_ids
+    ])
+
+
+def clear_notice(db, telegram_id):
+    """Forget the last decision, when the user submits a new username"""
+    db.execute(delete(TwitterNotice.__table__).where(TwitterNotice.telegram_id == telegram_id))
+
+
+def claim_notice(telegram_id, status):
+    """True if this process should tell the user about ``status``; False if another one already does"""
+    with session_scope() as db:
+        if insert_if_missing(db, TwitterNotice, 'telegram_id',
+                             {'telegram_id': telegram_id, 'status': status, 'created_at': time.time()}):
+            return True
+        return db.execute(update(TwitterNotice.__table__).where(
+            (TwitterNotice.telegram_id == telegram_id) & (TwitterNotice.status != status)
+        ).values(status=status, created_at=time.time())).rowcount == 1
+
+
+class TwitterStatusCache(object):
+    """Bounded telegram_id -> verification status map with a TTL"""
+
+    def __init__(self, ttl=300, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id):
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, telegram_id, status):
+        with self._lock:
+            self._entries[telegram_id] = (status, time.monotonic() + self.ttl)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def waiting(self):
+        """Users cached as 'pending', whether or not their entry expired"""
+        with self._lock:
+            return [telegram_id for telegram_id, (status, _) in self._entries.items() if status == 'pending']
+
+    def renew(self, telegram_ids, status):
+        """Extend entries still holding ``status``, after the database confirmed it"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for telegram_id in telegram_ids:
+                entry = self._entries.get(telegram_id)
+                if entry is not None and entry[0] == status:
+                    self._entries[telegram_id] = (status, expires)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+
+def load_waiting(cache, chunk_size=5000):
+    """Cache every user waiting for a decision, so poll_decisions watches them; returns how many"""
+    # Imported here so the cache works without the models (and their database)
+    from lib.models import users_data
+
+    loaded = 0
+    last_id = None
+    while loaded < cache.max_size:
+        with session_scope() as db:
+            query = db.query(users_data.telegram_id).filter(
+                users_data.twitter_verification_status == 'pending',
+                users_data.twitter_id.isnot(None),
+                users_data.registration_step == 2
+            )
+            if last_id is not None:
+                query = query.filter(users_data.telegram_id > last_id)
+            rows = query.order_by(users_data.telegram_id).limit(chunk_size).all()
+        if not rows:
+            break
+        for (telegram_id,) in rows:
+            cache.set(telegram_id, 'pending')
+        loaded += len(rows)
+        last_id = rows[-1][0]
+    return loaded
+
+
+def poll_decisions(cache, publish, chunk_size=5000):
+    """Re-read the status of every waiting user; ``publish(telegram_id, status)`` each one that changed.
+
+    Returns the number of changes found.
+    """
+    from lib.models import users_data
+
+    waiting = cache.waiting()
+    changed = 0
+    for start in range(0, len(waiting), chunk_size):
+        chunk = waiting[start:start + chunk_size]
+        with session_scope() as db:
+            rows = db.query(users_data.telegram_id, users_data.twitter_verification_status).filter(
+                users_data.telegram_id.in_(chunk),
+                users_data.twitter_verification_status != 'pending'
+            ).all()
+        decided = set()
+        for telegram_id, status in rows:
+            decided.add(telegram_id)
+            publish(telegram_id, status)
+        changed += len(decided)
+        cache.renew((telegram_id for telegram_id in chunk if telegram_id not in decided), 'pending')
+    return changed
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bounded, per-chat ordered queue for incoming Telegram updates.
+
+Updates are hashed by user/chat id onto a fixed number of worker lanes.
+Every lane has its own bounded queue and a single worker thread, so updates
+from one user are processed in order (``context.user_data`` and
+ConversationHandler state never race) while different users run in
+parallel.
+
+In webhook mode the route only hands the update to ``submit`` and returns;
+when the lane is full ``submit`` refuses the update so the webhook can
+answer 503 and let Telegram retry. In polling mode ``submit(block=True)``
+pushes back on the poller instead.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from lib.log import log_context, update_fields
+
+logger = logging.getLogger(__name__)
+
+# How many distinct users per lane are tracked for hot-spot reporting
+HOT_KEYS_PER_LANE = 256
+
+
+def update_key(update):
+    """Ordering key of an update: the user id, falling back to the chat id"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    return 0
+
+
+class Lane(object):
+    """One worker thread with its own bounded queue"""
+
+    def __init__(self, index, max_size):
+        self.index = index
+        self.queue = queue.Queue(maxsize=max_size)
+        self.thread = None
+        self.processed = 0
+        self.busy = 0.0
+        # user key -> [updates, busy seconds]
+        self.keys = {}
+
+    def record(self, key, took):
+        self.processed += 1
+        self.busy += took
+        entry = self.keys.get(key)
+        if entry is None:
+            if len(self.keys) >= HOT_KEYS_PER_LANE * 2:
+                # Keep only the busiest users so the table stays bounded
+                top = sorted(self.keys.items(), key=lambda item: item[1][1], reverse=True)
+                self.keys = dict(top[:HOT_KEYS_PER_LANE])
+            entry = self.keys[key] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += took
+
+
+class UpdateQueue(object):
+    """Per-user ordered, cross-user parallel update processing"""
+
+    def __init__(self, handler, workers=8, max_size=1000):
+        self.handler = handler
+        self.workers = workers
+        self.lanes = [Lane(i, max(1, max_size // workers)) for i in range(workers)]
+        self._started_at = None
+        self._lock = threading.Lock()
+
+        # metrics
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._processing_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._started_at is not None:
+                return
+            self._started_at = time.monotonic()
+            for lane in self.lanes:
+                lane.thread = threading.Thread(target=self._worker, args=(lane,),
+                                               name=f'update-lane-{lane.index}', daemon=True)
+                lane.thread.start()
+
+    def stop(self):
+        """Let workers finish the queued updates, then exit"""
+        with self._lock:
+            if self._started_at is None:
+                return
+            self._started_at = None
+        for lane in self.lanes:
+            lane.queue.put(None)
+        for lane in self.lanes:
+            lane.thread.join()
+            lane.thread = None
+
+    def lane_for(self, key):
+        return self.lanes[hash(key) % len(self.lanes)]
+
+    def submit(self, update, block=False):
+        """Queue an update on its user's lane; returns False when the lane is full"""
+        key = update_key(update)
+        try:
+            self.lane_for(key).queue.put((time.monotonic(), key, update), block=block)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def _worker(self, lane):
+        while True:
+            item = lane.queue.get()
+            if item is None:
+                break
+            enqueued_at, key, update = item
+            started = time.monotonic()
+            waited = started - enqueued_at
+            try:
+                # Every line logged while handling the update carries its ids
+                with log_context(**update_fields(update)):
+                    self.handler(update)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Error processing update {getattr(update, 'update_id', None)}: {e}")
+            finally:
+                took = time.monotonic() - started
+                with self._lock:
+                    lane.record(key, took)
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+                    self._processing_max = max(self._processing_max, took)
+
+    def hot_keys(self, limit=10):
+        """Users that consumed the most processing time"""
+        with self._lock:
+            entries = [(key, count, busy) for lane in self.lanes for key, (count, busy) in lane.keys.items()]
+        entries.sort(key=lambda entry: entry[2], reverse=True)
+        return [{'key': key, 'updates': count, 'busy_ms': round(busy * 1000, 3)}
+                for key, count, busy in entries[:limit]]
+
+    def stats(self):
+        uptime = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        with self._lock:
+            processed = sum(lane.processed for lane in self.lanes)
+            processing_total = sum(lane.busy for lane in self.lanes)
+            lanes = [{
+                'lane': lane.index,
+                'depth': lane.queue.qsize(),
+                'processed': lane.processed,
+                'utilization': round(lane.busy / uptime, 4) if uptime else 0.0,
+            } for lane in self.lanes]
+            wait_total, wait_max = self._wait_total, self._wait_max
+            processing_max = self._processing_max
+        return {
+            'workers': len(self.lanes),
+            'depth': sum(lane['depth'] for lane in lanes),
+            'max_size': sum(lane.queue.maxsize for lane in self.lanes),
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'processed': processed,
+            'failed': self.failed,
+            'avg_wait_ms': round(wait_total / processed * 1000, 3) if processed else 0.0,
+            'max_wait_ms': round(wait_max * 1000, 3),
+            'avg_processing_ms': round(processing_total / processed * 1000, 3) if processed else 0.0,
+            'max_processing_ms': round(processing_max * 1000, 3),
+            'lanes': lanes,
+            'hot_keys': self.hot_keys(),
+        }
+
+
+def route_dispatcher_updates(dispatcher, update_queue):
+    """Make a polling Dispatcher hand its updates to ``update_queue``.
+
+    ``Dispatcher.start`` pulls updates from the poller and calls
+    ``process_update``; the lanes call the original method instead, and the
+    dispatcher thread blocks while a lane is full.
+    """
+    update_queue.handler = dispatcher.process_update
+    dispatcher.process_update = lambda update: update_queue.submit(update, block=True)
+    update_queue.start()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read-through cache of user profiles, keyed by telegram_id.
+
+``/start`` and ``/info`` are sent over and over by the same users; the
+profile behind them only changes when the bot itself writes it. Profiles
+are copied out of the loader's result into small ``__slots__`` records
+(no ORM objects or per-row dicts are kept alive), held in a bounded LRU
+and dropped whenever the user's row is written (see ``invalidate``).
+Entries also expire after a TTL, to pick up writes made by other
+processes.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Columns of users_data kept in a profile
+PROFILE_FIELDS = (
+    'telegram_id', 'username', 'twitter_id', 'wallet', 'registration_step',
+    'telegram_verified', 'twitter_verification_status', 'wallet_submitted',
+    'balance', 'verified', 'referral_count', 'referral_by',
+)
+
+
+class LoadTracker(object):
+    """Loads in flight per key, so a load that raced with a write is not cached.
+
+    Not locked itself: callers hold their cache's lock around every call.
+    ``begin(key)`` registers a load and returns a token, ``changed(key)``
+    records a write, and ``end(key, token)`` unregisters the load and tells
+    whether its result may be cached. Only keys being loaded have an entry.
+    """
+
+    def __init__(self):
+        self._loads = {}  # key -> [loads in flight, writes seen since]
+
+    def begin(self, key):
+        load = self._loads.get(key)
+        if load is None:
+            load = self._loads[key] = [0, 0]
+        load[0] += 1
+        return load[1]
+
+    def end(self, key, token):
+        """End a load started by begin(); False if ``key`` was written meanwhile"""
+        load = self._loads[key]
+        load[0] -= 1
+        if not load[0]:
+            del self._loads[key]
+        return load[1] == token
+
+    def changed(self, key):
+        load = self._loads.get(key)
+        if load is not None:
+            load[1] += 1
+
+    def __len__(self):
+        return len(self._loads)
+
+
+class UserProfile(object):
+    """Compact copy of one users_data row, with the lazily built /info text"""
+    __slots__ = PROFILE_FIELDS + ('summary', 'expires')
+
+    def __init__(self, row, expires):
+        for field in PROFILE_FIELDS:
+            setattr(self, field, row.get(field))
+        self.summary = None
+        self.expires = expires
+
+    def get(self, field, default=None):
+        """dict-style access, so profiles can stand in for users_data rows as dicts"""
+        value = getattr(self, field, None) if field in PROFILE_FIELDS else None
+        return default if value is None else value
+
+    def size(self):
+        """Approximate bytes held by this record and the values it owns"""
+        total = sys.getsizeof(self)
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if isinstance(value, str):
+                total += sys.getsizeof(value)
+        return total
+
+
+class UserProfileCache(object):
+    """Bounded LRU of UserProfile records in front of the user loaders.
+
+    ``load_profile(telegram_id)`` returns a dict-like row (or raises / returns
+    None when the user does not exist); ``load_summary(telegram_id)`` returns
+    the /info text. Missing users are not cached, so a freshly registered
+    user is found on the next lookup.
+    """
+
+    def __init__(self, load_profile, load_summary, max_size=50000, ttl=60):
+        self.load_profile = load_profile
+        self.load_summary = load_summary
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = LoadTracker()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, telegram_id):
+        """``(profile, None)`` on a hit; on a miss ``(None, generation)`` and a load is registered"""
+        with self._lock:
+            profile = self._entries.get(telegram_id)
+            if profile is not None and profile.expires > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return profile, None
+            self.misses += 1
+            return None, self._loads.begin(telegram_id)
+
+    def _store(self, telegram_id, profile, generation):
+        """End a load registered by _lookup; cache ``profile`` unless the user was written meanwhile"""
+        with self._lock:
+            if not self._loads.end(telegram_id, generation) or profile is None:
+                return
+            self._remove(telegram_id)
+            self._entries[telegram_id] = profile
+            self._bytes += profile.size()
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size()
+                self.evictions += 1
+
+    def _remove(self, telegram_id):
+        profile = self._entries.pop(telegram_id, None)
+        if profile is not None:
+            self._bytes -= profile.size()
+
+    def get(self, telegram_id):
+        """The user's profile, or None if they are not registered"""
+        profile, generation = self._lookup(telegram_id)
+        if profile is not None:
+            return profile
+        try:
+            row = self.load_profile(telegram_id)
+        except Exception:
+            # A failed read is answered like an unknown user, and not cached
+            row = None
+        profile = UserProfile(row, time.monotonic() + self.ttl) if row else None
+        self._store(telegram_id, profile, generation)
+        return profile
+
+    def summary(self, telegram_id):
+        """The user's /info text, or None if they are not registered"""
+        profile = self.get(telegram_id)
+        if profile is None:
+            return None
+        if profile.summary is None:
+            summary = self.load_summary(telegram_id)
+            with self._lock:
+                if self._entries.get(telegram_id) is profile:
+                    self._bytes -= profile.size()
+                    profile.summary = summary
+                    self._bytes += profile.size()
+            return summary
+        return profile.summary
+
+    def invalidate(self, telegram_id):
+        """Forget a user after their row was written"""
+        with self._lock:
+            self._loads.changed(telegram_id)
+            self._remove(telegram_id)
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+            memory = self._bytes + sys.getsizeof(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'memory_bytes': memory,
+            'bytes_per_entry': memory // size if size else 0,
+        }
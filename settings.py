@@ -1,3 +1,5 @@
+import os
+
 WELCOME_MESSAGE = """Welcome, {Username}! To qualify for the Greendale Airdrop: 
  
  Stay in all our social channels & complete daily tasks. 
@@ -7,7 +9,7 @@ WELCOME_MESSAGE = """Welcome, {Username}! To qualify for the Greendale Airdrop:
  Rewards will be sent to your Solana wallet within 14 days after the airdrop ends."""
 
 ##TOKEN
-TELEGRAM_TOKEN= ''
+TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN', '')
 
 
 ## welcome message
@@ -45,6 +47,122 @@ TWITTER_REJECTED_MESSAGE = "❌ Your X verification was rejected.\n\nReason: {re
 WALLET_PROMPT_MESSAGE = "💰 Final Step: Solana Wallet Submission\n\nPlease submit your Solana wallet address (e.g., from Phantom, Solflare, or other Solana wallets).\n\n⚠️ Important: Do not send an exchange wallet address."
 FINAL_SUCCESS_MESSAGE = "🎊 Registration Complete!\n\nCongratulations! You have successfully completed all verification steps:\n✅ Telegram group membership\n✅ X (Twitter) follow verification\n✅ Solana wallet submission\n\nYou're now eligible for the Greendale airdrop! Tokens will be distributed to your wallet address after February 28th, 2019.\n\n🔗 Your referral link: {ref_link}\nShare with friends to earn bonus tokens!"
 ALREADY_REGISTERED_MESSAGE = "✅ You're already registered!\n\nYour account status:\n{status_info}\n\n🔗 Your referral link: {ref_link}"
+USER_INFO_MESSAGE = "👤 Your account\n\n🆔 Telegram ID: {telegram_id}\n📛 Username: {username}\n🐦 X (Twitter): {twitter_id} ({twitter_verification_status})\n💰 Wallet: {wallet}\n🪙 Balance: {balance}\n👥 Referrals: {referral_count}"
+
+
+
+
+## automatic membership checks
+MEMBERSHIP_CHECK_INTERVAL = 30  # seconds between two checks of the same user
+MEMBERSHIP_CHECK_MAX_ATTEMPTS = 20  # 20 * 30 seconds = 10 minutes
+MEMBERSHIP_CHECK_TICK = 5  # how often the scheduler looks for due users
+MEMBERSHIP_CHECK_BATCH_SIZE = 200
+
+## membership API client
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')  # Bot API server (benchmarks point it at a fake)
+MEMBERSHIP_CHECK_WORKERS = 16  # pooled connections and parallel getChatMember calls
+MEMBERSHIP_INTERACTIVE_WORKERS = 4  # separate pool for users pressing "check", never behind a scheduler batch
+MEMBERSHIP_CONNECT_TIMEOUT = 3.0
+MEMBERSHIP_READ_TIMEOUT = 5.0
+
+## membership result cache
+MEMBERSHIP_CACHE_SIZE = 100000  # (user, group) entries
+MEMBERSHIP_CACHE_POSITIVE_TTL = 600
+MEMBERSHIP_CACHE_NEGATIVE_TTL = 5  # doubles on repeated negatives...
+MEMBERSHIP_CACHE_NEGATIVE_MAX_TTL = 20  # ...up to this many seconds
+
+## task backend
+TASKS_API_URL = os.environ.get('TASKS_API_URL', 'http://localhost:5000/api')
+TASK_CATALOG_TTL = 30  # seconds before the task list is re-validated
+
+## database
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///airdrop_bot.db')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # should cover dispatcher + webhook workers
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+DB_POOL_RECYCLE = 1800  # recycle connections before RDS/pgbouncer idle timeouts
+
+## update processing (webhook and polling)
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 8))  # lanes; one user always maps to the same lane
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', 1000))  # split evenly across lanes
+WEBHOOK_RETRY_AFTER = 5  # seconds suggested to Telegram when the queue is full
+
+## outgoing message rate limits (Telegram flood limits)
+SEND_GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 30))  # messages per second across all chats
+SEND_CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', 1))  # messages per second to a single chat...
+SEND_CHAT_BURST = 3  # ...after a short burst
+SEND_QUEUE_SIZE = 10000  # background messages beyond this are dropped
+SEND_QUEUE_INTERACTIVE_SIZE = 20000  # replies beyond this are dropped too
+SEND_MAX_RETRIES = 3  # retries after a 429 "retry after"
+
+## admin API
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN', '')  # sent as X-Admin-Token; admin routes are disabled when empty
+
+## broadcasts
+BROADCAST_BATCH_SIZE = 500
+# A worker sending a broadcast renews its lease on it; others take over once it expires
+BROADCAST_LEASE_SECONDS = 60
+
+## X (Twitter) verification
+# Pending user notifications; room for a full bulk moderation request
+NOTIFICATION_BUS_SIZE = 50000
+TWITTER_STATUS_CACHE_TTL = 300  # seconds; waiting users are renewed by every poll
+TWITTER_STATUS_POLL_INTERVAL = 5  # seconds between re-reads of waiting users, for decisions made elsewhere
+TWITTER_STATUS_POLL_CHUNK = 5000  # waiting users per query
+
+## moderation API
+MODERATION_PAGE_SIZE_MAX = 1000
+MODERATION_BATCH_MAX = 20000  # ids per bulk request
+MODERATION_UPDATE_CHUNK = 5000  # ids per UPDATE statement
+MODERATION_PUBLISH_TIMEOUT = 30  # seconds a bulk request waits for room on the notification bus
+
+## conversation state persistence
+# 'sql' (shared by all workers), 'file' (single process) or '' (memory only).
+# 'sql' needs the bot_state table (python -m lib.schema) and reads a user's
+# state from the database once per PERSISTENCE_CACHE_TTL while they are active.
+PERSISTENCE_BACKEND = os.environ.get('PERSISTENCE_BACKEND', '')
+PERSISTENCE_FILE = os.environ.get('PERSISTENCE_FILE', 'bot_state.pickle')
+# Seconds a cached state is trusted; this worker's own writes update it, so this
+# only bounds how long a change made by another worker can go unseen
+PERSISTENCE_CACHE_TTL = 60.0
+PERSISTENCE_FLUSH_INTERVAL = 0.2  # seconds between write-behind flushes
+
+## user profile cache (start, /info)
+USER_CACHE_SIZE = 50000  # profiles; see memory_bytes on /health to size it
+USER_CACHE_TTL = 60  # seconds, for writes made by other workers
+
+## wallets
+WALLET_INDEX_CHUNK = 5000  # rows per query when (re)loading and re-validating stored wallets
+
+## payout export
+PAYOUT_REFERRAL_REWARD = 0  # tokens per referral, added to the user's balance
+PAYOUT_TASK_REWARD = 0  # tokens per approved task
+PAYOUT_CHUNK_SIZE = 1000  # users fetched, priced and written at a time
+PAYOUT_TASK_WORKERS = 8  # parallel task backend requests per chunk
+PAYOUT_EXPORT_DIR = os.environ.get('PAYOUT_EXPORT_DIR', 'exports')
+
+## referral leaderboard
+LEADERBOARD_SIZE = 100  # referrers kept ranked (and the /api/leaderboard limit)
+LEADERBOARD_SHOWN = 10  # entries shown by /leaderboard
+REFERRAL_INDEX_CHUNK = 5000
+REFERRAL_INDEX_RELOAD = 600  # seconds between rebuilds, for referrals made in other workers
 
+## sybil detection
+SYBIL_FLAG_THRESHOLD = 0.7  # combined score at which a user is flagged
+SYBIL_BURST_ID_GAP = 100000  # telegram ids this close count as created together
+SYBIL_BURST_MIN = 5  # accounts of one referrer created together before it counts as a burst
+SYBIL_FANOUT_MIN = 50  # referrals before a referrer's users get the fan-out signal
+SYBIL_CHUNK_SIZE = 10000  # rows per fetch / insert
+SYBIL_INCREMENTAL_INTERVAL = 120  # seconds between rescoring groups with new users
 
+## task submissions
+SUBMISSION_INDEX_CHUNK = 5000  # proofs per fetch when loading the duplicate index
+SUBMISSION_STATUS_CACHE_SIZE = 50000  # users whose task statuses are kept for /tasks
+SUBMISSION_STATUS_CACHE_TTL = 300  # seconds before re-reading the backend, for decisions made elsewhere
 
+## logging
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' (one object per line) or 'text'
+LOG_FILE = os.environ.get('LOG_FILE', '')  # also write to this rotating file; stdout only when empty
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))  # share of DEBUG records kept
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer thread before new ones are dropped
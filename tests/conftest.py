@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Test setup: an in-memory SQLite database and no real Telegram or task API.
+
+Environment variables are set before settings.py is imported, since it
+reads them at import time.
+"""
+
+import os
+import sys
+
+os.environ.update(
+    DATABASE_URL='sqlite://',
+    PERSISTENCE_BACKEND='',
+    TELEGRAM_TOKEN='123456:test',
+    TELEGRAM_API_URL='http://telegram.test',
+    TASKS_API_URL='http://tasks.test/api',
+    LOG_FILE='',
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
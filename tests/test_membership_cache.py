@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import lib.membership_cache as membership_cache
+from lib.membership_cache import MembershipCache
+from lib.membership_client import MembershipClient
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(membership_cache, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_positive_results_expire_after_positive_ttl(clock):
+    cache = MembershipCache(positive_ttl=600, negative_ttl=5)
+    cache.set(1, 'group', True)
+    clock[0] += 599
+    assert cache.get(1, 'group') is True
+    clock[0] += 1
+    assert cache.get(1, 'group') is None
+
+
+def test_negative_ttl_doubles_while_negative_up_to_the_maximum(clock):
+    cache = MembershipCache(negative_ttl=5, negative_max_ttl=20)
+    for ttl in (5, 10, 20, 20):
+        cache.set(1, 'group', False)
+        clock[0] += ttl - 1
+        assert cache.get(1, 'group') is False
+        clock[0] += 1
+        assert cache.get(1, 'group') is None
+
+
+def test_positive_result_resets_the_negative_streak(clock):
+    cache = MembershipCache(negative_ttl=5, negative_max_ttl=20)
+    cache.set(1, 'group', False)
+    cache.set(1, 'group', False)
+    cache.set(1, 'group', True)
+    cache.set(1, 'group', False)
+    clock[0] += 5
+    assert cache.get(1, 'group') is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = MembershipCache(max_size=2)
+    cache.set(1, 'group', True)
+    cache.set(2, 'group', True)
+    cache.get(1, 'group')
+    cache.set(3, 'group', True)
+    assert cache.get(2, 'group') is None
+    assert cache.get(1, 'group') is True
+    assert cache.stats()['evictions'] == 1
+
+
+def test_begin_coalesces_checks_for_one_user():
+    cache = MembershipCache()
+    future, owner = cache.begin(1)
+    other, other_owner = cache.begin(1)
+    assert (owner, other_owner) == (True, False)
+    assert other is future
+    cache.finish(1, True)
+    assert other.result(timeout=1) is True
+    # The next check starts afresh
+    assert cache.begin(1)[1] is True
+
+
+class FakeClient(MembershipClient):
+    """getChatMember answered from ``statuses`` after ``delay`` seconds, counting calls"""
+
+    def __init__(self, statuses, delay=0.0, **kwargs):
+        super().__init__('123456:test', list(statuses), api_url='http://telegram.test', **kwargs)
+        self.statuses = statuses
+        self.delay = delay
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def get_chat_member_status(self, user_id, group):
+        with self._calls_lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.statuses[group]
+
+
+def test_client_coalesces_concurrent_checks_and_caches_them():
+    client = FakeClient({'one': 'member', 'two': 'administrator'}, delay=0.1, cache=MembershipCache())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.is_member(1))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 5
+    assert client.calls == 2
+    assert client.cache.stats()['coalesced'] == 4
+
+    assert client.is_member(1) is True
+    assert client.calls == 2
+
+
+def test_client_caches_negative_answers():
+    client = FakeClient({'one': 'left'}, cache=MembershipCache())
+    assert client.is_member(1) is False
+    assert client.is_member(1) is False
+    assert client.calls == 1
+
+
+def test_client_does_not_cache_api_errors():
+    client = FakeClient({'one': None}, cache=MembershipCache())
+    assert client.is_member(1) is False
+    assert client.is_member(1) is False
+    assert client.calls == 2
+
+
+def test_interactive_checks_do_not_queue_behind_a_batch():
+    client = FakeClient({'one': 'member'}, delay=0.2, max_workers=1, interactive_workers=1)
+    batch = threading.Thread(target=client.check_batch, args=(list(range(2, 12)),))
+    batch.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    assert client.is_member(1) is True
+    # The batch alone takes 10 * 0.2 seconds on its single worker
+    assert time.monotonic() - started < 1.0
+    batch.join()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from lib.send_queue import BACKGROUND, INTERACTIVE, SendQueue, SendQueueFull
+
+
+def results(futures, timeout=5):
+    return [future.result(timeout=timeout) for future in futures]
+
+
+def fast_queue(**kwargs):
+    options = dict(global_rate=10000, chat_rate=10000, chat_burst=10000, workers=8)
+    options.update(kwargs)
+    return SendQueue(**options)
+
+
+def test_messages_to_one_chat_are_sent_one_at_a_time_in_order():
+    queue = fast_queue()
+    sent = []
+    active = []
+
+    def send(i):
+        active.append(i)
+        assert len(active) == 1, 'two calls to one chat in flight'
+        time.sleep(0.005)
+        sent.append(i)
+        active.remove(i)
+        return i
+
+    futures = [queue.submit(7, send, (i,)) for i in range(20)]
+    assert results(futures) == list(range(20))
+    assert sent == list(range(20))
+
+
+def test_chats_are_sent_in_parallel():
+    queue = fast_queue()
+    started = time.monotonic()
+    results([queue.submit(chat_id, time.sleep, (0.1,)) for chat_id in range(8)])
+    assert time.monotonic() - started < 0.5
+
+
+def test_retry_after_keeps_the_call_at_its_chats_head():
+    queue = fast_queue()
+    sent = []
+    attempts = []
+
+    def send(i):
+        attempts.append(i)
+        if i == 0 and attempts.count(0) == 1:
+            raise RetryAfter(0)
+        sent.append(i)
+
+    results([queue.submit(1, send, (i,)) for i in range(3)])
+    assert sent == [0, 1, 2]
+    assert queue.stats()['retried'] == 1
+
+
+def test_gives_up_after_max_retries():
+    queue = fast_queue(max_retries=2)
+
+    def send():
+        raise RetryAfter(0)
+
+    future = queue.submit(1, send)
+    with pytest.raises(RetryAfter):
+        future.result(timeout=5)
+    assert queue.stats()['failed'] == 1
+    # The chat is not blocked by the failed call
+    assert queue.submit(1, lambda: 'ok').result(timeout=5) == 'ok'
+
+
+def test_global_rate_limit():
+    queue = fast_queue(global_rate=20)
+    started = time.monotonic()
+    # The bucket starts full (20 tokens), the other 10 take 0.5s
+    results([queue.submit(chat_id, lambda: None) for chat_id in range(30)])
+    assert time.monotonic() - started >= 0.45
+
+
+def test_chat_rate_limit():
+    queue = fast_queue(chat_rate=10, chat_burst=1)
+    started = time.monotonic()
+    results([queue.submit(1, lambda: None) for _ in range(5)])
+    assert time.monotonic() - started >= 0.35
+
+
+def test_interactive_replies_go_before_background_messages():
+    queue = fast_queue(global_rate=20)
+    queue.start()
+    order = []
+    with queue._cond:
+        queue.global_bucket.tokens = 0
+        background = queue.submit(1, order.append, ('background',), priority=BACKGROUND)
+        interactive = queue.submit(2, order.append, ('interactive',), priority=INTERACTIVE)
+    results([background, interactive])
+    assert order == ['interactive', 'background']
+
+
+def test_queue_bounds():
+    queue = fast_queue(max_size=2, max_interactive_size=4)
+    release = threading.Event()
+    head = queue.submit(1, release.wait, (5,))
+    while queue.stats()['inflight'] != 1:
+        time.sleep(0.001)
+
+    waiting = [queue.submit(1, lambda: None, priority=BACKGROUND) for _ in range(2)]
+    dropped = queue.submit(1, lambda: None, priority=BACKGROUND)
+    with pytest.raises(SendQueueFull):
+        dropped.result(timeout=1)
+
+    # Interactive replies have room of their own
+    waiting += [queue.submit(1, lambda: None) for _ in range(2)]
+    with pytest.raises(SendQueueFull):
+        queue.submit(1, lambda: None).result(timeout=1)
+    assert len(queue) == 4
+
+    release.set()
+    results([head] + waiting)
+    assert queue.stats()['dropped'] == 2
+    assert len(queue) == 0
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from lib.solana import ALPHABET, WalletIndex, b58decode, is_valid_address
+
+
+def b58encode(data):
+    number = int.from_bytes(data, 'big')
+    text = ''
+    while number:
+        number, digit = divmod(number, 58)
+        text = ALPHABET[digit] + text
+    return '1' * (len(data) - len(data.lstrip(b'\0'))) + text
+
+
+@pytest.mark.parametrize('data', [
+    os.urandom(32),
+    b'\0' * 32,
+    b'\0\0\0' + os.urandom(29),
+    b'\xff' * 32,
+])
+def test_b58decode_round_trips(data):
+    assert b58decode(b58encode(data)) == data
+
+
+def test_b58decode_rejects_characters_outside_the_alphabet():
+    for char in '0OIl+/é':
+        with pytest.raises(ValueError):
+            b58decode('abc' + char)
+
+
+@pytest.mark.parametrize('address', [
+    '11111111111111111111111111111111',
+    'TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA',
+    '4Nd1mBQtrMJVYVfKf2PJy9NZUZdTAsp7D4xWLs4gDB4T',
+])
+def test_valid_addresses(address):
+    assert is_valid_address(address)
+
+
+def test_random_public_keys_are_valid():
+    for _ in range(100):
+        assert is_valid_address(b58encode(os.urandom(32)))
+
+
+@pytest.mark.parametrize('address', [
+    None,
+    '',
+    '1111111111111111111111111111111',                 # 31 characters
+    b58encode(b'\1' + os.urandom(30)),                 # 31 bytes in 41-43 characters
+    b58encode(b'\1' + os.urandom(32)),                 # 33 bytes
+    '4Nd1mBQtrMJVYVfKf2PJy9NZUZdTAsp7D4xWLs4gDB40',    # '0' is not base58
+    'TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA ',
+    '0x52908400098527886E0F7030069857D2E4169EE7',
+    'A' * 45,
+    'A' * 10000,
+])
+def test_invalid_addresses(address):
+    assert not is_valid_address(address)
+
+
+def test_wallet_index_rejects_a_wallet_of_another_account():
+    index = WalletIndex()
+    wallet = b58encode(os.urandom(32))
+    assert index.claim(wallet, 1) is None
+    assert index.claim(wallet, 1) is None
+    assert index.claim(wallet, 2) == 1
+    assert index.stats()['duplicates_rejected'] == 1
+
+
+def test_wallet_index_releases_a_replaced_wallet():
+    index = WalletIndex()
+    first, second = b58encode(os.urandom(32)), b58encode(os.urandom(32))
+    index.claim(first, 1)
+    index.claim(second, 1)
+    assert index.claim(first, 2) is None
+
+
+def test_wallet_index_release_undoes_a_claim():
+    index = WalletIndex()
+    wallet = b58encode(os.urandom(32))
+    index.claim(wallet, 1)
+    index.release(wallet, 1)
+    assert index.owner(wallet) is None
+    assert index.claim(wallet, 2) is None
+
+
+def test_wallet_index_release_restores_the_previous_wallet():
+    index = WalletIndex()
+    first, second = b58encode(os.urandom(32)), b58encode(os.urandom(32))
+    index.claim(first, 1)
+    index.claim(second, 1)
+    index.release(second, 1)
+    assert index.owner(first) == 1
+    assert index.owner(second) is None
+    assert index.claim(first, 2) == 1
+
+
+def test_wallet_index_release_keeps_a_wallet_claimed_again():
+    index = WalletIndex()
+    wallet = b58encode(os.urandom(32))
+    index.claim(wallet, 1)
+    index.claim(wallet, 1)
+    index.release(wallet, 1)
+    assert index.owner(wallet) == 1
+
+
+def test_wallet_index_load_keeps_claims_made_during_the_scan():
+    index = WalletIndex()
+    stored, claimed, released = (b58encode(os.urandom(32)) for _ in range(3))
+
+    def scan(on_row):
+        on_row(1, stored)
+        # Made while the reload reads the table, after their rows were passed
+        index.claim(claimed, 2)
+        index.claim(released, 3)
+        index.release(released, 3)
+        return {'checked': 1, 'invalid': [], 'duplicates': {}}
+
+    index.scan = scan
+    index.load()
+    assert index.owner(stored) == 1
+    assert index.owner(claimed) == 2
+    assert index.owner(released) is None
+    assert index.claim(claimed, 4) == 2
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import lib.submissions as submissions
+from lib.db import engine
+from lib.submissions import SubmissionIndex, SubmissionRejected, normalize_proof
+
+
+@pytest.fixture
+def tables():
+    submissions.Base.metadata.create_all(engine)
+    yield
+    submissions.Base.metadata.drop_all(engine)
+
+
+@pytest.mark.parametrize('text', [
+    'https://twitter.com/SomeUser/status/1234567890',
+    'https://x.com/someone_else/status/1234567890?s=20',
+    'done! mobile.twitter.com/SomeUser/status/1234567890/',
+    'https://fxtwitter.com/i/web/status/1234567890',
+    'www.x.com/SomeUser/statuses/1234567890.',
+])
+def test_normalize_proof_x_status_links(text):
+    assert normalize_proof(text) == 'https://x.com/i/status/1234567890'
+
+
+def test_normalize_proof_drops_tracking_parameters():
+    assert normalize_proof('https://www.Example.com/post/?utm_source=tg&b=2&fbclid=x&a=1') == \
+        'https://example.com/post?a=1&b=2'
+
+
+def test_normalize_proof_x_profile_is_case_insensitive():
+    assert normalize_proof('https://twitter.com/SomeUser/') == 'https://x.com/someuser'
+
+
+def test_normalize_proof_plain_text():
+    assert normalize_proof('  Done\n  ALREADY ') == 'done already'
+    assert normalize_proof(None) == ''
+
+
+def test_claim_rejects_resubmission(tables):
+    index = SubmissionIndex()
+    proof = normalize_proof('https://x.com/a/status/1')
+    index.claim(1, proof, 100)
+    with pytest.raises(SubmissionRejected) as rejected:
+        index.claim(1, proof, 100)
+    assert (rejected.value.kind, rejected.value.owner_id) == ('resubmitted', 100)
+
+
+def test_claim_same_user_may_reuse_a_link_for_another_task(tables):
+    index = SubmissionIndex()
+    proof = normalize_proof('https://x.com/a/status/1')
+    index.claim(1, proof, 100)
+    index.claim(2, proof, 100)
+    assert index.stats()['proofs'] == 2
+
+
+def test_claim_rejects_link_used_by_another_account(tables):
+    index = SubmissionIndex()
+    index.claim(1, normalize_proof('https://twitter.com/a/status/1'), 100)
+    with pytest.raises(SubmissionRejected) as rejected:
+        index.claim(2, normalize_proof('https://x.com/b/status/1?s=20'), 200)
+    assert (rejected.value.kind, rejected.value.owner_id) == ('collision', 100)
+    assert index.stats()['collisions'] == 1
+
+
+def test_claim_text_proofs_do_not_collide_across_accounts(tables):
+    index = SubmissionIndex()
+    index.claim(1, normalize_proof('Done'), 100)
+    index.claim(1, normalize_proof('done'), 200)
+    with pytest.raises(SubmissionRejected) as rejected:
+        index.claim(1, normalize_proof('DONE'), 200)
+    assert rejected.value.kind == 'resubmitted'
+
+
+def test_claim_sees_proofs_claimed_by_another_worker(tables):
+    first, second = SubmissionIndex(), SubmissionIndex()
+    proof = normalize_proof('https://x.com/a/status/1')
+    first.claim(1, proof, 100)
+    with pytest.raises(SubmissionRejected) as rejected:
+        second.claim(1, proof, 200)
+    assert (rejected.value.kind, rejected.value.owner_id) == ('collision', 100)
+    # The other worker's owner is adopted
+    with pytest.raises(SubmissionRejected):
+        second.claim(2, proof, 300)
+
+
+def test_claim_is_undone_when_storing_fails(tables, monkeypatch):
+    index = SubmissionIndex()
+    proof = normalize_proof('https://x.com/a/status/1')
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(submissions, 'insert_if_missing', fail)
+    with pytest.raises(RuntimeError):
+        index.claim(1, proof, 100)
+    assert index.stats()['proofs'] == 0
+
+    monkeypatch.undo()
+    index.claim(1, proof, 100)
+
+
+def test_release_frees_the_proof(tables):
+    index = SubmissionIndex()
+    proof = normalize_proof('https://x.com/a/status/1')
+    index.claim(1, proof, 100)
+    index.release(1, proof, 100)
+    index.claim(1, proof, 200)
+
+
+def test_load_rebuilds_from_the_database(tables):
+    proof = normalize_proof('https://x.com/a/status/1')
+    SubmissionIndex().claim(1, proof, 100)
+    index = SubmissionIndex()
+    assert index.load() == 1
+    with pytest.raises(SubmissionRejected) as rejected:
+        index.claim(1, proof, 100)
+    assert rejected.value.kind == 'resubmitted'
+
+
+def test_load_keeps_claims_made_during_the_read(tables):
+    index = SubmissionIndex()
+    stored, claimed, released = (normalize_proof(f'https://x.com/a/status/{n}') for n in range(3))
+    index.claim(1, stored, 100)
+    read = index._read
+
+    def racing_read():
+        result = read()
+        # Made while the reload reads the table, after their rows were passed
+        index.claim(1, claimed, 200)
+        index.claim(1, released, 300)
+        index.release(1, released, 300)
+        return result
+
+    index._read = racing_read
+    index.load()
+    for proof, owner in ((stored, 100), (claimed, 200)):
+        with pytest.raises(SubmissionRejected) as rejected:
+            index.claim(1, proof, 400)
+        assert rejected.value.owner_id == owner
+    index.claim(1, released, 400)
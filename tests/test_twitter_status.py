@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import lib.twitter_status as twitter_status
+from lib.db import engine, session_scope
+from lib.twitter_status import TwitterStatusCache, claim_notice, clear_notice, reserve_notices
+
+
+@pytest.fixture
+def tables():
+    twitter_status.Base.metadata.create_all(engine)
+    yield
+    twitter_status.Base.metadata.drop_all(engine)
+
+
+def test_cache_waiting_lists_pending_users_only():
+    cache = TwitterStatusCache()
+    cache.set(1, 'pending')
+    cache.set(2, 'approved')
+    cache.set(3, 'rejected')
+    assert cache.waiting() == [1]
+
+
+def test_cache_renew_skips_entries_that_changed():
+    cache = TwitterStatusCache(ttl=0)
+    cache.set(1, 'pending')
+    cache.set(2, 'pending')
+    assert cache.get(1) is None
+    cache.ttl = 60
+    cache.set(2, 'approved')
+    cache.renew([1, 2], 'pending')
+    assert cache.get(1) == 'pending'
+    assert cache.get(2) == 'approved'
+
+
+def test_claim_notice_announces_a_decision_once(tables):
+    assert claim_notice(1, 'approved')
+    assert not claim_notice(1, 'approved')
+
+
+def test_reserved_notices_are_not_claimed_again(tables):
+    with session_scope() as db:
+        reserve_notices(db, [1, 2], 'rejected')
+    assert not claim_notice(1, 'rejected')
+    assert claim_notice(2, 'approved')
+
+
+def test_cleared_notice_announces_the_same_decision_again(tables):
+    assert claim_notice(1, 'rejected')
+    with session_scope() as db:
+        clear_notice(db, 1)
+    assert claim_notice(1, 'rejected')
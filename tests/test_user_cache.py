@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import threading
+from types import SimpleNamespace
+
+import lib.user_cache as user_cache
+from lib.user_cache import UserProfileCache
+
+
+class Loader(object):
+    """load_profile for the cache; loads of users in ``gates`` wait until their gate is set"""
+
+    def __init__(self):
+        self.gates = {}
+        self.started = {}
+        self.calls = 0
+        self.step = 1
+
+    def gate(self, telegram_id):
+        self.gates[telegram_id] = threading.Event()
+        self.started[telegram_id] = threading.Event()
+        return self.gates[telegram_id]
+
+    def __call__(self, telegram_id):
+        self.calls += 1
+        step = self.step
+        if telegram_id in self.started:
+            self.started[telegram_id].set()
+        if telegram_id in self.gates:
+            self.gates[telegram_id].wait(5)
+        if telegram_id < 0:
+            raise LookupError('not registered')
+        return {'telegram_id': telegram_id, 'username': f'user{telegram_id}', 'registration_step': step}
+
+
+def make_cache(loader, **kwargs):
+    return UserProfileCache(loader, lambda telegram_id: f'summary of {telegram_id}', **kwargs)
+
+
+def in_background(cache, telegram_id):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('profile', cache.get(telegram_id)))
+    thread.start()
+    return thread, result
+
+
+def test_profiles_are_cached_until_invalidated():
+    loader = Loader()
+    cache = make_cache(loader)
+    assert cache.get(1).username == 'user1'
+    assert cache.get(1).username == 'user1'
+    assert loader.calls == 1
+    cache.invalidate(1)
+    cache.get(1)
+    assert loader.calls == 2
+
+
+def test_unknown_users_are_not_cached():
+    loader = Loader()
+    cache = make_cache(loader)
+    assert cache.get(-1) is None
+    assert cache.get(-1) is None
+    assert loader.calls == 2
+    assert len(cache._loads) == 0
+
+
+def test_profiles_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_cache, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    loader = Loader()
+    cache = make_cache(loader, ttl=60)
+    cache.get(1)
+    now[0] += 59
+    cache.get(1)
+    now[0] += 1
+    cache.get(1)
+    assert loader.calls == 2
+
+
+def test_load_racing_with_a_write_is_not_cached():
+    loader = Loader()
+    cache = make_cache(loader)
+    gate = loader.gate(1)
+    thread, result = in_background(cache, 1)
+    loader.started[1].wait(5)
+    cache.invalidate(1)
+    gate.set()
+    thread.join()
+    assert result['profile'].username == 'user1'
+
+    cache.get(1)
+    assert loader.calls == 2
+    assert len(cache._loads) == 0
+
+
+def test_write_to_another_user_does_not_discard_a_load():
+    loader = Loader()
+    cache = make_cache(loader)
+    gate = loader.gate(1)
+    thread, _ = in_background(cache, 1)
+    loader.started[1].wait(5)
+    cache.invalidate(2)
+    gate.set()
+    thread.join()
+
+    cache.get(1)
+    assert loader.calls == 1
+
+
+def test_stale_load_does_not_replace_a_fresh_one():
+    loader = Loader()
+    cache = make_cache(loader)
+    gate = loader.gate(1)
+    stale_thread, _ = in_background(cache, 1)
+    loader.started[1].wait(5)
+
+    # The row is written, then loaded again while the first load is still running
+    loader.step = 2
+    cache.invalidate(1)
+    del loader.gates[1]
+    assert cache.get(1).registration_step == 2
+    gate.set()
+    stale_thread.join()
+
+    assert cache.get(1).registration_step == 2
+    assert loader.calls == 2
+    assert len(cache._loads) == 0
+
+
+def test_summary_is_kept_with_the_profile():
+    loader = Loader()
+    cache = make_cache(loader)
+    assert cache.summary(1) == 'summary of 1'
+    assert cache.get(1).summary == 'summary of 1'
+    cache.invalidate(1)
+    assert cache.get(1).summary is None
+
+
+def test_least_recently_used_profiles_are_evicted():
+    loader = Loader()
+    cache = make_cache(loader, max_size=2)
+    cache.get(1)
+    cache.get(2)
+    cache.get(1)
+    cache.get(3)
+    assert cache.stats()['evictions'] == 1
+    calls = loader.calls
+    cache.get(1)
+    assert loader.calls == calls
+    cache.get(2)
+    assert loader.calls == calls + 1
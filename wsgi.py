@@ -17,6 +17,10 @@ sys.path.insert(0, str(project_dir))
 if not os.environ.get('FLASK_ENV'):
     os.environ['FLASK_ENV'] = 'production'
 
+# Application logs also go to a rotating file, written off the request threads (see lib/log.py)
+if not os.environ.get('LOG_FILE'):
+    os.environ['LOG_FILE'] = str(project_dir / 'logs' / 'airdropbot.log')
+
 try:
     # Import the Flask application from app.py
     from app import app
@@ -35,28 +39,8 @@ except ImportError as e:
     def index():
         return {'message': 'AirdropBot V2 is running', 'status': 'active'}, 200
 
-# Configure logging for production
-import logging
-from logging.handlers import RotatingFileHandler
-
+# Logging (stdout and LOG_FILE, through a queue) is configured by app.py
 if not app.debug:
-    # Create logs directory if it doesn't exist
-    logs_dir = project_dir / 'logs'
-    logs_dir.mkdir(exist_ok=True)
-    
-    # Set up file handler for application logs
-    file_handler = RotatingFileHandler(
-        logs_dir / 'airdropbot.log',
-        maxBytes=10240000,  # 10MB
-        backupCount=10
-    )
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    
-    app.logger.setLevel(logging.INFO)
     app.logger.info('AirdropBot V2 startup')
 
 # Application factory pattern (optional)